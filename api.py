@@ -0,0 +1,165 @@
+# api.py
+# JSON API（/api/v1）：給手機 App / 內部報表用，不用再爬 HTML。
+# 和網頁共用 queries.py 的查詢；看登入的 session 決定看得到什麼（訪客只看得到投放中），
+# 結案檔案只給案主 / 得標者（和下載一樣，見 downloads.can_download），其他人拿到空的 / 403。
+# 全部唯讀，有設複本就從複本讀（db.get_read_db）。
+# 每個端點都支援 ?fields=a,b,c 只回需要的欄位；有裝 orjson 就用 orjson 輸出。
+# 端點直接回傳 APIResponse：回傳 dict 的話 FastAPI 會先用 jsonable_encoder（純 Python）整個走過一遍，
+# 每筆報價 / 檔案都要轉一次，orjson 再快也省不到多少；datetime 交給 orjson 自己處理。
+from dataclasses import asdict
+
+import psycopg
+from fastapi import APIRouter, Depends, HTTPException, Request
+
+from db import get_read_db
+from deps import current_user
+from downloads import can_download
+from queries import list_projects, parse_cursor, load_project_detail, PAGE_SIZE, BID_PAGE_SIZE
+
+try:  # orjson 比內建 json 快很多，也直接支援 datetime
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as APIResponse
+except ImportError:
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    class APIResponse(JSONResponse):
+        # 內建 json 不認得 datetime，沒有 orjson 時才走 jsonable_encoder
+        def render(self, content):
+            return super().render(jsonable_encoder(content))
+
+router = APIRouter(prefix="/api/v1", default_response_class=APIResponse)
+
+# 各種資料可以選的欄位
+LIST_FIELDS = ("id", "title", "status", "created_at", "description",
+               "bid_count", "delivery_count", "has_bid", "my_delivery_count")
+PROJECT_FIELDS = ("id", "title", "description", "status", "created_at", "budget",
+                  "client_name", "client_id", "awarded_bid_id", "awarded_freelancer_id",
+                  "bid_summary", "bids", "deliveries")
+BID_FIELDS = ("id", "price", "message", "created_at", "freelancer")
+DELIVERY_FIELDS = ("id", "filename", "url", "thumb_url", "note", "created_at", "freelancer")
+
+# 沒指定 fields 時的預設（專案詳細預設不帶報價摘要 / 報價 / 檔案，要的話 fields 加上 bid_summary、bids、deliveries）
+DEFAULT_PROJECT_FIELDS = PROJECT_FIELDS[:-3]
+
+
+def parse_fields(request, allowed, default=None):
+    """?fields=id,title -> ("id", "title")；有不認得的欄位回 400"""
+    raw = request.query_params.get("fields")
+    if not raw:
+        return default or allowed
+    fields = tuple(dict.fromkeys(f.strip() for f in raw.split(",") if f.strip()))
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise HTTPException(400, {"error": "unknown_fields", "fields": unknown, "allowed": list(allowed)})
+    return fields
+
+
+def pick(row, fields):
+    # 只留要的欄位；這一頁沒有的欄位（例如訪客沒有 bid_count）就不放
+    return {f: row[f] for f in fields if f in row}
+
+
+def bid_dict(b):
+    return asdict(b)
+
+
+def delivery_dict(d):
+    return {
+        "id": d.id,
+        "filename": d.filename,
+        "url": f"/deliveries/{d.id}/download",  # 需要登入且是案主 / 得標者
+        # 圖片縮圖做好才有；還沒好是 null
+        "thumb_url": f"/deliveries/{d.id}/preview/thumb" if d.preview_status == "ready" else None,
+        "note": d.note,
+        "created_at": d.created_at,
+        "freelancer": d.freelancer,
+    }
+
+
+def _int_param(request, name, default):
+    try:
+        return int(request.query_params.get(name, default))
+    except ValueError:
+        return default
+
+
+async def _detail(conn, project_id, user, **bid_page):
+    detail = await load_project_detail(conn, project_id, user, **bid_page)
+    if detail is None:
+        raise HTTPException(404, {"error": "not_found"})
+    return detail
+
+
+def _can_see_deliveries(user, project):
+    return can_download(user, {"client_id": project.client_id,
+                               "awarded_freelancer_id": project.awarded_freelancer_id})
+
+
+# ----------------
+# 專案列表（和首頁一樣的分頁籤與游標分頁）
+# ----------------
+@router.get("/projects")
+async def api_projects(request: Request, conn: psycopg.AsyncConnection = Depends(get_read_db)):
+    user = current_user(request)
+    fields = parse_fields(request, LIST_FIELDS)
+    tab = request.query_params.get("tab", "open")
+    cursor, direction = parse_cursor(request)
+    limit = _int_param(request, "limit", PAGE_SIZE)
+
+    rows, next_cursor, prev_cursor = await list_projects(conn, user, tab, cursor, direction, limit)
+    return APIResponse({
+        "items": [pick(r, fields) for r in rows],
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+    })
+
+
+# ----------------
+# 專案詳細 / 報價 / 結案檔案（一次查詢，見 queries.load_project_detail）
+# ----------------
+@router.get("/projects/{project_id}")
+async def api_project_detail(request: Request, project_id: int,
+                             conn: psycopg.AsyncConnection = Depends(get_read_db)):
+    user = current_user(request)
+    fields = parse_fields(request, PROJECT_FIELDS, DEFAULT_PROJECT_FIELDS)
+    detail = await _detail(conn, project_id, user)
+
+    row = asdict(detail.project)
+    if "bid_summary" in fields:
+        row["bid_summary"] = asdict(detail.bid_summary) if detail.bid_summary else None  # 只有案主有
+    if "bids" in fields:  # 第一頁（價格低到高）；要翻頁用 /projects/{id}/bids
+        row["bids"] = [bid_dict(b) for b in detail.bids]
+    if "deliveries" in fields:  # 不是案主 / 得標者就是空的
+        row["deliveries"] = ([delivery_dict(d) for d in detail.deliveries]
+                             if _can_see_deliveries(user, detail.project) else [])
+    return APIResponse(pick(row, fields))
+
+
+@router.get("/projects/{project_id}/bids")
+async def api_project_bids(request: Request, project_id: int,
+                           conn: psycopg.AsyncConnection = Depends(get_read_db)):
+    # 看得到哪些報價和網頁一樣：案主看全部、接案人只看自己的、訪客看不到
+    # ?sort=price|price_desc|newest|oldest&cursor=...&limit=20，下一頁用回傳的 next_cursor
+    fields = parse_fields(request, BID_FIELDS)
+    detail = await _detail(conn, project_id, current_user(request),
+                           bid_sort=request.query_params.get("sort", "price"),
+                           bid_cursor=request.query_params.get("cursor"),
+                           bid_limit=_int_param(request, "limit", BID_PAGE_SIZE))
+    return APIResponse({
+        "items": [pick(bid_dict(b), fields) for b in detail.bids],
+        "sort": detail.bid_sort,
+        "next_cursor": detail.bid_next_cursor,
+    })
+
+
+@router.get("/projects/{project_id}/deliveries")
+async def api_project_deliveries(request: Request, project_id: int,
+                                 conn: psycopg.AsyncConnection = Depends(get_read_db)):
+    # 和下載一樣只給案主 / 得標者，其他人（含訪客）403
+    user = current_user(request)
+    fields = parse_fields(request, DELIVERY_FIELDS)
+    detail = await _detail(conn, project_id, user)
+    if not _can_see_deliveries(user, detail.project):
+        raise HTTPException(403, {"error": "forbidden"})
+    return APIResponse({"items": [pick(delivery_dict(d), fields) for d in detail.deliveries]})
@@ -1,191 +1,141 @@
-# 小工具：取目前登入者（同步）
-from fastapi import Request
-
-def current_user(request: Request):
-    return request.session.get("user")  # {id, username, role} 或 None
-
 # === app.py ===
 from typing import Optional
 from pathlib import Path
+from contextlib import asynccontextmanager
 import re 
+from urllib.parse import urlencode
 
-from fastapi import FastAPI, Request, Form, UploadFile, File
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Request, Form, UploadFile, File, Depends
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse
 from starlette.middleware.sessions import SessionMiddleware  
-from db import get_conn
+import db
+from deps import current_user
+from db import get_db, get_read_db, open_async_pool, close_async_pool, pool_stats
+from queries import list_projects, parse_cursor, load_project_detail
+from counters import dashboard_stats
+from search import parse_search, search_projects
+from storage import save_upload, UploadTooLarge, add_ref, release
+import cache
+from cache import LIST_TAG, project_tag
+import api
+import assets
+import downloads
+import previews
+import jobs
+import metrics
+import transitions
+import events
+import ratelimit
+from passwords import (HashBusy, hash_password, verify_password, rehash_later,
+                       start_hasher, stop_hasher, hasher_stats)
 import psycopg 
 
 # --- 初始化 ---
-try:  # 雜湊函式載入
-    from passlib.hash import bcrypt, pbkdf2_sha256
-    HAS_BCRYPT = True
-except Exception:
-    HAS_BCRYPT = False
-
 BASE_DIR = Path(__file__).resolve().parent  # 取得資料夾所在的實體路徑
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    assets.build()            # 靜態檔案加指紋、預先壓縮（內容沒變就不重做）
+    warm_templates()          # 先載入所有模板（有編譯快取就不用重新編譯）
+    await open_async_pool()   # 啟動時先建好 DB 連線池
+    await start_hasher()      # 密碼雜湊用的行程池
+    await previews.start_previews()  # 圖片縮圖的背景行程池（順便補做上次沒做完的）
+    await events.start_listener()    # LISTEN 即時事件（每個 worker 一條連線）
+    yield
+    await events.stop_listener()
+    await previews.stop_previews()
+    await stop_hasher()
+    await close_async_pool()  # 關閉時歸還所有連線
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(db.PrimaryPinMiddleware)  # 寫入後幾秒內讀主庫（要在 SessionMiddleware 裡面）
+app.add_middleware(ratelimit.RateLimitMiddleware, router_app=app)  # 登入 / 註冊 / 報價 / 上傳限流、忙碌時卸載
 app.add_middleware(SessionMiddleware, secret_key="change-me")  # 讓 request.session 可用，secret_key 用來加密/簽章 session cookie
+app.add_middleware(metrics.MetricsMiddleware, router_app=app)  # 每個路由的延遲 / 狀態碼（最外層，整個 request 都算進去）
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))  # 指定模板資料夾 之後回傳(reutrn)頁面會用
-app.mount("/www", StaticFiles(directory=str(BASE_DIR / "www")), name="www")  # 靜態檔案掛載
+templates.env.globals["asset_url"] = assets.asset_url  # 模板裡用 {{ asset_url('style.css') }}
+# 模板編譯結果存在 .jinja_cache/（依模板內容的雜湊，改了模板會自動重編），重開或多開 worker 不用每個都重新編譯
+TEMPLATE_CACHE_DIR = BASE_DIR / ".jinja_cache"
+TEMPLATE_CACHE_DIR.mkdir(exist_ok=True)
+templates.env.bytecode_cache = FileSystemBytecodeCache(str(TEMPLATE_CACHE_DIR))
+
+
+def warm_templates():
+    for name in templates.env.list_templates(extensions=["html"]):
+        templates.env.get_template(name)
+
+
+def project_card(p, user, tab):
+    # 首頁的專案卡片：render 好的 HTML 依 (id, version, 角色, 分頁, 徽章用到的數字) 快取，大家共用
+    role = user["role"] if user else None
+    tab = tab if tab in ("open", "progress") else "closed"
+    badge = (p.get("bid_count"), p.get("has_bid"), p.get("delivery_count"), p.get("my_delivery_count"))
+    key = ("card", p["id"], p["version"], role, tab, badge)
+    return cache.fragment(key, lambda: Markup(
+        templates.env.get_template("_project_card.html").render(p=p, role=role, tab=tab)))
+
+
+templates.env.globals["project_card"] = project_card  # 模板裡用 {{ project_card(p, user, tab) }}
+app.mount("/www", assets.PublicStaticFiles(directory=str(BASE_DIR / "www")), name="www")  # 靜態檔案掛載（uploads/ 不公開）
+app.include_router(api.router)  # JSON API：/api/v1/...
+app.include_router(assets.router)  # 帶指紋的靜態檔案：/static/...
+app.include_router(downloads.router)  # 結案檔案下載（需權限）
+app.include_router(events.router)  # 即時更新：/events（SSE）
 
 # --------------------------------
 # 首頁：專案列表
 # --------------------------------
 @app.get("/", response_class=HTMLResponse)  # 宣告首頁路由
-def projects_list(request: Request):
+async def projects_list(request: Request):
     user = current_user(request)  # 讀 session 取得目前登入者
     tab = request.query_params.get("tab", "open")  # 讀網址列參數，預設是 "open"
-    stats = {"open": 0, "progress": 0, "closed": 0}  # 統計數字
-    projects = []  # 先給空清單，等下依角色查 DB 填資料
-
-    with get_conn() as conn, conn.cursor() as cur:  # 開 DB 連線
-
-        # 未登入（訪客）：僅顯示投放中
-        if not user:
-            cur.execute(""" 
-                SELECT p.id, p.title, p.status, p.created_at,
-                       LEFT(p.description, 200) AS description
-                FROM projects p
-                WHERE p.status='open'
-                ORDER BY p.id DESC
-            """)
-            projects = [
-                {"id": a, "title": b, "status": c, "created_at": d, "description": e}
-                for (a, b, c, d, e) in cur.fetchall()  # 取出所有列
-            ]
-
-        # 委託人
-        elif user["role"] == "client":
-            # 數量統計
-            for k, cond in {
-                "open": "status='open'",
-                "progress": "status IN ('in_progress','reopened')",
-                "closed": "status='closed'",
-            }.items():
-                cur.execute(
-                    f"SELECT COUNT(*) FROM projects WHERE client_id=%s AND {cond}",
-                    (user["id"],),
-                )
-                stats[k] = cur.fetchone()[0]
-
-            # 清單
-            if tab == "open":  # 投放中
-                cur.execute("""
-                    SELECT p.id, p.title, p.status, p.created_at,
-                           LEFT(p.description, 200) AS description,
-                           (SELECT COUNT(*) FROM bids b WHERE b.project_id=p.id) AS bid_count
-                    FROM projects p
-                    WHERE p.client_id=%s AND p.status='open'
-                    ORDER BY p.id DESC
-                """, (user["id"],))
-                projects = [
-                    {"id": a, "title": b, "status": c, "created_at": d,
-                     "description": e, "bid_count": f}
-                    for (a, b, c, d, e, f) in cur.fetchall()
-                ]
-
-            elif tab == "progress":  # 進行中
-                cur.execute("""
-                    SELECT p.id, p.title, p.status, p.created_at,
-                           LEFT(p.description, 200) AS description,
-                           (SELECT COUNT(*) FROM deliveries d WHERE d.project_id=p.id) AS delivery_count
-                    FROM projects p
-                    WHERE p.client_id=%s AND p.status IN ('in_progress','reopened')
-                    ORDER BY p.id DESC
-                """, (user["id"],))
-                projects = [
-                    {"id": a, "title": b, "status": c, "created_at": d,
-                     "description": e, "delivery_count": f}
-                    for (a, b, c, d, e, f) in cur.fetchall()
-                ]
-
-            else:  # 已結案
-                cur.execute("""
-                    SELECT p.id, p.title, p.status, p.created_at,
-                           LEFT(p.description, 200) AS description
-                    FROM projects p
-                    WHERE p.client_id=%s AND p.status='closed'
-                    ORDER BY p.id DESC
-                """, (user["id"],))
-                projects = [
-                    {"id": a, "title": b, "status": c, "created_at": d, "description": e}
-                    for (a, b, c, d, e) in cur.fetchall()
-                ]
-
-        # 接案人
-        elif user["role"] == "freelancer":
-            # 數量統計
-            cur.execute("SELECT COUNT(*) FROM projects WHERE status='open'")
-            stats["open"] = cur.fetchone()[0]
-
-            cur.execute("""
-                SELECT COUNT(*) FROM projects p
-                JOIN bids b ON b.id = p.awarded_bid_id
-                WHERE b.freelancer_id=%s AND p.status IN ('in_progress','reopened')
-            """, (user["id"],))
-            stats["progress"] = cur.fetchone()[0]
-
-            cur.execute("""
-                SELECT COUNT(*) FROM projects p
-                JOIN bids b ON b.id = p.awarded_bid_id
-                WHERE b.freelancer_id=%s AND p.status='closed'
-            """, (user["id"],))
-            stats["closed"] = cur.fetchone()[0]
-
-            # 清單
-            if tab == "open":
-                cur.execute("""
-                    SELECT p.id, p.title, p.status, p.created_at,
-                           LEFT(p.description, 200) AS description,
-                           (SELECT COUNT(*) FROM bids b
-                            WHERE b.project_id=p.id AND b.freelancer_id=%s) AS has_bid
-                    FROM projects p
-                    WHERE p.status='open'
-                    ORDER BY p.id DESC
-                """, (user["id"],))
-                projects = [
-                    {"id": a, "title": b, "status": c, "created_at": d,
-                     "description": e, "has_bid": (f > 0)}
-                    for (a, b, c, d, e, f) in cur.fetchall()
-                ]
-
-            elif tab == "progress":
-                cur.execute("""
-                    SELECT p.id, p.title, p.status, p.created_at,
-                           LEFT(p.description, 200) AS description,
-                           (SELECT COUNT(*) FROM deliveries d
-                            WHERE d.project_id=p.id AND d.freelancer_id=%s) AS my_delivery_count
-                    FROM projects p
-                    JOIN bids b ON b.id = p.awarded_bid_id
-                    WHERE b.freelancer_id=%s AND p.status IN ('in_progress','reopened')
-                    ORDER BY p.id DESC
-                """, (user["id"], user["id"]))
-                projects = [
-                    {"id": a, "title": b, "status": c, "created_at": d,
-                     "description": e, "my_delivery_count": f}
-                    for (a, b, c, d, e, f) in cur.fetchall()
-                ]
-
-            else:  # closed
-                cur.execute("""
-                    SELECT p.id, p.title, p.status, p.created_at,
-                           LEFT(p.description, 200) AS description
-                    FROM projects p
-                    JOIN bids b ON b.id = p.awarded_bid_id
-                    WHERE b.freelancer_id=%s AND p.status='closed'
-                    ORDER BY p.id DESC
-                """, (user["id"],))
-                projects = [
-                    {"id": a, "title": b, "status": c, "created_at": d, "description": e}
-                    for (a, b, c, d, e) in cur.fetchall()
-                ]
+    cursor, direction = parse_cursor(request)  # 分頁游標（?cursor=<id>&dir=next|prev）
 
-    return templates.TemplateResponse(
+    # 訪客看到的頁面都一樣：有快取就直接回（ETag 對得上回 304）
+    key = cache.guest_key(request)
+    if key and (hit := cache.get(key)):
+        return cache.respond(request, hit)
+    since = cache.generation(LIST_TAG)  # 查的途中被清過就不存
+
+    # 訪客頁面會被快取：從落後的複本讀到舊資料會被存 TTL 秒，所以訪客讀主庫，登入的人才分給複本
+    async with (db.connection() if key else db.read_connection(request)) as conn:
+        stats = await dashboard_stats(conn, user)  # 統計數字（計數表，一次查詢）
+        # 清單（訪客 / 委託人 / 接案人各分頁，一次只取一頁）
+        projects, next_cursor, prev_cursor = await list_projects(conn, user, tab, cursor, direction)
+
+    resp = templates.TemplateResponse(
         "projects_list.html",
-        {"request": request, "user": user, "tab": tab, "projects": projects, "stats": stats},
+        {"request": request, "user": user, "tab": tab, "projects": projects, "stats": stats,
+         "next_cursor": next_cursor, "prev_cursor": prev_cursor},
+    )
+    if key:
+        return cache.respond(request, cache.put(key, resp.body, resp.media_type, [LIST_TAG], since=since))
+    return resp
+
+
+# ----------------
+# 搜尋專案
+# ----------------
+@app.get("/search", response_class=HTMLResponse)
+async def project_search(request: Request, conn: psycopg.AsyncConnection = Depends(get_read_db)):
+    user = current_user(request)
+    f = parse_search(request)  # q / status / min_budget / max_budget / cursor
+    projects, next_cursor = await search_projects(conn, f)
+
+    # 下一頁沿用同樣的篩選條件
+    next_url = None
+    if next_cursor:
+        qs = {k: v for k, v in request.query_params.items() if k != "cursor"}
+        next_url = "/search?" + urlencode({**qs, "cursor": next_cursor})
+
+    return templates.TemplateResponse(
+        "search.html",
+        {"request": request, "user": user, "f": f, "projects": projects, "next_url": next_url},
     )
 
 
@@ -193,7 +143,7 @@ def projects_list(request: Request):
 # 新增專案
 # ----------------
 @app.get("/projects/create")
-def project_create_page(request: Request):
+async def project_create_page(request: Request):
     user = current_user(request)
     if not user or user["role"] != "client":
         return RedirectResponse("/", 302)
@@ -201,10 +151,11 @@ def project_create_page(request: Request):
 
 
 @app.post("/projects/create")
-def project_create(request: Request,
+async def project_create(request: Request,
                    title: str = Form(...),
                    description: str = Form(...),
-                   budget: Optional[int] = Form(None)):
+                   budget: Optional[int] = Form(None),
+                   conn: psycopg.AsyncConnection = Depends(get_db)):
     user = current_user(request)
     # 後端再次保護
     if not user:
@@ -212,128 +163,75 @@ def project_create(request: Request,
     if user["role"] != "client":
         return RedirectResponse("/", 302)
 
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("""
+    async with conn.cursor() as cur:
+        await cur.execute("""
             INSERT INTO projects (title, description, client_id, budget)
             VALUES (%s, %s, %s, %s)
+            RETURNING id
         """, (title, description, user["id"], budget))
-        conn.commit()  # 確保有被寫入
+        project_id = (await cur.fetchone())[0]
+        await events.publish(cur, "project_created", project_id)  # 別的 worker 的列表快取也要清
+        await conn.commit()  # 確保有被寫入
+    cache.invalidate(LIST_TAG)
     return RedirectResponse("/", 302)
 
 
 # ----------------
 # 案子詳細資料
 # ----------------
-from psycopg.rows import dict_row
+# 專案頁報價的排序選項（queries.BID_SORTS）
+BID_SORT_LABELS = {"price": "價格低到高", "price_desc": "價格高到低", "newest": "最新", "oldest": "最早"}
+
 
 @app.get("/projects/{id}")
-def project_detail(request: Request, id: int):
+async def project_detail(request: Request, id: int):
     user = current_user(request) 
 
-    # 讀專案（用 dict_row，欄位有名稱，不用數字 index）
-    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute("""
-            SELECT
-                p.id,
-                p.title,
-                p.description,
-                p.status,
-                p.created_at,
-                p.budget,                         
-                u.username      AS client_name,
-                u.id            AS client_id,
-                p.awarded_bid_id,  -- 目前得標的
-                (SELECT b.freelancer_id
-                   FROM bids b
-                  WHERE b.id = p.awarded_bid_id) AS awarded_freelancer_id
-            FROM projects p
-            JOIN users u ON p.client_id = u.id
-            WHERE p.id = %s
-        """, (id,))
-        row = cur.fetchone()
-        if not row:
-            return RedirectResponse("/", 302)
-
-        # 正規化狀態（避免 CHAR 尾巴空白 / 大小寫）
-        status = (row["status"] or "").strip().lower()
-
-        project = {
-            "id": row["id"],
-            "title": row["title"],
-            "description": row["description"],
-            "status": status,
-            "created_at": row["created_at"],
-            "budget": row["budget"],
-            "client_name": row["client_name"],
-            "client_id": row["client_id"],
-            "awarded_bid_id": row["awarded_bid_id"],
-            "awarded_freelancer_id": row["awarded_freelancer_id"],
-        }
-
-    # 讀報價（依角色）
-    bids = []
-    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        if user and user["role"] == "client" and user["id"] == project["client_id"]: # 案主可以看到所有人的報價
-            cur.execute("""
-                SELECT b.id, b.price, b.message, b.created_at, fu.username AS freelancer
-                FROM bids b
-                JOIN users fu ON fu.id = b.freelancer_id
-                WHERE b.project_id = %s
-                ORDER BY b.price ASC, b.created_at ASC
-            """, (id,))
-            bids = cur.fetchall()
-        elif user and user["role"] == "freelancer":
-            cur.execute("""
-                SELECT id, price, message, created_at
-                FROM bids
-                WHERE project_id=%s AND freelancer_id=%s
-            """, (id, user["id"]))
-            r = cur.fetchone()
-            if r:
-                bids = [{
-                    "id": r["id"],
-                    "price": r["price"],
-                    "message": r["message"],
-                    "created_at": r["created_at"],
-                    "freelancer": user["username"],
-                }]
-
-    # 讀結案檔案
-    with get_conn() as conn, conn.cursor(row_factory=dict_row) as cur:
-        cur.execute("""
-            SELECT d.filename, d.note, d.created_at, u.username AS freelancer
-            FROM deliveries d
-            JOIN users u ON u.id = d.freelancer_id
-            WHERE d.project_id = %s
-            ORDER BY d.created_at DESC
-        """, (id,))
-        deliveries = cur.fetchall()
+    key = cache.guest_key(request)
+    if key and (hit := cache.get(key)):
+        return cache.respond(request, hit)
+    since = cache.generation(project_tag(id))
+
+    # 專案、看得到的報價（案主一次一頁）、結案檔案一次查完（queries.load_project_detail）
+    async with (db.connection() if key else db.read_connection(request)) as conn:  # 同首頁
+        detail = await load_project_detail(conn, id, user,
+                                           bid_sort=request.query_params.get("bid_sort", "price"),
+                                           bid_cursor=request.query_params.get("bid_cursor"))
+    if detail is None:
+        return RedirectResponse("/", 302)
 
-    return templates.TemplateResponse(
+    resp = templates.TemplateResponse(
         "project_detail.html",
-        {"request": request, "project": project, "user": user, "bids": bids, "deliveries": deliveries}
+        {"request": request, "user": user, "project": detail.project,
+         "bids": detail.bids, "deliveries": detail.deliveries,
+         "bid_summary": detail.bid_summary, "awarded_bid": detail.awarded_bid,
+         "bid_sort": detail.bid_sort, "bid_next_cursor": detail.bid_next_cursor,
+         "bid_sorts": BID_SORT_LABELS}
     )
+    if key:
+        return cache.respond(request, cache.put(key, resp.body, resp.media_type, [project_tag(id)], since=since))
+    return resp
 
 
 # ----------------
 # 顯示編輯表單 / 接收編輯送出
 # ----------------
 @app.get("/projects/{project_id}/edit")
-def edit_project_page(request: Request, project_id: int):
+async def edit_project_page(request: Request, project_id: int, conn: psycopg.AsyncConnection = Depends(get_db)):
     user = current_user(request)
     if not user:
         return RedirectResponse("/login", 302)
 
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("SELECT id, title, description, status, client_id FROM projects WHERE id=%s", (project_id,))
-        row = cur.fetchone()
+    async with conn.cursor() as cur:
+        await cur.execute("SELECT id, title, description, status, client_id FROM projects WHERE id=%s", (project_id,))
+        row = await cur.fetchone()
         if not row:
             return RedirectResponse("/", 302)
         pid, title, desc, status, client_id = row
 
         # 已有報價不能編輯
-        cur.execute("SELECT EXISTS (SELECT 1 FROM bids WHERE project_id=%s)", (project_id,))
-        has_bids = cur.fetchone()[0]
+        await cur.execute("SELECT EXISTS (SELECT 1 FROM bids WHERE project_id=%s)", (project_id,))
+        has_bids = (await cur.fetchone())[0]
 
         if user["id"] != client_id or status != "open":
             return RedirectResponse(f"/projects/{project_id}", 302)
@@ -344,30 +242,31 @@ def edit_project_page(request: Request, project_id: int):
     })
 
 
+def transition_failed(project_id, result, locked_code=None):
+    # 狀態轉換失敗 → 回專案頁；已有報價（不能編輯 / 刪除）另外帶錯誤代碼
+    if result.reason == transitions.HAS_BIDS and locked_code:
+        return RedirectResponse(f"/projects/{project_id}?e={locked_code}", 302)
+    if result.reason == transitions.NOT_FOUND:
+        return RedirectResponse("/", 302)
+    return RedirectResponse(f"/projects/{project_id}", 302)
+
+
 @app.post("/projects/{project_id}/edit")
-def edit_project_submit(request: Request, project_id: int,
-                        title: str = Form(...), description: str = Form(...)):
+async def edit_project_submit(request: Request, project_id: int,
+                        title: str = Form(...), description: str = Form(...),
+                        conn: psycopg.AsyncConnection = Depends(get_db)):
     user = current_user(request)
     if not user:
         return RedirectResponse("/login", 302)
 
-    with get_conn() as conn, conn.cursor() as cur:
-        # 僅限本人且 open 狀態才可編輯
-        cur.execute("SELECT client_id, status FROM projects WHERE id=%s", (project_id,))
-        row = cur.fetchone()
-        if not row or row[0] != user["id"] or row[1] != "open":
-            return RedirectResponse(f"/projects/{project_id}", 302)
-        
-        # 有報價就不能編輯
-        cur.execute("SELECT EXISTS (SELECT 1 FROM bids WHERE project_id=%s)", (project_id,))
-        has_bids = cur.fetchone()[0]
-        if has_bids:
-            return RedirectResponse(f"/projects/{project_id}?e=edit_locked", 302)
-
-        cur.execute("""
-            UPDATE projects SET title=%s, description=%s WHERE id=%s
-        """, (title, description, project_id))
-        conn.commit()
+    async with conn.cursor() as cur:
+        # 僅限本人、open 狀態、還沒有報價（一句 UPDATE 判斷）
+        result = await transitions.edit(cur, project_id, user["id"], title, description)
+        if not result:
+            return transition_failed(project_id, result, "edit_locked")
+        await events.publish(cur, "project_edited", project_id)
+        await conn.commit()
+    cache.invalidate_project(project_id)
 
     return RedirectResponse(f"/projects/{project_id}", 302)
 
@@ -376,25 +275,19 @@ def edit_project_submit(request: Request, project_id: int,
     # 刪除案子
 # ----------------
 @app.post("/projects/{project_id}/delete")
-def delete_project(request: Request, project_id: int):
+async def delete_project(request: Request, project_id: int, conn: psycopg.AsyncConnection = Depends(get_db)):
     user = current_user(request)
     if not user:
         return RedirectResponse("/login", 302)
 
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("SELECT client_id, status FROM projects WHERE id=%s", (project_id,))
-        row = cur.fetchone()
-        if not row or row[0] != user["id"] or row[1] != "open":
-            return RedirectResponse(f"/projects/{project_id}", 302)
-        
+    async with conn.cursor() as cur:
         # 已有報價就不能刪除
-        cur.execute("SELECT EXISTS (SELECT 1 FROM bids WHERE project_id=%s)", (project_id,))
-        has_bids = cur.fetchone()[0]
-        if has_bids:
-            return RedirectResponse(f"/projects/{project_id}?e=delete_locked", 302)
-
-        cur.execute("DELETE FROM projects WHERE id=%s", (project_id,))
-        conn.commit()
+        result = await transitions.delete(cur, project_id, user["id"])
+        if not result:
+            return transition_failed(project_id, result, "delete_locked")
+        await events.publish_deleted(cur, project_id, users=[user["id"]])  # 已經刪掉，只能直接給收件人
+        await conn.commit()
+    cache.invalidate_project(project_id)
 
     return RedirectResponse("/", 302)
 
@@ -403,25 +296,19 @@ def delete_project(request: Request, project_id: int):
 # 接受報價（選標）
 # ----------------
 @app.post("/projects/{project_id}/award/{bid_id}")
-def award_bid(request: Request, project_id: int, bid_id: int):
+async def award_bid(request: Request, project_id: int, bid_id: int, conn: psycopg.AsyncConnection = Depends(get_db)):
     user = current_user(request)
     if not user:
         return RedirectResponse("/login", 302)
 
-    with get_conn() as conn, conn.cursor() as cur:
-        # 取得專案確認是本人委託
-        cur.execute("SELECT client_id FROM projects WHERE id=%s", (project_id,))
-        row = cur.fetchone()
-        if not row or row[0] != user["id"]:
-            return RedirectResponse(f"/projects/{project_id}", 302)
-
-        # 更新狀態與中標報價
-        cur.execute("""
-            UPDATE projects
-            SET awarded_bid_id=%s, status='in_progress'
-            WHERE id=%s
-        """, (bid_id, project_id))
-        conn.commit()
+    async with conn.cursor() as cur:
+        # 本人委託、open 狀態、報價屬於這個專案，才更新狀態與中標報價
+        result = await transitions.award(cur, project_id, user["id"], bid_id)
+        if not result:
+            return transition_failed(project_id, result)
+        await events.publish(cur, "project_awarded", project_id)
+        await conn.commit()
+    cache.invalidate_project(project_id)
 
     return RedirectResponse(f"/projects/{project_id}", 302)
 
@@ -430,15 +317,20 @@ def award_bid(request: Request, project_id: int, bid_id: int):
 # 上傳結案檔案
 # ----------------
 
-UPLOAD_DIR = BASE_DIR / "www" / "uploads"
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+async def enqueue_removal(cur, unused_keys, removed):
+    # removed：DELETE ... RETURNING storage_key, filename；舊資料（storage_key 為 NULL）依檔名刪
+    legacy = [fname for key, fname in removed if not key]
+    if unused_keys or legacy:
+        await jobs.enqueue(cur, "remove_files", {"keys": unused_keys, "legacy": legacy})
+
 
 @app.post("/deliveries/{project_id}")
 async def upload_delivery(
     request: Request,
     project_id: int,
     file: UploadFile = File(...),
-    note: str = Form("")
+    note: str = Form(""),
+    conn: psycopg.AsyncConnection = Depends(get_db),
 ):
     user = current_user(request)
     if not user:
@@ -447,14 +339,14 @@ async def upload_delivery(
         return RedirectResponse(f"/projects/{project_id}", 302)
 
     # 先查專案狀態與中標者
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("""
+    async with conn.cursor() as cur:
+        await cur.execute("""
             SELECT p.status AS proj_status, b.freelancer_id AS awarded_freelancer_id
             FROM projects p
             JOIN bids b ON b.id = p.awarded_bid_id
             WHERE p.id = %s
         """, (project_id,))
-        row = cur.fetchone()
+        row = await cur.fetchone()
         if not row:
             return RedirectResponse(f"/projects/{project_id}", 302)
 
@@ -465,49 +357,54 @@ async def upload_delivery(
             return RedirectResponse(f"/projects/{project_id}", 302)
 
         # 檢查是否已上傳過（同一專案、同一人）
-        cur.execute("""
+        await cur.execute("""
             SELECT id, filename
             FROM deliveries
             WHERE project_id=%s AND freelancer_id=%s
         """, (project_id, user["id"]))
-        prev = cur.fetchall()
-
-        if prev:
-            # 非退件狀態：拒絕重複上傳
-            if proj_status != 'reopened':
-                return RedirectResponse(f"/projects/{project_id}?filedup=1", 302)
-            # 退件狀態：清理舊檔與紀錄後才允許上傳
-            for _id, fname in prev:
-                p = UPLOAD_DIR / fname
-                if p.exists():
-                    p.unlink()
-            cur.execute("""
-                DELETE FROM deliveries
-                WHERE project_id=%s AND freelancer_id=%s
-            """, (project_id, user["id"]))
-            conn.commit()
-
-    # 儲存新檔
-    dest = UPLOAD_DIR / file.filename
-    with open(dest, "wb") as f:
-        f.write(await file.read())
-
-    # 寫入DB
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("""
-            INSERT INTO deliveries (project_id, freelancer_id, filename, note)
-            VALUES (%s,%s,%s,%s)
-        """, (project_id, user["id"], file.filename, note))
-        conn.commit()
-
-    # 若是退件狀態，上傳後自動改回進行中
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("""
+        prev = await cur.fetchall()
+
+        # 非退件狀態：拒絕重複上傳
+        if prev and proj_status != 'reopened':
+            return RedirectResponse(f"/projects/{project_id}?filedup=1", 302)
+
+    # 儲存新檔（分段寫入、同時算雜湊，相同內容只存一份）
+    try:
+        stored = await save_upload(file)
+    except UploadTooLarge:
+        return RedirectResponse(f"/projects/{project_id}?toolarge=1", 302)
+
+    async with conn.cursor() as cur:
+        # 退件狀態：清理舊紀錄後才寫入新檔
+        await cur.execute("""
+            DELETE FROM deliveries
+            WHERE project_id=%s AND freelancer_id=%s
+            RETURNING storage_key, filename
+        """, (project_id, user["id"]))
+        removed = await cur.fetchall()
+        unused = await release(cur, [key for key, _ in removed])
+
+        # 寫入DB
+        await add_ref(cur, stored)
+        await cur.execute("""
+            INSERT INTO deliveries (project_id, freelancer_id, filename, note, storage_key)
+            VALUES (%s,%s,%s,%s,%s)
+        """, (project_id, user["id"], file.filename, note, stored.storage_key))
+
+        # 若是退件狀態，上傳後自動改回進行中
+        await cur.execute("""
             UPDATE projects
             SET status='in_progress'
             WHERE id=%s AND status='reopened'
         """, (project_id,))
-        conn.commit()
+
+        # 舊的實體檔案交給背景工作刪（跟這個交易一起 commit，當掉也不會漏刪）
+        await enqueue_removal(cur, unused, removed)
+        await events.publish(cur, "delivery_uploaded", project_id)  # 通知案主（commit 後才送出）
+        await conn.commit()
+    cache.invalidate_project(project_id)
+
+    previews.schedule(stored.storage_key)  # 圖片在背景產生縮圖，不等它
 
     return RedirectResponse(f"/projects/{project_id}", 302)
 
@@ -517,61 +414,46 @@ async def upload_delivery(
 # ----------------
 # 關專案
 @app.post("/projects/{project_id}/close")
-def close_project(request: Request, project_id: int):
+async def close_project(request: Request, project_id: int, conn: psycopg.AsyncConnection = Depends(get_db)):
     user = current_user(request)
     if not user:
         return RedirectResponse("/login", 302)
 
-    with get_conn() as conn, conn.cursor() as cur:
-        # 確認專案是該使用者委託的
-        cur.execute("SELECT client_id, status FROM projects WHERE id=%s", (project_id,))
-        row = cur.fetchone()
-        if not row or row[0] != user["id"] or row[1] != "in_progress":
-            return RedirectResponse(f"/projects/{project_id}", 302)
-
-        # 更新狀態為 closed
-        cur.execute("""
-            UPDATE projects
-            SET status='closed'
-            WHERE id=%s
-        """, (project_id,))
-        conn.commit()
+    async with conn.cursor() as cur:
+        # 該使用者委託、進行中的專案才能改成 closed
+        result = await transitions.close(cur, project_id, user["id"])
+        if not result:
+            return transition_failed(project_id, result)
+        await events.publish(cur, "project_closed", project_id)
+        await conn.commit()
+    cache.invalidate_project(project_id)
 
     return RedirectResponse(f"/projects/{project_id}", 302)
 
 # 退件
 @app.post("/projects/{project_id}/reject")
-def reject_project(request: Request, project_id: int):
+async def reject_project(request: Request, project_id: int, conn: psycopg.AsyncConnection = Depends(get_db)):
     user = current_user(request)
     if not user:
         return RedirectResponse("/login", 302)
 
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("SELECT client_id, status FROM projects WHERE id=%s", (project_id,))
-        row = cur.fetchone()
-        if not row or row[0] != user["id"] or row[1] != "in_progress":
-            return RedirectResponse(f"/projects/{project_id}", 302)
+    async with conn.cursor() as cur:
+        # 先改成退件狀態（同時確認是本人、進行中；也鎖住這個專案）
+        result = await transitions.reject(cur, project_id, user["id"])
+        if not result:
+            return transition_failed(project_id, result)
 
-        # 改成退件狀態(刪掉檔案 且 接案人可以在船檔案)
-        cur.execute("""
-            SELECT b.freelancer_id, d.filename
-            FROM projects p
-            JOIN bids b ON b.id = p.awarded_bid_id
-            LEFT JOIN deliveries d ON d.project_id = p.id AND d.freelancer_id = b.freelancer_id
-            WHERE p.id=%s
+        # 刪掉檔案 且 接案人可以在船檔案
+        await cur.execute("""
+            DELETE FROM deliveries WHERE project_id=%s
+            RETURNING storage_key, filename
         """, (project_id,))
-        rows = cur.fetchall()
-        for fid, fname in rows:
-            if fname:
-                file_path = UPLOAD_DIR / fname
-                if file_path.exists():
-                    file_path.unlink()
-        cur.execute("DELETE FROM deliveries WHERE project_id=%s", (project_id,))
-        conn.commit()
-
-        # 更新狀態為退件
-        cur.execute("UPDATE projects SET status='reopened' WHERE id=%s", (project_id,))
-        conn.commit()
+        removed = await cur.fetchall()
+        unused = await release(cur, [key for key, _ in removed])  # 扣掉引用，沒人用的檔案才刪
+        await enqueue_removal(cur, unused, removed)  # 實體檔案由背景工作刪
+        await events.publish(cur, "project_rejected", project_id)
+        await conn.commit()
+    cache.invalidate_project(project_id)
 
     return RedirectResponse(f"/projects/{project_id}", 302)
 
@@ -580,27 +462,29 @@ def reject_project(request: Request, project_id: int):
 # 送出報價
 # ----------------
 @app.post("/bids/{project_id}")
-def create_bid(request: Request, project_id: int,
+async def create_bid(request: Request, project_id: int,
                price: int = Form(...),
-               message: str = Form("")):
+               message: str = Form(""),
+               conn: psycopg.AsyncConnection = Depends(get_db)):
     user = current_user(request)
     if not user:
         return RedirectResponse("/login", 302)
     if user["role"] != "freelancer":
         return RedirectResponse(f"/projects/{project_id}", 302)
 
-    with get_conn() as conn, conn.cursor() as cur:
+    async with conn.cursor() as cur:
         # 防止重複報價（也可交給 UNIQUE，但這樣訊息更友善）
-        cur.execute("SELECT 1 FROM bids WHERE project_id=%s AND freelancer_id=%s",
+        await cur.execute("SELECT 1 FROM bids WHERE project_id=%s AND freelancer_id=%s",
                     (project_id, user["id"]))
-        if cur.fetchone():  # 關閉連線防重檢查
+        if await cur.fetchone():  # 關閉連線防重檢查
             return RedirectResponse(f"/projects/{project_id}?dup=1", 302)  # 倒回擬以投標
 
-        cur.execute("""
+        await cur.execute("""
             INSERT INTO bids (project_id, freelancer_id, price, message)
             VALUES (%s,%s,%s,%s)
         """, (project_id, user["id"], price, message))
-        conn.commit()
+        await events.publish(cur, "bid_created", project_id, users=[user["id"]])  # 案主的頁面即時更新
+        await conn.commit()
 
     return RedirectResponse(f"/projects/{project_id}", 302)
 
@@ -609,47 +493,28 @@ def create_bid(request: Request, project_id: int,
 # 登入 / 登出 / 註冊
 # ----------------
 @app.get("/login")
-def login_page(request: Request):
+async def login_page(request: Request):
     return templates.TemplateResponse("login.html", {"request": request})
 
 
 @app.post("/login")
-def login(request: Request, username: str = Form(...), password: str = Form(...)):
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("SELECT id, username, password_hash, role FROM users WHERE username=%s", (username,))
-        row = cur.fetchone()
+async def login(request: Request, username: str = Form(...), password: str = Form(...),
+          conn: psycopg.AsyncConnection = Depends(get_read_db)):  # 只查帳號；剛註冊的人 session 還釘在主庫
+    async with conn.cursor() as cur:
+        await cur.execute("SELECT id, username, password_hash, role FROM users WHERE username=%s", (username,))
+        row = await cur.fetchone()
     if not row:
         return RedirectResponse("/login?e=1", 302)  # 帶錯誤訊息
 
     uid, uname, pw_hash, role = row
-    ok = False
+    try:
+        ok, needs_rehash = await verify_password(password, pw_hash)
+    except HashBusy:
+        return RedirectResponse("/login?e=busy", 302)  # 登入的人太多，請稍後再試
 
-    # 明文（相容舊資料）
-    if pw_hash.startswith("plain:"):
-        ok = (pw_hash[6:] == password)
-        # 首登自動轉 bcrypt
-        if ok and HAS_BCRYPT:
-            try:
-                new_hash = bcrypt.hash(password)
-                with get_conn() as conn, conn.cursor() as cur:
-                    cur.execute("UPDATE users SET password_hash=%s WHERE id=%s", (new_hash, uid))
-                    conn.commit()
-            except Exception:
-                pass
-    else:
-        # 2) bcrypt
-        if HAS_BCRYPT and (pw_hash.startswith("$2a$") or pw_hash.startswith("$2b$") or pw_hash.startswith("$2y$")):
-            try:
-                ok = bcrypt.verify(password, pw_hash)
-            except Exception:
-                ok = False
-
-        # 3) pbkdf2_sha256
-        if not ok and pw_hash.startswith("$pbkdf2-sha256$"):
-            try:
-                ok = pbkdf2_sha256.verify(password, pw_hash)
-            except Exception:
-                ok = False
+    # 明文（相容舊資料）首登自動轉 bcrypt：背景做，不拖慢這次登入
+    if ok and needs_rehash:
+        rehash_later(db.apool, uid, password, pw_hash)
 
     if not ok:
         return RedirectResponse("/login?e=1", 302)
@@ -660,18 +525,18 @@ def login(request: Request, username: str = Form(...), password: str = Form(...)
 
 # 登出
 @app.get("/logout")
-def logout(request: Request):
+async def logout(request: Request):
     request.session.clear()
     return RedirectResponse("/", 302)
 
 # 註冊
 @app.get("/register")
-def register_page(request: Request):
+async def register_page(request: Request):
     e = request.query_params.get("e")   # 取得 ?e=... 錯誤代碼
     return templates.TemplateResponse("register.html", {"request": request, "e": e})
 
 @app.post("/register")
-def register(
+async def register(
     request: Request,
     username: str = Form(...),
     password: str = Form(...),
@@ -681,6 +546,7 @@ def register(
     phone: str = Form(""),
     email: str = Form(""),   
     agree: str = Form(None),
+    conn: psycopg.AsyncConnection = Depends(get_db),
 ):
     # ---------- 驗證 ----------
     if role not in ("client", "freelancer"):
@@ -697,31 +563,27 @@ def register(
     #    return RedirectResponse("/register?e=email", status_code=302)
 
     # ---------- 檢查使用者名稱重複 ----------
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("SELECT 1 FROM users WHERE username=%s;", (username,))
-        if cur.fetchone():
+    async with conn.cursor() as cur:
+        await cur.execute("SELECT 1 FROM users WHERE username=%s;", (username,))
+        if await cur.fetchone():
             return RedirectResponse("/register?e=user", status_code=302)
 
         try:
-            # 雜湊密碼
+            # 雜湊密碼（在行程池裡算；排滿了請使用者稍後再試）
             try:
-                if HAS_BCRYPT:
-                    hashed = bcrypt.hash(password)
-                else:
-                    from passlib.hash import pbkdf2_sha256 as pbk
-                    hashed = pbk.hash(password)
-            except Exception:
-                hashed = f"plain:{password}"
+                hashed = await hash_password(password)
+            except HashBusy:
+                return RedirectResponse("/register?e=busy", status_code=302)
 
             # 送進 DB
             print("[DEBUG] about to insert:", username, role, full_name, phone, email)
-            cur.execute("""
+            await cur.execute("""
                 INSERT INTO users (username, password_hash, role, full_name, phone, email)
                 VALUES (%s,%s,%s,%s,%s,%s);
             """, (username, hashed, role, full_name, (phone or None), (email or None)))
             print("[DEBUG] rowcount after insert:", cur.rowcount)
 
-            conn.commit()
+            await conn.commit()
             print("[DEBUG] committed insert for:", username)
 
         except Exception as e:
@@ -732,3 +594,36 @@ def register(
             return RedirectResponse(f"/register?e=dberr:{msg}", status_code=302)
 
     return RedirectResponse("/register?ok=1", status_code=302)
+
+
+# ----------------
+# 健康檢查 / 連線池狀態
+# ----------------
+@app.get("/healthz")
+async def healthz(conn: psycopg.AsyncConnection = Depends(get_db)):
+    return {"ok": True, "db_pool": pool_stats(), "hasher": hasher_stats(),
+            "page_cache": cache.cache_stats(),
+            "previews": previews.preview_stats(),
+            "events": events.event_stats(),
+            "db_replicas": db.replica_stats(),
+            "rate_limit": ratelimit.rate_limit_stats(),
+            "jobs": await jobs.queue_stats(conn)}
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    # Prometheus 抓取用（text format 0.0.4）
+    extra = [(f"db_pool_{k}", f"async pool {k.replace('_', ' ')}", v) for k, v in pool_stats().items()]
+    extra += [(f"page_cache_{k}", f"guest page cache {k.replace('_', ' ')}", v)
+              for k, v in cache.cache_stats().items()]
+    extra += [(f"events_{k}", f"live update events {k}", v) for k, v in events.event_stats().items()]
+    extra += [(f"rate_limit_{k}", f"rate limiting / load shedding {k.replace('_', ' ')}", v)
+              for k, v in ratelimit.rate_limit_stats().items() if not isinstance(v, str)]
+    replica = db.replica_stats()
+    extra += [(f"db_reads_{k}", f"reads served by the primary ({k})", v) for k, v in replica["reads"].items()]
+    for r in replica["replicas"]:
+        extra += [(f"db_{r['name']}_healthy", f"{r['name']} in rotation", int(r["healthy"])),
+                  (f"db_{r['name']}_lag_seconds", f"{r['name']} replication lag", r["lag"] if r["lag"] is not None else -1),
+                  (f"db_{r['name']}_reads", f"reads served by {r['name']}", r["reads"]),
+                  (f"db_{r['name']}_ejections", f"times {r['name']} was taken out of rotation", r["ejections"])]
+    return PlainTextResponse(metrics.render(extra), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,148 @@
+# archive.py
+# 冷熱分離：結案超過 ARCHIVE_AFTER_DAYS 天的專案，連同報價、結案檔案、報價摘要搬到 *_archive 表（migrations/0010），
+# projects / bids / deliveries 只留還會變動的資料，投放中 / 進行中的查詢、索引、VACUUM 都跟著變小。
+# 一批 BATCH_SIZE 個專案 = 一個交易裡的一句 SQL（INSERT 到 archive + DELETE，外鍵 CASCADE 帶走報價 / 檔案紀錄）：
+# 挑專案用 FOR UPDATE SKIP LOCKED（別人正在用的先跳過），再設 lock_timeout，等不到鎖就放棄這批、下次再搬，
+# 不會長時間鎖住線上的表。搬移時設 app.archiving = on，計數表與報價摘要的 trigger 不動（專案還是算已結案）。
+# 搬過去之後，已結案分頁、專案頁、下載、搜尋一樣看得到；結案檔案的實體檔不動。
+#   python archive.py run [--days 180] [--batch 200] [--max-batches N] [--pause 0.1]
+#   python archive.py status
+# jobs worker 每天也會自動排一次（archive_closed）；ARCHIVE=off 關掉自動排程。
+import argparse
+import logging
+import os
+import sys
+import time
+
+import psycopg
+
+import db
+
+log = logging.getLogger("archive")
+
+ARCHIVE_ENABLED = os.environ.get("ARCHIVE", "on") != "off"
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS") or 180)  # 結案幾天後搬
+BATCH_SIZE = 200            # 一個交易搬幾個專案
+BATCH_PAUSE = 0.1           # 每批之間休息幾秒，讓 replica / autovacuum 跟得上
+LOCK_TIMEOUT = "2s"         # 等鎖等太久就放棄這批
+
+# 一句做完：挑專案 -> 刪掉線上的（RETURNING 原本的欄位）-> 同一個快照裡的報價 / 檔案 / 摘要一起寫進 archive
+# （CASCADE 的刪除、archive 的外鍵檢查都在這句結束時才做，所以先刪後寫也沒關係）
+# projects / bids / deliveries 加欄位時這裡也要加
+ARCHIVE_SQL = """
+    WITH picked AS (
+        SELECT id FROM projects
+        WHERE status = 'closed' AND closed_at < now() - make_interval(days => %(days)s)
+        ORDER BY closed_at
+        LIMIT %(batch)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    moved AS (
+        DELETE FROM projects p USING picked
+        WHERE p.id = picked.id
+        RETURNING p.id, p.title, p.description, p.status, p.client_id, p.created_at,
+                  p.awarded_bid_id, p.budget, p.version, p.closed_at
+    ),
+    ins_projects AS (
+        INSERT INTO projects_archive (id, title, description, status, client_id, created_at,
+                                      awarded_bid_id, budget, version, closed_at)
+        SELECT * FROM moved
+        RETURNING id
+    ),
+    ins_bids AS (
+        INSERT INTO bids_archive (id, project_id, freelancer_id, price, message, created_at)
+        SELECT b.id, b.project_id, b.freelancer_id, b.price, b.message, b.created_at
+        FROM bids b JOIN moved m ON m.id = b.project_id
+        RETURNING id
+    ),
+    ins_deliveries AS (
+        INSERT INTO deliveries_archive (id, project_id, freelancer_id, filename, note, created_at, storage_key)
+        SELECT d.id, d.project_id, d.freelancer_id, d.filename, d.note, d.created_at, d.storage_key
+        FROM deliveries d JOIN moved m ON m.id = d.project_id
+        RETURNING id
+    ),
+    ins_stats AS (
+        INSERT INTO project_bid_stats_archive (project_id, bid_count, min_price, max_price, median_price, last_bid_at)
+        SELECT s.project_id, s.bid_count, s.min_price, s.max_price, s.median_price, s.last_bid_at
+        FROM project_bid_stats s JOIN moved m ON m.id = s.project_id
+        RETURNING project_id
+    )
+    SELECT (SELECT count(*) FROM ins_projects), (SELECT count(*) FROM ins_bids),
+           (SELECT count(*) FROM ins_deliveries), (SELECT count(*) FROM ins_stats)
+"""
+
+
+def archive_batch(conn, days=ARCHIVE_AFTER_DAYS, batch=BATCH_SIZE):
+    """搬一批，回傳 (專案, 報價, 結案檔案, 報價摘要) 筆數；不 commit（呼叫端決定）"""
+    conn.execute("SET LOCAL app.archiving = on")
+    conn.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+    return conn.execute(ARCHIVE_SQL, {"days": days, "batch": batch}).fetchone()
+
+
+def run(conn, days=ARCHIVE_AFTER_DAYS, batch=BATCH_SIZE, max_batches=None, pause=BATCH_PAUSE):
+    """一批一個交易，搬到沒有可以搬的（或做滿 max_batches 批）為止"""
+    stats = dict.fromkeys(("batches", "projects", "bids", "deliveries", "bid_stats", "lock_timeouts"), 0)
+    while max_batches is None or stats["batches"] < max_batches:
+        try:
+            with conn.transaction():
+                projects, bids, deliveries, bid_stats = archive_batch(conn, days, batch)
+        except psycopg.errors.LockNotAvailable:
+            # 有人鎖著這批的報價 / 檔案：這次先停，下次排程再搬
+            stats["lock_timeouts"] += 1
+            log.warning("archive: lock timeout, stopping this run")
+            break
+        conn.commit()
+        if not projects:
+            break
+        stats["batches"] += 1
+        stats["projects"] += projects
+        stats["bids"] += bids
+        stats["deliveries"] += deliveries
+        stats["bid_stats"] += bid_stats
+        if projects < batch:
+            break
+        time.sleep(pause)
+    log.info("archive: %s", stats)
+    return stats
+
+
+def status(conn, days=ARCHIVE_AFTER_DAYS):
+    row = conn.execute("""
+        SELECT (SELECT count(*) FROM projects WHERE status = 'closed'),
+               (SELECT count(*) FROM projects
+                WHERE status = 'closed' AND closed_at < now() - make_interval(days => %s)),
+               (SELECT min(closed_at) FROM projects WHERE status = 'closed'),
+               (SELECT count(*) FROM projects_archive),
+               (SELECT count(*) FROM bids_archive),
+               (SELECT count(*) FROM deliveries_archive),
+               (SELECT max(archived_at) FROM projects_archive)
+    """, (days,)).fetchone()
+    keys = ("closed_live", "due", "oldest_closed_at", "archived_projects", "archived_bids",
+            "archived_deliveries", "last_archived_at")
+    return dict(zip(keys, row))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="把結案很久的專案搬到 archive 表")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run")
+    r.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="結案超過幾天才搬")
+    r.add_argument("--batch", type=int, default=BATCH_SIZE, help="一個交易搬幾個專案")
+    r.add_argument("--max-batches", type=int, default=None)
+    r.add_argument("--pause", type=float, default=BATCH_PAUSE, help="每批之間休息幾秒")
+    s = sub.add_parser("status")
+    s.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS)
+    args = ap.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    with db.get_conn() as conn:
+        if args.cmd == "run":
+            print(run(conn, args.days, max(1, args.batch), args.max_batches, args.pause))
+        else:
+            for key, value in status(conn, args.days).items():
+                print(f"{key:20} {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
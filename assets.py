@@ -0,0 +1,138 @@
+# assets.py
+# 靜態檔案（www/ 底下的 css / js / 圖片）：啟動時依內容雜湊產生帶指紋的檔名（style.3f2a9c1d7e4b.css），
+# 同時預先壓好 gzip / brotli，放在 .assets/。
+# 檔名跟著內容變，所以可以讓瀏覽器快取一年（immutable），改了 css 網址自然不同。
+# 模板用 {{ asset_url('style.css') }} 取得網址。
+#   python assets.py build   # 手動產生（部署時可以先跑，啟動就不用再壓縮）
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import sys
+import uuid
+from pathlib import Path
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse
+from fastapi.staticfiles import StaticFiles
+
+try:  # brotli 是選配，沒裝就只有 gzip
+    import brotli
+except ImportError:
+    brotli = None
+
+BASE_DIR = Path(__file__).resolve().parent
+SOURCE_DIR = BASE_DIR / "www"
+BUILD_DIR = BASE_DIR / ".assets"
+MANIFEST_PATH = BUILD_DIR / "manifest.json"
+
+URL_PREFIX = "/static"
+SKIP_DIRS = {"uploads"}   # 使用者上傳的檔案不算靜態資源
+COMPRESS_SUFFIXES = {".css", ".js", ".svg", ".json", ".txt", ".html", ".map"}
+MIN_COMPRESS_BYTES = 512  # 太小的檔案壓了也省不到什麼
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+manifest = {}   # "style.css" -> "style.3f2a9c1d7e4b.css"（相對於 www/）
+_served = {}    # "style.3f2a9c1d7e4b.css" -> 原始檔名（只有列在這裡的才會被送出去）
+
+router = APIRouter()
+
+
+def _write_atomic(path, data):
+    # 多個 worker 同時啟動也不會讀到寫一半的檔案
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def fingerprint(rel, data):
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    p = Path(rel)
+    return str(p.with_name(f"{p.stem}.{digest}{p.suffix}").as_posix())
+
+
+def source_files():
+    for path in sorted(SOURCE_DIR.rglob("*")):
+        rel = path.relative_to(SOURCE_DIR)
+        if path.is_file() and rel.parts[0] not in SKIP_DIRS and not path.name.startswith("."):
+            yield rel.as_posix(), path
+
+
+def build():
+    """產生帶指紋的檔案與 .gz / .br，寫 manifest；內容沒變的檔案不會重做"""
+    out = {}
+    for rel, path in source_files():
+        data = path.read_bytes()
+        hashed = fingerprint(rel, data)
+        out[rel] = hashed
+        target = BUILD_DIR / hashed
+        if not target.exists():
+            _write_atomic(target, data)
+        if path.suffix.lower() in COMPRESS_SUFFIXES and len(data) >= MIN_COMPRESS_BYTES:
+            gz = target.with_name(target.name + ".gz")
+            if not gz.exists():
+                _write_atomic(gz, gzip.compress(data, compresslevel=9, mtime=0))
+            br = target.with_name(target.name + ".br")
+            if brotli is not None and not br.exists():
+                _write_atomic(br, brotli.compress(data, quality=11))
+    _write_atomic(MANIFEST_PATH, json.dumps(out, indent=2, ensure_ascii=False).encode())
+    load(out)
+    return out
+
+
+def load(data=None):
+    global manifest, _served
+    if data is None:
+        data = json.loads(MANIFEST_PATH.read_text()) if MANIFEST_PATH.exists() else {}
+    manifest = dict(data)
+    _served = {hashed: rel for rel, hashed in manifest.items()}
+    return manifest
+
+
+def asset_url(rel):
+    # 模板用：有指紋版本就用指紋網址，沒有（例如還沒 build）就退回原本的 /www/
+    hashed = manifest.get(rel)
+    return f"{URL_PREFIX}/{hashed}" if hashed else f"/www/{rel}"
+
+
+def _pick_encoding(request, path):
+    # 依 Accept-Encoding 挑預先壓好的版本：br > gzip > 原檔
+    accept = request.headers.get("accept-encoding", "")
+    offered = {part.split(";")[0].strip().lower() for part in accept.split(",")}
+    for encoding, ext in (("br", ".br"), ("gzip", ".gz")):
+        if encoding in offered:
+            candidate = path.with_name(path.name + ext)
+            if candidate.exists():
+                return candidate, encoding
+    return path, None
+
+
+@router.get(URL_PREFIX + "/{name:path}")
+async def static_asset(request: Request, name: str):
+    if name not in _served:
+        raise HTTPException(404)
+    path, encoding = _pick_encoding(request, BUILD_DIR / name)
+    headers = {"Cache-Control": IMMUTABLE, "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
+class PublicStaticFiles(StaticFiles):
+    # /www 掛載用：一般靜態檔照舊，但 uploads/ 底下（使用者上傳的結案檔案）一律 404，
+    # 要下載請走 downloads.py 的權限檢查
+    def lookup_path(self, path):
+        parts = Path(path).parts
+        if parts and parts[0] in SKIP_DIRS:
+            return "", None
+        return super().lookup_path(path)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["build"]:
+        sys.exit("usage: python assets.py build")
+    for rel, hashed in build().items():
+        print(f"{rel} -> {hashed}")
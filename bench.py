@@ -0,0 +1,431 @@
+# bench.py
+# 壓力測試：用固定的並行數打 app.py 的每一個路由（訪客 / 委託人 / 接案人，包含上傳），
+# 輸出每個路由的吞吐量與 p50 / p95 / p99 延遲（JSON），可以拿兩個 commit 的結果比較。
+# 先用 seed.py 產生資料，再啟動網站（建議跟正式環境一樣的 worker 數），然後：
+#   python bench.py run --concurrency 16 --duration 30 --out before.json
+#   python bench.py run --scenario guest --duration 60            # 只跑訪客
+#   python bench.py compare before.json after.json                # p95 變慢超過 10% 就 exit 1
+# 每個虛擬使用者的操作順序由 --seed 決定，同一份資料、同一個 seed 每次打的請求都一樣。
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+import psycopg
+
+from db import CONNINFO
+from seed import BENCH_PASSWORD, BENCH_PREFIX, CATEGORIES
+
+ROLE_WEIGHTS = {"guest": 6, "freelancer": 3, "client": 1}   # mixed 時各角色的虛擬使用者比例
+SEARCH_WORDS = CATEGORIES + ["急徵", "遠端", "設計 開發"]
+
+
+# ----------------
+# 統計
+# ----------------
+class Recorder:
+    def __init__(self):
+        self.samples = {}   # 路由 -> [(秒數, 狀態碼)]
+        self.recording = False
+
+    def add(self, name, seconds, status):
+        if self.recording:
+            self.samples.setdefault(name, []).append((seconds, status))
+
+
+def percentile(sorted_values, pct):
+    # nearest-rank
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def summarize(samples, elapsed):
+    lat = sorted(s for s, _ in samples)
+    statuses = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ms = lambda v: round(v * 1000, 2) if v is not None else None  # noqa: E731
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, st in samples if st == 0 or st >= 500),
+        "rps": round(len(samples) / elapsed, 2) if elapsed else 0,
+        "mean_ms": ms(sum(lat) / len(lat)) if lat else None,
+        "p50_ms": ms(percentile(lat, 50)),
+        "p95_ms": ms(percentile(lat, 95)),
+        "p99_ms": ms(percentile(lat, 99)),
+        "max_ms": ms(lat[-1]) if lat else None,
+        "status": statuses,
+    }
+
+
+# ----------------
+# 虛擬使用者
+# ----------------
+class VirtualUser:
+    def __init__(self, index, role, args, fixtures, recorder):
+        self.index, self.role, self.args = index, role, args
+        self.fx, self.rec = fixtures, recorder
+        self.rng = random.Random(f"{args.seed}-{index}")
+        self.http = httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, follow_redirects=False)
+        self.db = None
+        self.user_id = None
+        self.partner = None   # 委託人流程要搭配的接案人（另一個 session）
+
+    async def request(self, name, method, url, client=None, **kwargs):
+        # name 用路由樣板（"GET /projects/{id}"），統計才不會每個 id 一組
+        start = time.perf_counter()
+        try:
+            r = await (client or self.http).request(method, url, **kwargs)
+            status = r.status_code
+        except httpx.HTTPError:
+            r, status = None, 0
+        self.rec.add(name, time.perf_counter() - start, status)
+        return r
+
+    async def login(self, client, username):
+        await self.request("POST /login", "POST", "/login", client=client,
+                           data={"username": username, "password": BENCH_PASSWORD})
+
+    async def setup(self):
+        self.db = await psycopg.AsyncConnection.connect(CONNINFO, autocommit=True)
+        if self.role == "guest":
+            return
+        prefix = "c" if self.role == "client" else "f"
+        n = self.fx[f"{self.role}_count"]
+        username = f"bench_{prefix}{1 + self.index % n}"
+        cur = await self.db.execute("SELECT id FROM users WHERE username=%s", (username,))
+        self.user_id = (await cur.fetchone())[0]
+        await self.login(self.http, username)
+        if self.role == "client":
+            self.partner = httpx.AsyncClient(base_url=self.args.base_url, timeout=self.args.timeout)
+            f = f"bench_f{1 + (self.index * 7) % self.fx['freelancer_count']}"
+            cur = await self.db.execute("SELECT id FROM users WHERE username=%s", (f,))
+            self.partner_id = (await cur.fetchone())[0]
+            await self.login(self.partner, f)
+
+    async def close(self):
+        await self.http.aclose()
+        if self.partner:
+            await self.partner.aclose()
+        if self.db:
+            await self.db.close()
+
+    async def one(self, sql, params):
+        cur = await self.db.execute(sql, params)
+        return await cur.fetchone()
+
+    def open_project(self):
+        return self.rng.choice(self.fx["open_projects"])
+
+    def any_project(self):
+        return self.rng.choice(self.fx["projects"])
+
+    # ---- 訪客 ----
+    async def guest_step(self):
+        op = self.rng.choices(
+            ["list", "list_next", "detail", "search", "api_list", "api_detail", "api_bids", "static",
+             "login_page", "register_page", "register", "healthz", "metrics", "logout"],
+            [20, 8, 25, 10, 8, 8, 3, 5, 3, 2, 0.2, 1, 0.5, 1])[0]
+        if op == "list":
+            await self.request("GET /", "GET", "/")
+        elif op == "list_next":
+            await self.request("GET /", "GET", f"/?cursor={self.open_project()}&dir=next")
+        elif op == "detail":
+            await self.request("GET /projects/{id}", "GET", f"/projects/{self.any_project()}")
+        elif op == "search":
+            await self.request("GET /search", "GET", "/search", params={"q": self.rng.choice(SEARCH_WORDS)})
+        elif op == "api_list":
+            await self.request("GET /api/v1/projects", "GET", "/api/v1/projects", params={"fields": "id,title,status"})
+        elif op == "api_detail":
+            await self.request("GET /api/v1/projects/{project_id}", "GET", f"/api/v1/projects/{self.any_project()}")
+        elif op == "api_bids":
+            await self.request("GET /api/v1/projects/{project_id}/bids", "GET",
+                               f"/api/v1/projects/{self.any_project()}/bids")
+        elif op == "static":
+            await self.request("GET /static/{name}", "GET", self.fx["css_url"], headers={"Accept-Encoding": "br, gzip"})
+        elif op == "login_page":
+            await self.request("GET /login", "GET", "/login")
+        elif op == "register_page":
+            await self.request("GET /register", "GET", "/register")
+        elif op == "register":
+            name = f"bench_r{self.index}_{self.rng.getrandbits(40):x}"
+            await self.request("POST /register", "POST", "/register", data={
+                "username": name, "password": BENCH_PASSWORD, "password2": BENCH_PASSWORD,
+                "role": "freelancer", "full_name": name, "agree": "1"})
+        elif op == "healthz":
+            await self.request("GET /healthz", "GET", "/healthz")
+        elif op == "metrics":
+            await self.request("GET /metrics", "GET", "/metrics")
+        else:
+            await self.request("GET /logout", "GET", "/logout")
+
+    # ---- 接案人 ----
+    async def freelancer_step(self):
+        op = self.rng.choices(["list", "tab", "detail", "bid", "download", "api_deliveries", "search", "login"],
+                              [20, 15, 30, 8, 8, 4, 5, 0.5])[0]
+        if op == "login":
+            cur = await self.db.execute("SELECT username FROM users WHERE id=%s", (self.user_id,))
+            await self.login(self.http, (await cur.fetchone())[0])
+        elif op == "list":
+            await self.request("GET /", "GET", "/")
+        elif op == "tab":
+            await self.request("GET /", "GET", "/", params={"tab": self.rng.choice(["progress", "closed"])})
+        elif op == "detail":
+            await self.request("GET /projects/{id}", "GET", f"/projects/{self.any_project()}")
+        elif op == "bid":
+            pid = self.open_project()
+            await self.request("POST /bids/{project_id}", "POST", f"/bids/{pid}",
+                               data={"price": str(self.rng.randint(5, 400) * 250), "message": "bench"})
+        elif op == "search":
+            await self.request("GET /search", "GET", "/search", params={"q": self.rng.choice(SEARCH_WORDS)})
+        else:
+            row = await self.one("""
+                SELECT d.id, d.project_id FROM deliveries d WHERE d.freelancer_id=%s
+                ORDER BY d.id DESC OFFSET %s LIMIT 1
+            """, (self.user_id, self.rng.randint(0, 3)))
+            if not row:
+                return
+            if op == "download" and self.rng.random() < 0.2:
+                # 不是圖片的會轉到原檔（302），只量這一跳
+                await self.request("GET /deliveries/{delivery_id}/preview/{variant}", "GET",
+                                   f"/deliveries/{row[0]}/preview/thumb")
+            elif op == "download":
+                await self.request("GET /deliveries/{delivery_id}/download", "GET", f"/deliveries/{row[0]}/download",
+                                   headers={"Range": "bytes=0-65535"} if self.rng.random() < 0.3 else None)
+            else:
+                await self.request("GET /api/v1/projects/{project_id}/deliveries", "GET",
+                                   f"/api/v1/projects/{row[1]}/deliveries")
+
+    # ---- 委託人：整個專案流程 ----
+    async def client_step(self):
+        op = self.rng.choices(["list", "tab", "detail", "lifecycle", "delete"], [20, 15, 20, 4, 1])[0]
+        if op == "list":
+            await self.request("GET /", "GET", "/")
+        elif op == "tab":
+            await self.request("GET /", "GET", "/", params={"tab": self.rng.choice(["progress", "closed"])})
+        elif op == "detail":
+            row = await self.one("SELECT id FROM projects WHERE client_id=%s ORDER BY id DESC OFFSET %s LIMIT 1",
+                                 (self.user_id, self.rng.randint(0, 20)))
+            if row:
+                await self.request("GET /projects/{id}", "GET", f"/projects/{row[0]}")
+        elif op == "delete":
+            pid = await self.create_project()
+            if pid:
+                await self.request("POST /projects/{project_id}/delete", "POST", f"/projects/{pid}/delete")
+        else:
+            await self.lifecycle()
+
+    async def create_project(self):
+        await self.request("GET /projects/create", "GET", "/projects/create")
+        title = f"{self.rng.choice(CATEGORIES)} bench {self.rng.getrandbits(32):x}"
+        await self.request("POST /projects/create", "POST", "/projects/create",
+                           data={"title": title, "description": "bench 專案", "budget": "5000"})
+        row = await self.one("SELECT id FROM projects WHERE client_id=%s AND title=%s ORDER BY id DESC LIMIT 1",
+                             (self.user_id, title))
+        return row and row[0]
+
+    async def upload(self, pid):
+        body = self.rng.randbytes(self.args.upload_size)
+        await self.request("POST /deliveries/{project_id}", "POST", f"/deliveries/{pid}", client=self.partner,
+                           files={"file": (f"bench-{pid}.bin", body, "application/octet-stream")},
+                           data={"note": "bench"})
+
+    async def lifecycle(self):
+        # 建立 → 編輯 → 報價 → 得標 → 上傳 → 下載 / zip → 退件 → 重新上傳 → 結案
+        pid = await self.create_project()
+        if not pid:
+            return
+        await self.request("GET /projects/{project_id}/edit", "GET", f"/projects/{pid}/edit")
+        await self.request("POST /projects/{project_id}/edit", "POST", f"/projects/{pid}/edit",
+                           data={"title": f"bench edited {pid}", "description": "bench 專案（已修改）"})
+        await self.request("POST /bids/{project_id}", "POST", f"/bids/{pid}", client=self.partner,
+                           data={"price": "4000", "message": "bench"})
+        row = await self.one("SELECT id FROM bids WHERE project_id=%s AND freelancer_id=%s", (pid, self.partner_id))
+        if not row:
+            return
+        await self.request("POST /projects/{project_id}/award/{bid_id}", "POST", f"/projects/{pid}/award/{row[0]}")
+        await self.upload(pid)
+        row = await self.one("SELECT id FROM deliveries WHERE project_id=%s ORDER BY id DESC LIMIT 1", (pid,))
+        if row:
+            await self.request("GET /projects/{id}", "GET", f"/projects/{pid}")
+            await self.request("GET /deliveries/{delivery_id}/download", "GET", f"/deliveries/{row[0]}/download")
+            await self.request("GET /projects/{project_id}/deliveries.zip", "GET", f"/projects/{pid}/deliveries.zip")
+        await self.request("POST /projects/{project_id}/reject", "POST", f"/projects/{pid}/reject")
+        await self.upload(pid)
+        await self.request("POST /projects/{project_id}/close", "POST", f"/projects/{pid}/close")
+
+    async def loop(self, deadline):
+        step = {"guest": self.guest_step, "client": self.client_step, "freelancer": self.freelancer_step}[self.role]
+        while time.monotonic() < deadline:
+            await step()
+
+
+# ----------------
+# 執行
+# ----------------
+async def load_fixtures(args):
+    async with await psycopg.AsyncConnection.connect(CONNINFO) as conn:
+        cur = await conn.execute("""
+            SELECT count(*) FILTER (WHERE role='client'), count(*) FILTER (WHERE role='freelancer')
+            FROM users WHERE username LIKE %s AND username NOT LIKE 'bench\\_r%%'
+        """, (BENCH_PREFIX,))
+        clients, freelancers = await cur.fetchone()
+        if not clients or not freelancers:
+            sys.exit("no bench data; run `python seed.py` first")
+        cur = await conn.execute("""
+            SELECT p.id, p.status FROM projects p JOIN users u ON u.id = p.client_id
+            WHERE u.username LIKE %s ORDER BY p.id
+        """, (BENCH_PREFIX,))
+        rows = await cur.fetchall()
+        cur = await conn.execute("""
+            SELECT (SELECT count(*) FROM users), (SELECT count(*) FROM projects),
+                   (SELECT count(*) FROM bids), (SELECT count(*) FROM deliveries)
+        """)
+        dataset = dict(zip(("users", "projects", "bids", "deliveries"), await cur.fetchone()))
+    rng = random.Random(args.seed)
+    projects = [pid for pid, _ in rows]
+    open_projects = [pid for pid, st in rows if st == "open"]
+    sample = lambda items: rng.sample(items, min(len(items), args.sample))  # noqa: E731
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout) as http:
+        html = (await http.get("/login")).text
+    m = re.search(r'href="(/static/[^"]+\.css)"', html)
+    return {
+        "client_count": clients, "freelancer_count": freelancers,
+        "projects": sample(projects), "open_projects": sample(open_projects) or sample(projects),
+        "css_url": m.group(1) if m else "/www/style.css",
+        "dataset": dataset,
+    }
+
+
+def roles_for(args):
+    if args.scenario != "mixed":
+        return [args.scenario] * args.concurrency
+    # 依比例交錯分配（並行數少時每種角色也都會有）
+    total = sum(ROLE_WEIGHTS.values())
+    assigned = dict.fromkeys(ROLE_WEIGHTS, 0)
+    roles = []
+    for i in range(args.concurrency):
+        role = max(ROLE_WEIGHTS, key=lambda r: ROLE_WEIGHTS[r] * (i + 1) / total - assigned[r] + (r == "client"))
+        assigned[role] += 1
+        roles.append(role)
+    return roles
+
+
+def git_meta():
+    def git(*cmd):
+        try:
+            return subprocess.run(["git", *cmd], capture_output=True, text=True, timeout=10).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ""
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+async def run(args):
+    fixtures = await load_fixtures(args)
+    rec = Recorder()
+    users = [VirtualUser(i, role, args, fixtures, rec) for i, role in enumerate(roles_for(args))]
+    await asyncio.gather(*(u.setup() for u in users))
+    try:
+        if args.warmup:
+            await asyncio.gather(*(u.loop(time.monotonic() + args.warmup) for u in users))
+        rec.recording = True
+        started = datetime.now(timezone.utc)
+        t0 = time.monotonic()
+        await asyncio.gather(*(u.loop(t0 + args.duration) for u in users))
+        elapsed = time.monotonic() - t0
+        rec.recording = False
+    finally:
+        await asyncio.gather(*(u.close() for u in users))
+
+    all_samples = [s for samples in rec.samples.values() for s in samples]
+    return {
+        "meta": {
+            **git_meta(),
+            "started_at": started.isoformat(timespec="seconds"),
+            "base_url": args.base_url,
+            "scenario": args.scenario,
+            "concurrency": args.concurrency,
+            "duration_s": round(elapsed, 2),
+            "warmup_s": args.warmup,
+            "seed": args.seed,
+            "upload_size": args.upload_size,
+            "python": platform.python_version(),
+            "dataset": fixtures["dataset"],
+        },
+        "total": summarize(all_samples, elapsed),
+        "routes": {name: summarize(samples, elapsed) for name, samples in sorted(rec.samples.items())},
+    }
+
+
+def print_table(result):
+    print(f"{'route':50} {'req':>7} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, s in [*result["routes"].items(), ("TOTAL", result["total"])]:
+        print(f"{name:50} {s['requests']:>7} {s['errors']:>5} {s['rps']:>8} "
+              f"{s['p50_ms']:>8} {s['p95_ms']:>8} {s['p99_ms']:>8}")
+
+
+def compare(old_path, new_path, threshold):
+    old, new = (json.load(open(p, encoding="utf-8")) for p in (old_path, new_path))
+    print(f"old: {old['meta'].get('commit', '')[:10]}  new: {new['meta'].get('commit', '')[:10]}")
+    print(f"{'route':50} {'p95 old':>9} {'p95 new':>9} {'Δ%':>7} {'rps old':>9} {'rps new':>9}")
+    regressions = 0
+    rows = [(n, old["routes"].get(n), new["routes"][n]) for n in new["routes"]]
+    rows.append(("TOTAL", old["total"], new["total"]))
+    for name, o, n in rows:
+        if not o or not o["p95_ms"] or not n["p95_ms"]:
+            print(f"{name:50} {'-':>9} {n['p95_ms']!s:>9}")
+            continue
+        delta = (n["p95_ms"] - o["p95_ms"]) / o["p95_ms"] * 100
+        flag = "  <-- slower" if delta > threshold else ""
+        regressions += bool(flag)
+        print(f"{name:50} {o['p95_ms']:>9} {n['p95_ms']:>9} {delta:>+7.1f} {o['rps']:>9} {n['rps']:>9}{flag}")
+    return 1 if regressions else 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="壓力測試（先跑 seed.py）")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run")
+    r.add_argument("--base-url", default="http://127.0.0.1:8000")
+    r.add_argument("--scenario", choices=["mixed", "guest", "client", "freelancer"], default="mixed")
+    r.add_argument("-c", "--concurrency", type=int, default=16)
+    r.add_argument("-d", "--duration", type=float, default=30.0, help="量測秒數")
+    r.add_argument("--warmup", type=float, default=5.0, help="先跑幾秒不計（填快取、連線池）")
+    r.add_argument("--seed", type=int, default=42)
+    r.add_argument("--sample", type=int, default=5000, help="隨機挑多少個專案 id 來打")
+    r.add_argument("--upload-size", type=int, default=256 * 1024)
+    r.add_argument("--timeout", type=float, default=30.0)
+    r.add_argument("--out", help="結果寫到這個 JSON 檔（不給就印到 stdout）")
+    c = sub.add_parser("compare")
+    c.add_argument("old")
+    c.add_argument("new")
+    c.add_argument("--threshold", type=float, default=10.0, help="p95 變慢超過幾 %% 算退步")
+    args = ap.parse_args()
+
+    if args.cmd == "compare":
+        return compare(args.old, args.new, args.threshold)
+
+    result = asyncio.run(run(args))
+    print_table(result)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"wrote {args.out}")
+    else:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
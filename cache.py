@@ -0,0 +1,158 @@
+# cache.py
+# 訪客頁面快取：未登入的人看到的首頁列表 / 專案頁內容都一樣，render 好的 HTML 存在記憶體裡。
+# 每筆有 TTL，超過 CACHE_MAX_ENTRIES 筆就丟掉最久沒用的（LRU）；
+# 寫入的路由會依標籤（"list"、"project:<id>"）精準清掉相關頁面。
+# 回應帶 ETag，瀏覽器重看時送 If-None-Match，對得上就直接 304，完全不碰資料庫。
+# 查資料庫期間有人清了同一個標籤，查到的可能是舊的：查之前先記下標籤的世代（generation），
+# put 時世代變了就不存（這次照樣回給訪客，只是不快取），不然舊頁面會再留 TTL 秒。
+# 快取在各個 worker 行程自己的記憶體裡；其他 worker 改了專案時，events.py 收到 NOTIFY 會跟著清（沒收到的話靠 TTL 過期）。
+# 另外有片段快取（fragment）：登入後的首頁每個人不同、不能整頁快取，但每張專案卡片 render 好的 HTML
+# 可以共用；key 裡帶專案的 version，專案一改 key 就變了，舊的卡片用不到、慢慢被 LRU 擠掉。
+import hashlib
+import time
+from collections import OrderedDict, defaultdict
+
+from fastapi.responses import Response
+
+CACHE_TTL = 30.0          # 秒
+CACHE_MAX_ENTRIES = 512   # 最多幾頁
+FRAGMENT_MAX_ENTRIES = 4096  # 片段最多幾個
+GENERATION_SLOTS = 1024   # 標籤的世代依雜湊分到固定幾格（撞到只是少存一次，不會越長越大）
+
+LIST_TAG = "list"
+
+_entries = OrderedDict()   # key -> {"body", "etag", "media_type", "tags", "expires"}
+_keys_by_tag = defaultdict(set)
+_fragments = OrderedDict()  # key -> render 好的 HTML（Markup）
+_generations = [0] * (GENERATION_SLOTS + 1)  # 最後一格給 clear()
+_stats = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0, "evictions": 0,
+          "stale_puts": 0, "fragment_hits": 0, "fragment_misses": 0}
+
+
+def project_tag(project_id):
+    return f"project:{project_id}"
+
+
+def guest_key(request):
+    # 只快取訪客；登入的人頁面內容因人而異，回傳 None 表示不快取
+    if request.session.get("user"):
+        return None
+    return request.url.path + ("?" + request.url.query if request.url.query else "")
+
+
+def _slot(tag):
+    return hash(tag) % GENERATION_SLOTS
+
+
+def generation(*tags):
+    # 查資料庫之前呼叫，結果交給 put(since=...)
+    return tuple(_generations[_slot(tag)] for tag in tags) + (_generations[-1],)
+
+
+def make_etag(body):
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _drop(key):
+    entry = _entries.pop(key, None)
+    if entry:
+        for tag in entry["tags"]:
+            keys = _keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del _keys_by_tag[tag]
+
+
+def get(key):
+    entry = _entries.get(key)
+    if entry is None or entry["expires"] <= time.monotonic():
+        if entry is not None:
+            _drop(key)
+        _stats["misses"] += 1
+        return None
+    _entries.move_to_end(key)  # 最近用過，排到最後
+    _stats["hits"] += 1
+    return entry
+
+
+def put(key, body, media_type, tags, ttl=CACHE_TTL, since=None):
+    entry = {
+        "body": body,
+        "etag": make_etag(body),
+        "media_type": media_type,
+        "tags": tuple(tags),
+        "expires": time.monotonic() + ttl,
+    }
+    if since is not None and since != generation(*entry["tags"]):
+        _stats["stale_puts"] += 1   # 查的時候被清過，內容可能是舊的：回傳但不存
+        return entry
+    _drop(key)
+    _entries[key] = entry
+    for tag in entry["tags"]:
+        _keys_by_tag[tag].add(key)
+    while len(_entries) > CACHE_MAX_ENTRIES:
+        _drop(next(iter(_entries)))
+        _stats["evictions"] += 1
+    return entry
+
+
+def invalidate(*tags):
+    # 寫入 commit 之後呼叫
+    for tag in tags:
+        _generations[_slot(tag)] += 1
+        for key in list(_keys_by_tag.get(tag, ())):
+            _drop(key)
+    _stats["invalidations"] += 1
+
+
+def invalidate_project(project_id):
+    # 專案內容或狀態改了：專案頁 + 所有列表頁（狀態會影響在哪個分頁出現）
+    invalidate(project_tag(project_id), LIST_TAG)
+
+
+def clear():
+    _generations[-1] += 1
+    _entries.clear()
+    _keys_by_tag.clear()
+
+
+# ----------------
+# 片段快取
+# ----------------
+def fragment(key, render):
+    """key 要包含所有會影響內容的東西（版本、角色……）；沒有就呼叫 render() 產生並存起來"""
+    html = _fragments.get(key)
+    if html is not None:
+        _fragments.move_to_end(key)
+        _stats["fragment_hits"] += 1
+        return html
+    _stats["fragment_misses"] += 1
+    html = _fragments[key] = render()
+    while len(_fragments) > FRAGMENT_MAX_ENTRIES:
+        _fragments.popitem(last=False)
+    return html
+
+
+def etag_matches(request, etag):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [t.strip().removeprefix("W/") for t in header.split(",")]
+    return etag in candidates
+
+
+def respond(request, entry):
+    # Vary: Cookie — 同一個網址登入後內容不同，中間的 proxy 不能混用
+    headers = {"ETag": entry["etag"], "Cache-Control": "no-cache", "Vary": "Cookie"}
+    if etag_matches(request, entry["etag"]):
+        _stats["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    return Response(entry["body"], media_type=entry["media_type"], headers=headers)
+
+
+def cache_stats():
+    return dict(_stats, entries=len(_entries), max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL,
+                fragments=len(_fragments))
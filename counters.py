@@ -0,0 +1,154 @@
+# counters.py
+# 首頁統計數字：平常由 DB trigger 即時維護（migrations/0002_project_counters.sql），這裡負責讀取與重算
+# 專案的報價摘要（project_bid_stats，migrations/0007_bid_stats.sql）也一起檢查 / 重算
+#   python counters.py rebuild   從 projects / bids 重新計算整張計數表與報價摘要
+#   python counters.py check     只比對，不修改；有差異時 exit code = 1
+import sys
+
+from db import get_conn
+
+# 從原始資料表算出應有的數字（和 project_counters 同欄位）；已搬到 archive 的專案一樣算「已結案」
+EXPECTED_SQL = """
+    SELECT 'client' AS scope, p.client_id AS user_id,
+           COUNT(*) FILTER (WHERE project_bucket(p.status)='open')     AS open_count,
+           COUNT(*) FILTER (WHERE project_bucket(p.status)='progress') AS progress_count,
+           COUNT(*) FILTER (WHERE project_bucket(p.status)='closed')   AS closed_count
+    FROM all_projects p
+    GROUP BY p.client_id
+    UNION ALL
+    SELECT 'freelancer', b.freelancer_id,
+           COUNT(*) FILTER (WHERE project_bucket(p.status)='open'),
+           COUNT(*) FILTER (WHERE project_bucket(p.status)='progress'),
+           COUNT(*) FILTER (WHERE project_bucket(p.status)='closed')
+    FROM all_projects p
+    JOIN all_bids b ON b.id = p.awarded_bid_id
+    GROUP BY b.freelancer_id
+    UNION ALL
+    SELECT 'global', 0,
+           COUNT(*) FILTER (WHERE project_bucket(p.status)='open'),
+           COUNT(*) FILTER (WHERE project_bucket(p.status)='progress'),
+           COUNT(*) FILTER (WHERE project_bucket(p.status)='closed')
+    FROM all_projects p
+"""
+
+
+async def dashboard_stats(conn, user):
+    """
+    首頁分頁籤上的數字，一次查詢、只讀主鍵。
+    委託人：自己發的案子；接案人：全站可接案 + 自己得標的進行中 / 已結案。
+    """
+    stats = {"open": 0, "progress": 0, "closed": 0}
+    if not user or user["role"] not in ("client", "freelancer"):
+        return stats
+
+    async with conn.cursor() as cur:
+        await cur.execute("""
+            SELECT scope, open_count, progress_count, closed_count
+            FROM project_counters
+            WHERE (scope=%s AND user_id=%s) OR (scope='global' AND user_id=0)
+        """, (user["role"], user["id"]))
+        rows = {scope: (o, p, c) for (scope, o, p, c) in await cur.fetchall()}
+
+    mine = rows.get(user["role"], (0, 0, 0))
+    stats["open"], stats["progress"], stats["closed"] = mine
+    if user["role"] == "freelancer":
+        stats["open"] = rows.get("global", (0, 0, 0))[0]  # 可接案 = 全站投放中
+    return stats
+
+
+def rebuild(conn):
+    # 鎖住 projects 寫入，重算期間不會有人改到數字
+    with conn.cursor() as cur:
+        cur.execute("LOCK TABLE projects IN SHARE MODE")
+        cur.execute("DELETE FROM project_counters")
+        cur.execute(f"""
+            INSERT INTO project_counters (scope, user_id, open_count, progress_count, closed_count)
+            {EXPECTED_SQL}
+        """)
+        n = cur.rowcount
+    conn.commit()
+    return n
+
+
+def diff(conn):
+    # 回傳 [(scope, user_id, 目前值, 應有值)]；0 和「沒有這列」視為相同
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            WITH expected AS ({EXPECTED_SQL})
+            SELECT COALESCE(e.scope, c.scope), COALESCE(e.user_id, c.user_id),
+                   ARRAY[c.open_count, c.progress_count, c.closed_count],
+                   ARRAY[e.open_count, e.progress_count, e.closed_count]
+            FROM expected e
+            FULL JOIN project_counters c ON c.scope = e.scope AND c.user_id = e.user_id
+            WHERE COALESCE(c.open_count, 0) <> COALESCE(e.open_count, 0)
+               OR COALESCE(c.progress_count, 0) <> COALESCE(e.progress_count, 0)
+               OR COALESCE(c.closed_count, 0) <> COALESCE(e.closed_count, 0)
+            ORDER BY 1, 2
+        """)
+        return cur.fetchall()
+
+
+# ----------------
+# 報價摘要
+# ----------------
+BID_STATS_SQL = """
+    SELECT project_id, count(*) AS bid_count, min(price) AS min_price, max(price) AS max_price,
+           round(percentile_cont(0.5) WITHIN GROUP (ORDER BY price))::int AS median_price,
+           max(created_at) AS last_bid_at
+    FROM bids
+    GROUP BY project_id
+"""
+
+
+def rebuild_bid_stats(conn):
+    with conn.cursor() as cur:
+        cur.execute("LOCK TABLE bids IN SHARE MODE")
+        cur.execute("DELETE FROM project_bid_stats")
+        cur.execute(f"""
+            INSERT INTO project_bid_stats (project_id, bid_count, min_price, max_price, median_price, last_bid_at)
+            {BID_STATS_SQL}
+        """)
+        n = cur.rowcount
+    conn.commit()
+    return n
+
+
+def bid_stats_diff(conn):
+    # 回傳 [(project_id, 目前值, 應有值)]；沒有報價的專案可以沒有這一列，或是 0 筆
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            WITH expected AS ({BID_STATS_SQL})
+            SELECT COALESCE(e.project_id, s.project_id),
+                   ARRAY[s.bid_count, s.min_price, s.max_price, s.median_price]::text || ' ' || COALESCE(s.last_bid_at::text, '-'),
+                   ARRAY[e.bid_count, e.min_price, e.max_price, e.median_price]::text || ' ' || COALESCE(e.last_bid_at::text, '-')
+            FROM expected e
+            FULL JOIN project_bid_stats s ON s.project_id = e.project_id
+            WHERE COALESCE(s.bid_count, 0) <> COALESCE(e.bid_count, 0)
+               OR s.min_price IS DISTINCT FROM e.min_price
+               OR s.max_price IS DISTINCT FROM e.max_price
+               OR s.median_price IS DISTINCT FROM e.median_price
+               OR s.last_bid_at IS DISTINCT FROM e.last_bid_at
+            ORDER BY 1
+        """)
+        return cur.fetchall()
+
+
+if __name__ == "__main__":
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    with get_conn() as conn:
+        if cmd == "rebuild":
+            print(f"rebuilt {rebuild(conn)} counter rows")
+            print(f"rebuilt {rebuild_bid_stats(conn)} bid summary rows")
+        elif cmd == "check":
+            rows = diff(conn)
+            for scope, uid, have, want in rows:
+                print(f"{scope} {uid}: have {have}, want {want}")
+            print("counters OK" if not rows else f"{len(rows)} counter rows drifted")
+            stats = bid_stats_diff(conn)
+            for pid, have, want in stats:
+                print(f"project {pid}: have {have}, want {want}")
+            print("bid stats OK" if not stats else f"{len(stats)} bid summary rows drifted")
+            sys.exit(1 if rows or stats else 0)
+        else:
+            print("usage: python counters.py rebuild|check")
+            sys.exit(2)
@@ -0,0 +1,329 @@
+# datacopy.py
+# 資料搬家（例如正式機 → 測試機）：每張表用 PostgreSQL COPY 串流匯出 / 匯入成 CSV 或 JSONL，
+# 一次只讀寫一小塊，幾百萬筆記憶體用量也一樣。
+#   python datacopy.py export DIR [--format csv|jsonl] [--gzip] [--tables users,projects,...]
+#   python datacopy.py import DIR [--truncate] [--tables ...]
+# 匯出在同一個 REPEATABLE READ 快照裡做，各表之間一致；DIR/manifest.json 記錄格式、欄位、筆數、migration 版本。
+# 匯入依外鍵順序（users → blobs → projects → bids → deliveries）；像 projects.awarded_bid_id ↔ bids 這種循環，
+# 先用 NULL 匯入，等另一邊進來後再補上。最後把 id 的 sequence 調到 max(id) 之後、重算首頁計數、ANALYZE。
+# 整個匯入在一個交易裡，中途失敗什麼都不會留下。
+# --truncate 只清要匯入的表（加上跟著重算的 project_bid_stats）；還有別的表用外鍵指著它們就不做，
+# 例如只匯 users 會被 projects / bids 擋下來，要一起列進 --tables。
+# 注意：結案檔案的實體檔（www/uploads）不在這裡搬，請另外複製目錄。
+import argparse
+import csv
+import gzip
+import io
+import json
+import re
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import psycopg
+from psycopg import sql
+
+from db import CONNINFO
+import counters
+
+# 預設搬的表（計數表匯入後重算，jobs 不搬）；archive 的報價摘要不會再變、沒有 trigger 重算，要跟著搬
+TABLES = ("users", "blobs", "projects", "bids", "deliveries",
+          "projects_archive", "bids_archive", "deliveries_archive", "project_bid_stats_archive")
+# archive 表的 id 沿用原本的表（archive.py 原封不動搬過去），調 sequence 時兩邊都要看
+ARCHIVES = {"projects": "projects_archive", "bids": "bids_archive", "deliveries": "deliveries_archive"}
+# 由 trigger 維護、外鍵指到這些表的資料：清空時一起清，匯入報價時 trigger 會重新算
+DERIVED = {"projects": ("project_bid_stats",), "bids": ("project_bid_stats",)}
+CHUNK_SIZE = 1024 * 1024
+# JSONL 借用 COPY 的 csv 格式輸出：選兩個 JSON 裡不會出現的控制字元當引號 / 分隔，一列就是一個 JSON
+JSONL_OPTIONS = "FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02'"
+
+
+# ----------------
+# 讀資料表結構
+# ----------------
+def table_columns(conn, table):
+    # 一般欄位（generated column 例如 projects.search_vector 會自己算，不搬）
+    rows = conn.execute("""
+        SELECT attname FROM pg_attribute
+        WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = ''
+        ORDER BY attnum
+    """, (table,)).fetchall()
+    return [r[0] for r in rows]
+
+
+def primary_key(conn, table):
+    rows = conn.execute("""
+        SELECT a.attname FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = %s::regclass AND i.indisprimary
+        ORDER BY array_position(i.indkey, a.attnum)
+    """, (table,)).fetchall()
+    return [r[0] for r in rows]
+
+
+def all_foreign_keys(conn):
+    # [(子表, 母表, [欄位], 欄位都可以是 NULL)]
+    return conn.execute("""
+        SELECT c.conrelid::regclass::text, c.confrelid::regclass::text,
+               array_agg(a.attname ORDER BY a.attnum), bool_and(NOT a.attnotnull)
+        FROM pg_constraint c
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+        WHERE c.contype = 'f'
+        GROUP BY c.oid, c.conrelid, c.confrelid
+    """).fetchall()
+
+
+def foreign_keys(conn, tables):
+    # 只看這次要搬的表之間的外鍵
+    return [(child, parent, cols, nullable) for child, parent, cols, nullable in all_foreign_keys(conn)
+            if child in tables and parent in tables and child != parent]
+
+
+def truncate_targets(conn, tables):
+    """--truncate 要清的表：要匯入的表 + DERIVED；別的表有外鍵指進來就不清（不用 CASCADE 順便清掉）"""
+    targets = list(tables)
+    for table in tables:
+        targets += [t for t in DERIVED.get(table, ()) if t not in targets]
+    blocked = sorted({child for child, parent, _, _ in all_foreign_keys(conn)
+                      if parent in targets and child not in targets})
+    if blocked:
+        raise SystemExit(f"cannot truncate {targets}: {blocked} reference them (add them to --tables)")
+    return targets
+
+
+def load_order(conn, tables):
+    """
+    依外鍵排出匯入順序（母表在前）。遇到循環就挑一條可以為 NULL 的外鍵先拿掉，
+    回傳 (順序, {表: [先以 NULL 匯入、最後再補的欄位]})。
+    """
+    edges = foreign_keys(conn, tables)
+    deferred = {}
+    order, remaining = [], list(tables)
+    while remaining:
+        ready = [t for t in remaining
+                 if not any(child == t and parent in remaining for child, parent, _, _ in edges)]
+        if not ready:
+            cycle = [e for e in edges if e[0] in remaining and e[1] in remaining and e[3]]
+            if not cycle:
+                raise SystemExit(f"foreign keys form a cycle with NOT NULL columns: {remaining}")
+            child, parent, cols, _ = cycle[0]
+            deferred.setdefault(child, []).extend(cols)
+            edges.remove(cycle[0])
+            continue
+        for t in ready:   # 同一層照原本給的順序
+            order.append(t)
+            remaining.remove(t)
+    return order, deferred
+
+
+def id_sequences(conn, table):
+    # [(欄位, sequence 名稱)]：serial 或 DEFAULT nextval('xxx_seq') 都算（docs/schema.sql 是後者）
+    rows = conn.execute("""
+        SELECT a.attname, pg_get_expr(d.adbin, d.adrelid)
+        FROM pg_attrdef d
+        JOIN pg_attribute a ON a.attrelid = d.adrelid AND a.attnum = d.adnum
+        WHERE d.adrelid = %s::regclass
+    """, (table,)).fetchall()
+    out = []
+    for col, expr in rows:
+        m = re.match(r"nextval\('([^']+)'::regclass\)", expr or "")
+        if m:
+            out.append((col, m.group(1)))
+    return out
+
+
+def schema_version(conn):
+    try:
+        return conn.execute("SELECT max(version) FROM schema_migrations").fetchone()[0]
+    except psycopg.errors.UndefinedTable:
+        conn.rollback()
+        return None
+
+
+# ----------------
+# 檔案
+# ----------------
+def data_path(directory, table, fmt, gz):
+    return Path(directory) / f"{table}.{fmt}{'.gz' if gz else ''}"
+
+
+def open_file(path, mode):
+    return gzip.open(path, mode, compresslevel=6) if str(path).endswith(".gz") else open(path, mode)
+
+
+# ----------------
+# 匯出
+# ----------------
+def export_table(conn, table, path, fmt):
+    cols = table_columns(conn, table)
+    order = primary_key(conn, table) or cols[:1]
+    select = sql.SQL("SELECT {} FROM {} ORDER BY {}").format(
+        sql.SQL(", ").join(map(sql.Identifier, cols)), sql.Identifier(table),
+        sql.SQL(", ").join(map(sql.Identifier, order)))
+    if fmt == "csv":
+        copy_sql = sql.SQL("COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER true)").format(select)
+    else:
+        copy_sql = sql.SQL("COPY (SELECT row_to_json(t) FROM ({}) t) TO STDOUT WITH ({})").format(
+            select, sql.SQL(JSONL_OPTIONS))
+    with conn.cursor() as cur, open_file(path, "wb") as f:
+        with cur.copy(copy_sql) as copy:
+            for chunk in copy:
+                f.write(chunk)
+        return cols, cur.rowcount
+
+
+def export(args):
+    tables = args.tables or list(TABLES)
+    out = Path(args.dir)
+    out.mkdir(parents=True, exist_ok=True)
+    manifest = {"format": args.format, "gzip": args.gzip, "tables": {},
+                "exported_at": datetime.now(timezone.utc).isoformat(timespec="seconds")}
+    with psycopg.connect(CONNINFO) as conn:
+        conn.read_only = True
+        conn.isolation_level = psycopg.IsolationLevel.REPEATABLE_READ   # 所有表同一個快照
+        manifest["schema_version"] = schema_version(conn)
+        for table in tables:
+            t = time.perf_counter()
+            path = data_path(out, table, args.format, args.gzip)
+            cols, n = export_table(conn, table, path, args.format)
+            manifest["tables"][table] = {"file": path.name, "columns": cols, "rows": n}
+            print(f"export {table:12} {n:>10} rows  {time.perf_counter() - t:6.1f}s  -> {path}")
+    (out / "manifest.json").write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+# ----------------
+# 匯入
+# ----------------
+def _stage(conn, table, cols, deferred):
+    # 先 COPY 到暫存表，再 INSERT 進正式表：循環外鍵的欄位先放 NULL，其他欄位沒給的用預設值
+    stage = f"_in_{table}"
+    targets = [c for c in cols if c not in deferred]
+    conn.execute(sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {}").format(
+        sql.Identifier(table), sql.SQL(", ").join(map(sql.Identifier, targets)),
+        sql.SQL(", ").join(map(sql.Identifier, targets)), sql.Identifier(stage)))
+
+
+def import_csv(conn, table, path, known):
+    with open_file(path, "rb") as f:
+        header = f.readline().decode("utf-8")
+        cols = next(csv.reader(io.StringIO(header)))
+        unknown = [c for c in cols if c not in known]
+        if unknown:
+            raise SystemExit(f"{path}: columns not in {table}: {unknown}")
+        conn.execute(sql.SQL("CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA").format(
+            sql.Identifier(f"_in_{table}"), sql.SQL(", ").join(map(sql.Identifier, cols)), sql.Identifier(table)))
+        copy_sql = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+            sql.Identifier(f"_in_{table}"), sql.SQL(", ").join(map(sql.Identifier, cols)))
+        with conn.cursor() as cur:
+            with cur.copy(copy_sql) as copy:
+                while chunk := f.read(CHUNK_SIZE):
+                    copy.write(chunk)
+            return cols, cur.rowcount
+
+
+def import_jsonl(conn, table, path, cols):
+    # 每列一個 JSON 物件：先放進 jsonb 暫存表，再用 jsonb_populate_record 轉成正式表的型別
+    conn.execute(sql.SQL("CREATE TEMP TABLE {} (doc jsonb) ON COMMIT DROP").format(sql.Identifier(f"_raw_{table}")))
+    with open_file(path, "rb") as f, conn.cursor() as cur:
+        with cur.copy(sql.SQL("COPY {} (doc) FROM STDIN WITH ({})").format(
+                sql.Identifier(f"_raw_{table}"), sql.SQL(JSONL_OPTIONS))) as copy:
+            while chunk := f.read(CHUNK_SIZE):
+                copy.write(chunk)
+        n = cur.rowcount
+    conn.execute(sql.SQL("CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {}, jsonb_populate_record(NULL::{}, doc) r")
+                 .format(sql.Identifier(f"_in_{table}"),
+                         sql.SQL(", ").join(sql.SQL("r.{}").format(sql.Identifier(c)) for c in cols),
+                         sql.Identifier(f"_raw_{table}"), sql.Identifier(table)))
+    return cols, n
+
+
+def fill_deferred(conn, table, cols):
+    pk = primary_key(conn, table)
+    sets = sql.SQL(", ").join(sql.SQL("{0} = s.{0}").format(sql.Identifier(c)) for c in cols)
+    match = sql.SQL(" AND ").join(sql.SQL("t.{0} = s.{0}").format(sql.Identifier(c)) for c in pk)
+    given = sql.SQL(" OR ").join(sql.SQL("s.{} IS NOT NULL").format(sql.Identifier(c)) for c in cols)
+    conn.execute("SET LOCAL app.keep_version = on")  # 只是補欄位，projects.version 不要加
+    cur = conn.execute(sql.SQL("UPDATE {} t SET {} FROM {} s WHERE {} AND ({})").format(
+        sql.Identifier(table), sets, sql.Identifier(f"_in_{table}"), match, given))
+    return cur.rowcount
+
+
+def fix_sequences(conn, table):
+    sources = [table] + ([ARCHIVES[table]] if table in ARCHIVES else [])
+    for col, seq in id_sequences(conn, table):
+        maxes = sql.SQL(", ").join(sql.SQL("(SELECT max({}) FROM {})").format(sql.Identifier(col), sql.Identifier(t))
+                                   for t in sources)
+        conn.execute(sql.SQL("SELECT setval({}, COALESCE(GREATEST({}), 0) + 1, false)").format(
+            sql.Literal(seq), maxes))
+
+
+def import_(args):
+    src = Path(args.dir)
+    manifest = json.loads((src / "manifest.json").read_text(encoding="utf-8"))
+    tables = [t for t in (args.tables or manifest["tables"]) if t in manifest["tables"]]
+
+    with psycopg.connect(CONNINFO) as conn:
+        version = schema_version(conn)
+        if manifest.get("schema_version") != version:
+            print(f"warning: exported at schema {manifest.get('schema_version')}, target is at {version}")
+        order, deferred = load_order(conn, tables)
+
+        if args.truncate:
+            targets = truncate_targets(conn, tables)
+            conn.execute(sql.SQL("TRUNCATE {}").format(sql.SQL(", ").join(map(sql.Identifier, targets))))
+        else:
+            busy = [t for t in tables
+                    if conn.execute(sql.SQL("SELECT EXISTS (SELECT 1 FROM {})").format(sql.Identifier(t))).fetchone()[0]]
+            if busy:
+                raise SystemExit(f"target tables are not empty: {busy} (use --truncate to replace them)")
+
+        for table in order:
+            t = time.perf_counter()
+            info = manifest["tables"][table]
+            path = src / info["file"]
+            known = table_columns(conn, table)
+            if manifest["format"] == "csv":
+                cols, n = import_csv(conn, table, path, known)
+            else:
+                cols, n = import_jsonl(conn, table, path, [c for c in info["columns"] if c in known])
+            _stage(conn, table, cols, deferred.get(table, ()))
+            later = f" (deferred {', '.join(deferred[table])})" if table in deferred else ""
+            print(f"import {table:12} {n:>10} rows  {time.perf_counter() - t:6.1f}s{later}")
+
+        for table, cols in deferred.items():
+            n = fill_deferred(conn, table, [c for c in cols if c in table_columns(conn, table)])
+            print(f"fill   {table}.{','.join(cols)}  {n} rows")
+        for table in order:
+            fix_sequences(conn, table)
+        if {"projects", "projects_archive"} & set(tables):   # TRUNCATE 不會觸發計數的 trigger，一律重算
+            print(f"rebuilt {counters.rebuild(conn)} counter rows")   # 會一起 commit
+        conn.commit()
+
+        conn.autocommit = True
+        for table in order:
+            conn.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table)))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="以 COPY 匯出 / 匯入資料表（CSV 或 JSONL）")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    e = sub.add_parser("export")
+    e.add_argument("dir")
+    e.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    e.add_argument("--gzip", action="store_true")
+    e.add_argument("--tables", type=lambda s: [t.strip() for t in s.split(",") if t.strip()])
+    i = sub.add_parser("import")
+    i.add_argument("dir")
+    i.add_argument("--truncate", action="store_true", help="先清空目標資料表")
+    i.add_argument("--tables", type=lambda s: [t.strip() for t in s.split(",") if t.strip()])
+    args = ap.parse_args()
+
+    t = time.perf_counter()
+    export(args) if args.cmd == "export" else import_(args)
+    print(f"done in {time.perf_counter() - t:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,27 @@
 # db.py
+# 連線池：寫入 / 交易走主庫；唯讀的頁面（首頁列表、專案頁、搜尋、登入查帳號、API 的 GET）可以分給複本（streaming replica）
+#   DB_PRIMARY_DSN="host=db1 dbname=1141se user=app"            沒設就用下面的常數
+#   DB_REPLICA_DSNS="host=db2 dbname=1141se,host=db3 dbname=1141se"   逗號分隔；沒設就全部走主庫
+# 複本由背景工作每 REPLICA_CHECK_INTERVAL 秒檢查一次：連不上、落後超過 REPLICA_MAX_LAG 秒（或不是複本了）就先踢掉，恢復後自動加回；
+# 剛寫入過的人（session）PIN_SECONDS 秒內的讀取都走主庫，才看得到自己剛改的東西。
+# python db.py status：看主庫 / 每個複本的狀態與延遲
+import asyncio
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass
+from typing import Optional
+
 import psycopg
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import ConnectionPool, AsyncConnectionPool, PoolTimeout
+from starlette.requests import Request
+
+from metrics import TimedCursor, AsyncTimedCursor
 
 DB_NAME = "1141se"
 DB_USER = "postgres"
@@ -7,9 +29,363 @@ DB_PASS = "123"
 DB_HOST = "localhost"
 DB_PORT = 5432
 
+# 連線池設定
+POOL_MIN_SIZE = 2         # 最少保留幾條連線
+POOL_MAX_SIZE = 10        # 最多開幾條連線
+POOL_TIMEOUT = 10.0       # 借不到連線時最多等幾秒（逾時丟 PoolTimeout）
+POOL_MAX_IDLE = 300.0     # 閒置超過幾秒的連線會被回收
+POOL_MAX_LIFETIME = 3600.0  # 單條連線最長使用幾秒後換新
+
+CONNINFO = os.environ.get("DB_PRIMARY_DSN") or make_conninfo(
+    dbname=DB_NAME, user=DB_USER, password=DB_PASS,
+    host=DB_HOST, port=DB_PORT
+)
+REPLICA_DSNS = [d.strip() for d in os.environ.get("DB_REPLICA_DSNS", "").split(",") if d.strip()]
+
+REPLICA_MAX_LAG = float(os.environ.get("REPLICA_MAX_LAG") or 5.0)  # 複本最多可以落後幾秒
+REPLICA_CHECK_INTERVAL = 2.0   # 幾秒檢查一次複本
+REPLICA_CHECK_TIMEOUT = 2.0    # 檢查時連線 / 查詢最多等幾秒
+# 寫入後多久內讀主庫：超過這段時間還沒追上的複本一定已經被踢掉了
+PIN_SECONDS = REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL
+PIN_KEY = "db_pin_until"
+PRIMARY_HEADER = "x-read-primary"  # 帶這個 header 的請求一律讀主庫（live.js 收到事件後重抓頁面用）
+
+log = logging.getLogger("db")
+
+POOL_OPTIONS = dict(
+    min_size=POOL_MIN_SIZE,
+    max_size=POOL_MAX_SIZE,
+    timeout=POOL_TIMEOUT,
+    max_idle=POOL_MAX_IDLE,
+    max_lifetime=POOL_MAX_LIFETIME,
+)
+
+# 網站路由用非同步連線池（apool）；命令列腳本用同步連線池（pool）
+# 都是第一次用到才建立（關閉後可重新建立）
+pool = None
+apool = None
+_open_lock = threading.Lock()
+_aopen_lock = None
+
+
+@dataclass
+class Replica:
+    name: str
+    dsn: str
+    pool: Optional[AsyncConnectionPool] = None
+    healthy: bool = False          # 第一次檢查通過才開始分流量
+    lag: Optional[float] = None    # 秒；None = 不知道
+    error: Optional[str] = None
+    reads: int = 0
+    ejections: int = 0
+    checked_at: float = 0.0
+
+
+replicas = [Replica(f"replica{i}", dsn) for i, dsn in enumerate(REPLICA_DSNS, 1)]
+_monitor = None
+_rr = itertools.count()
+_read_stats = {"primary": 0, "pinned": 0, "fallback": 0}
+
+
+def open_pool():
+    # 同步連線池：腳本直接用 get_conn() 會自動打開
+    global pool
+    with _open_lock:
+        if pool is None:
+            pool = ConnectionPool(
+                CONNINFO,
+                kwargs={"cursor_factory": TimedCursor},  # 每句 SQL 計時（metrics.py）
+                check=ConnectionPool.check_connection,  # 借出前先確認連線還活著
+                name="sync",
+                open=False,
+                **POOL_OPTIONS,
+            )
+            pool.open()
+    return pool
+
+
+def close_pool():
+    global pool
+    with _open_lock:
+        if pool is not None:
+            pool.close()
+            pool = None
+
+
+async def open_async_pool():
+    # 非同步連線池：啟動時（lifespan）呼叫，必須在 event loop 裡打開
+    global apool, _aopen_lock
+    if _aopen_lock is None:
+        _aopen_lock = asyncio.Lock()
+    async with _aopen_lock:
+        if apool is None:
+            apool = AsyncConnectionPool(
+                CONNINFO,
+                kwargs={"cursor_factory": AsyncTimedCursor},
+                check=AsyncConnectionPool.check_connection,
+                name="main",
+                open=False,
+                **POOL_OPTIONS,
+            )
+            await apool.open()
+            await _open_replicas()
+    return apool
+
+
+async def close_async_pool():
+    global apool, _aopen_lock
+    await _close_replicas()
+    if apool is not None:
+        await apool.close()
+        apool = None
+    _aopen_lock = None
+
+
 def get_conn():
-    # 每次用完自動關閉
-    return psycopg.connect(
-        dbname=DB_NAME, user=DB_USER, password=DB_PASS,
-        host=DB_HOST, port=DB_PORT
-    )
+    # 從同步連線池借一條連線；with 區塊結束時自動 commit/rollback 並歸還
+    return open_pool().connection()
+
+
+@asynccontextmanager
+async def connection(timeout=None):
+    # 需要時才借連線（例如先查快取，沒命中才查資料庫）：async with connection() as conn
+    # timeout：借不到最多等幾秒（預設 POOL_TIMEOUT）
+    p = apool or await open_async_pool()
+    async with p.connection(timeout=timeout) as conn:
+        yield conn
+
+
+async def get_db():
+    # FastAPI 依賴：同一個 request 只借一條非同步連線，整個處理過程共用
+    async with connection() as conn:
+        yield conn
+
+
+# ----------------
+# 讀取分流到複本
+# ----------------
+def pin_primary(session):
+    session[PIN_KEY] = time.time() + PIN_SECONDS
+
+
+def is_pinned(request):
+    if request is None:
+        return False
+    if request.headers.get(PRIMARY_HEADER):
+        return True
+    return request.session.get(PIN_KEY, 0) > time.time()
+
+
+def _pick_replica():
+    healthy = [r for r in replicas if r.healthy and r.pool is not None]
+    if not healthy:
+        return None
+    return healthy[next(_rr) % len(healthy)]  # 輪流
+
+
+def _eject(replica, reason):
+    if replica.healthy:
+        replica.ejections += 1
+        log.warning("replica %s ejected: %s", replica.name, reason)
+    replica.healthy = False
+    replica.error = reason
+
+
+@asynccontextmanager
+async def read_connection(request=None):
+    """唯讀查詢用：有健康的複本就借複本的連線，否則（或這個 session 剛寫過）借主庫的"""
+    pinned = is_pinned(request)
+    replica = None if pinned else _pick_replica()
+    async with AsyncExitStack() as stack:
+        conn = None
+        if replica is not None:
+            try:
+                conn = await stack.enter_async_context(replica.pool.connection(timeout=REPLICA_CHECK_TIMEOUT))
+                replica.reads += 1
+            except (PoolTimeout, psycopg.OperationalError) as exc:
+                _eject(replica, f"checkout failed: {exc}")  # 這次改讀主庫，之後等檢查通過再加回
+                replica = None
+                _read_stats["fallback"] += 1
+        if conn is None:
+            conn = await stack.enter_async_context(connection())
+            _read_stats["pinned" if pinned and replicas else "primary"] += 1
+        try:
+            yield conn
+        except psycopg.OperationalError as exc:
+            if replica is not None:
+                _eject(replica, str(exc))
+            raise
+
+
+async def get_read_db(request: Request):
+    # FastAPI 依賴：唯讀路由用這個取代 get_db
+    async with read_connection(request) as conn:
+        yield conn
+
+
+class PrimaryPinMiddleware:
+    """寫入的請求（非 GET / HEAD、沒有失敗）回應時在 session 記下「接下來 PIN_SECONDS 秒讀主庫」。
+    要加在 SessionMiddleware 裡面一層（先 add_middleware 這個，再加 SessionMiddleware）。"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD", "OPTIONS") or not replicas:
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 400 and "session" in scope:
+                pin_primary(scope["session"])
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+# ----------------
+# 複本檢查
+# ----------------
+# 主庫上一輪的 WAL 位置：複本如果連「REPLICA_CHECK_INTERVAL 秒前主庫的位置」都還沒重播到，才算真的落後，
+# 這時延遲 = 現在 - 複本最後重播的交易時間。（主庫閒著的時候最後交易時間會很舊，不能單看它）
+PRIMARY_LSN_SQL = "SELECT pg_current_wal_lsn()::text"
+REPLICA_CHECK_SQL = """
+    SELECT pg_is_in_recovery(),
+           pg_last_wal_replay_lsn() >= %s::pg_lsn,
+           EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())::float8
+"""
+
+
+async def _primary_lsn():
+    try:
+        async with apool.connection(timeout=REPLICA_CHECK_TIMEOUT) as conn:
+            return (await (await conn.execute(PRIMARY_LSN_SQL)).fetchone())[0]
+    except (PoolTimeout, psycopg.Error):
+        return None  # 主庫連不上：只看複本自己還活不活著
+
+
+async def check_replica(replica, primary_lsn):
+    try:
+        async with replica.pool.connection(timeout=REPLICA_CHECK_TIMEOUT) as conn:
+            cur = await conn.execute(REPLICA_CHECK_SQL, (primary_lsn or "0/0",))
+            in_recovery, caught_up, since_replay = await cur.fetchone()
+    except (PoolTimeout, psycopg.Error) as exc:
+        replica.lag = None
+        _eject(replica, f"unreachable: {exc}")
+        return
+    finally:
+        replica.checked_at = time.time()
+
+    if not in_recovery:  # 被 promote 了：不是原本的複本，不能當唯讀用
+        replica.lag = None
+        _eject(replica, "not in recovery")
+        return
+    replica.lag = 0.0 if primary_lsn is None or caught_up else since_replay
+    if replica.lag is None:  # 還沒重播過任何交易又沒追上：不知道落後多少
+        _eject(replica, "lag unknown")
+    elif replica.lag > REPLICA_MAX_LAG:
+        _eject(replica, f"lag {replica.lag:.1f}s > {REPLICA_MAX_LAG}s")
+    elif not replica.healthy:
+        replica.healthy = True
+        replica.error = None
+        log.info("replica %s in rotation (lag %.1fs)", replica.name, replica.lag or 0)
+
+
+async def _check_all(primary_lsn):
+    await asyncio.gather(*(check_replica(r, primary_lsn) for r in replicas))
+
+
+async def _monitor_replicas():
+    previous = await _primary_lsn()
+    while True:
+        await asyncio.sleep(REPLICA_CHECK_INTERVAL)
+        current = await _primary_lsn()
+        await _check_all(previous)
+        previous = current
+
+
+async def _open_replicas():
+    global _monitor
+    if not replicas:
+        return
+    for r in replicas:
+        r.pool = AsyncConnectionPool(
+            r.dsn,
+            kwargs={"cursor_factory": AsyncTimedCursor},
+            check=AsyncConnectionPool.check_connection,
+            name=r.name,
+            open=False,
+            **POOL_OPTIONS,
+        )
+        await r.pool.open()  # 不等連線建好：複本掛著也能啟動
+    await _check_all(await _primary_lsn())  # 第一輪：跟現在的主庫比
+    _monitor = asyncio.create_task(_monitor_replicas(), name="replica-monitor")
+
+
+async def _close_replicas():
+    global _monitor
+    if _monitor is not None:
+        _monitor.cancel()
+        try:
+            await _monitor
+        except asyncio.CancelledError:
+            pass
+        _monitor = None
+    for r in replicas:
+        if r.pool is not None:
+            await r.pool.close()
+            r.pool = None
+        r.healthy = False
+
+
+def replica_stats():
+    return {
+        "reads": dict(_read_stats),
+        "replicas": [{"name": r.name, "healthy": r.healthy, "lag": r.lag, "error": r.error,
+                      "reads": r.reads, "ejections": r.ejections,
+                      "in_use": pool_stats(r.pool)["in_use"] if r.pool else 0} for r in replicas],
+    }
+
+
+def pool_stats(p=None):
+    # 連線池統計：使用中數量、等待時間、借用失敗次數等（預設看網站用的 apool）
+    p = p or apool
+    s = p.get_stats() if p is not None else {}
+    return {
+        "size": s.get("pool_size", 0),
+        "available": s.get("pool_available", 0),
+        "in_use": s.get("pool_size", 0) - s.get("pool_available", 0),
+        "min_size": s.get("pool_min", POOL_MIN_SIZE),
+        "max_size": s.get("pool_max", POOL_MAX_SIZE),
+        "requests_waiting": s.get("requests_waiting", 0),
+        "requests_total": s.get("requests_num", 0),
+        "requests_queued": s.get("requests_queued", 0),
+        "wait_ms_total": s.get("requests_wait_ms", 0),
+        "checkout_failures": s.get("requests_errors", 0),
+        "connections_opened": s.get("connections_num", 0),
+        "connections_errors": s.get("connections_errors", 0),
+        "connections_lost": s.get("connections_lost", 0),
+        "returns_bad": s.get("returns_bad", 0),
+    }
+
+
+if __name__ == "__main__":
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd != "status":
+        print("usage: python db.py status")
+        sys.exit(2)
+
+    async def status():
+        await open_async_pool()
+        try:
+            print(f"primary  {await _primary_lsn() or 'unreachable'}")
+            for r in replicas:
+                state = "ok" if r.healthy else f"ejected ({r.error})"
+                lag = "-" if r.lag is None else f"{r.lag:.2f}s"
+                print(f"{r.name:8} lag {lag:>8}  {state}")
+            if not replicas:
+                print("no replicas configured (DB_REPLICA_DSNS)")
+            return all(r.healthy for r in replicas)
+        finally:
+            await close_async_pool()
+
+    sys.exit(0 if asyncio.run(status()) else 1)
@@ -0,0 +1,8 @@
+# deps.py
+# HTML 頁面與 /api 共用的小工具
+from fastapi import Request
+
+
+def current_user(request: Request):
+    # 取目前登入者（同步）
+    return request.session.get("user")  # {id, username, role} 或 None
@@ -0,0 +1,234 @@
+# downloads.py
+# 結案檔案下載：只有案主和得標的接案人可以下載（不再透過公開的 /www/uploads）。
+#   GET /deliveries/{id}/download     單一檔案：支援 Range（續傳 / 影片拖拉）、If-Range、
+#                                     If-None-Match / If-Modified-Since（304）
+#   GET /deliveries/{id}/preview/{thumb|preview}  圖片的縮圖 / 預覽（previews.py 產生），網址不變內容就不變
+#   GET /projects/{id}/deliveries.zip 專案全部結案檔案，邊讀邊打包邊送（不在硬碟或記憶體組出整個 zip）
+# 前面有 nginx 時可設定環境變數 SENDFILE_HEADER=X-Accel-Redirect，
+# 權限檢查完只回一個標頭，實際傳檔（sendfile、Range）交給 nginx；沒設定就由這裡用 FileResponse 送。
+import os
+import zipfile
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from urllib.parse import quote
+
+import psycopg
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import FileResponse, RedirectResponse, Response, StreamingResponse
+from psycopg.rows import dict_row
+
+from cache import etag_matches
+from db import get_db
+from deps import current_user
+from storage import UPLOAD_DIR, CHUNK_SIZE, PREVIEW_VARIANTS, path_of, variant_key
+
+SENDFILE_HEADER = os.environ.get("SENDFILE_HEADER")                 # 例如 X-Accel-Redirect
+SENDFILE_PREFIX = os.environ.get("SENDFILE_PREFIX", "/_protected/")  # nginx internal location
+
+router = APIRouter()
+
+# 已搬到 archive 的專案（archive.py）檔案還在，一樣可以下載：都從 all_* view 讀
+DELIVERY_SQL = """
+    SELECT d.id, d.project_id, d.filename, d.storage_key,
+           p.client_id, ab.freelancer_id AS awarded_freelancer_id
+    FROM all_deliveries d
+    JOIN all_projects p ON p.id = d.project_id
+    LEFT JOIN all_bids ab ON ab.id = p.awarded_bid_id
+    WHERE d.id = %s
+"""
+
+PROJECT_DELIVERIES_SQL = """
+    SELECT p.id AS project_id, p.title, p.client_id, ab.freelancer_id AS awarded_freelancer_id,
+           d.id, d.filename, d.storage_key, d.created_at
+    FROM all_projects p
+    LEFT JOIN all_bids ab ON ab.id = p.awarded_bid_id
+    LEFT JOIN all_deliveries d ON d.project_id = p.id
+    WHERE p.id = %s
+    ORDER BY d.created_at, d.id
+"""
+
+
+def can_download(user, row):
+    return bool(user) and user["id"] in (row["client_id"], row["awarded_freelancer_id"])
+
+
+def file_path(row):
+    # 新檔案在 cas/ 底下；舊資料直接放在 uploads/<原始檔名>
+    if row["storage_key"]:
+        return path_of(row["storage_key"])
+    path = UPLOAD_DIR / (row["filename"] or "")
+    return path if path.parent == UPLOAD_DIR else None
+
+
+def stat_etag(st):
+    # 沒有內容雜湊的檔案（舊資料）：用修改時間 + 大小當 ETag
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def not_modified(request, etag, st):
+    # If-None-Match 優先；沒有才看 If-Modified-Since
+    if request.headers.get("if-none-match") is not None:
+        return etag_matches(request, etag)
+    since = request.headers.get("if-modified-since")
+    if since:
+        try:
+            return int(st.st_mtime) <= parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def content_disposition(filename):
+    # 中文檔名用 RFC 5987（filename*=UTF-8''...），舊瀏覽器看 filename 的 ASCII 版本
+    ascii_name = filename.encode("ascii", "replace").decode().replace('"', "")
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+
+
+async def authorized_delivery(conn, user, delivery_id):
+    # 查 deliveries 並檢查權限：不存在 404、不是案主 / 得標者 403
+    async with conn.cursor(row_factory=dict_row) as cur:
+        await cur.execute(DELIVERY_SQL, (delivery_id,))
+        row = await cur.fetchone()
+    if not row:
+        raise HTTPException(404)
+    if not can_download(user, row):
+        raise HTTPException(403)
+    return row
+
+
+def send_file(request, path, etag, cache_control, media_type=None, filename=None):
+    """共用的送檔流程：304 判斷 → X-Accel-Redirect 或 FileResponse（Range / If-Range）"""
+    try:
+        st = path.stat() if path else None
+    except FileNotFoundError:
+        st = None
+    if st is None:
+        raise HTTPException(404)
+
+    etag = etag or stat_etag(st)
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if not_modified(request, etag, st):
+        return Response(status_code=304, headers=headers)
+
+    if filename:
+        headers["Content-Disposition"] = content_disposition(filename)
+    if SENDFILE_HEADER:
+        # 交給前面的 nginx 傳檔（零拷貝、Range 都由它處理）
+        headers[SENDFILE_HEADER] = SENDFILE_PREFIX + path.relative_to(UPLOAD_DIR).as_posix()
+        return Response(headers=headers, media_type=media_type)
+    # FileResponse 本身處理 Range / If-Range（206、416）
+    return FileResponse(path, headers=headers, stat_result=st, media_type=media_type)
+
+
+@router.get("/deliveries/{delivery_id}/download")
+async def download_delivery(request: Request, delivery_id: int,
+                            conn: psycopg.AsyncConnection = Depends(get_db)):
+    user = current_user(request)
+    if not user:
+        return RedirectResponse("/login", 302)
+    row = await authorized_delivery(conn, user, delivery_id)
+
+    path = file_path(row)
+    # 內容定址的檔名就是 sha256，直接當 ETag
+    etag = f'"{Path(row["storage_key"]).stem}"' if row["storage_key"] else None
+    # 有權限控管，只能存在使用者自己的瀏覽器，且每次都要確認（可能被退件刪掉）
+    return send_file(request, path, etag, "private, no-cache",
+                     filename=row["filename"] or (path.name if path else None))
+
+
+@router.get("/deliveries/{delivery_id}/preview/{variant}")
+async def delivery_preview(request: Request, delivery_id: int, variant: str,
+                           conn: psycopg.AsyncConnection = Depends(get_db)):
+    user = current_user(request)
+    if not user:
+        return RedirectResponse("/login", 302)
+    if variant not in PREVIEW_VARIANTS:
+        raise HTTPException(404)
+    row = await authorized_delivery(conn, user, delivery_id)
+
+    key = row["storage_key"] and variant_key(row["storage_key"], variant)
+    if not key or not path_of(key).exists():
+        # 還沒產生（或不是圖片）：退回原檔
+        return RedirectResponse(f"/deliveries/{delivery_id}/download", 302)
+    # 同一筆 delivery 的縮圖永遠不變（重新上傳會是新的 id），可以長期快取
+    return send_file(request, path_of(key), f'"{Path(key).stem}"', "private, max-age=31536000, immutable",
+                     media_type="image/webp")
+
+
+# ----------------
+# 整個專案的結案檔案打包下載
+# ----------------
+class _ZipSink:
+    # zipfile 寫進來的資料先放這裡，每寫完一塊就取走送出去（不能 seek，zipfile 會自動改用 data descriptor）
+    def __init__(self):
+        self.buf = bytearray()
+
+    def write(self, data):
+        self.buf += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self.buf)
+        self.buf.clear()
+        return data
+
+
+def _arcnames(rows):
+    # zip 裡的檔名：拿掉路徑，同名的加上序號
+    seen = set()
+    for row in rows:
+        name = Path((row["filename"] or "").replace("\\", "/")).name or f"delivery-{row['id']}"
+        stem, suffix, n = Path(name).stem, Path(name).suffix, 1
+        while name in seen:
+            n += 1
+            name = f"{stem} ({n}){suffix}"
+        seen.add(name)
+        yield name, row
+
+
+def zip_stream(rows):
+    """
+    同步 generator（StreamingResponse 會放到 threadpool 跑）：每讀一塊檔案就吐出一塊 zip 資料。
+    用 ZIP_STORED 不再壓縮：結案檔案多半是 pptx / 影片 / 圖片，本來就壓過了。
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for name, row in _arcnames(rows):
+            path = file_path(row)
+            if not path or not path.is_file():
+                continue
+            info = zipfile.ZipInfo(name, date_time=row["created_at"].timetuple()[:6])
+            with open(path, "rb") as src, zf.open(info, "w", force_zip64=True) as dst:
+                while chunk := src.read(CHUNK_SIZE):
+                    dst.write(chunk)
+                    if sink.buf:
+                        yield sink.drain()
+    yield sink.drain()  # 最後的中央目錄
+
+
+@router.get("/projects/{project_id}/deliveries.zip")
+async def download_project_deliveries(request: Request, project_id: int,
+                                      conn: psycopg.AsyncConnection = Depends(get_db)):
+    user = current_user(request)
+    if not user:
+        return RedirectResponse("/login", 302)
+
+    async with conn.cursor(row_factory=dict_row) as cur:
+        await cur.execute(PROJECT_DELIVERIES_SQL, (project_id,))
+        rows = await cur.fetchall()
+    if not rows:
+        raise HTTPException(404)
+    if not can_download(user, rows[0]):
+        raise HTTPException(403)
+    rows = [r for r in rows if r["id"] is not None]
+    if not rows:
+        raise HTTPException(404)
+
+    headers = {
+        "Content-Disposition": content_disposition(f"project-{project_id}-deliveries.zip"),
+        "Cache-Control": "private, no-store",
+    }
+    return StreamingResponse(zip_stream(rows), media_type="application/zip", headers=headers)
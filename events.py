@@ -0,0 +1,241 @@
+# events.py
+# 即時更新：寫入的路由（新增 / 編輯 / 刪除專案、報價、選標、上傳結案檔案、結案、退件）在同一個交易裡 NOTIFY，
+# commit 之後才會送出（rollback 就不會有事件）。
+# 每個 worker 行程只開一條連線 LISTEN，收到後分送給這個行程裡開著的 SSE 連線：
+#   GET /events?project=<id>   瀏覽器用 EventSource 連上；會收到「自己的」事件（user:<id>）和這個專案的事件（project:<id>）
+# 頁面上由 www/live.js 接收，收到就重新抓一次目前的頁面、原地換掉內容，不用再一直重新整理。
+# 同時也是 cache.py 的跨 worker 清除：別的 worker 改了專案，這裡的訪客頁面快取也會跟著清掉。
+# SSE 連線不佔資料庫連線；每條最多開 STREAM_MAX_SECONDS 秒，之後瀏覽器自動重連。
+# uvicorn 關機（或 fastapi dev 重新載入）時會等所有連線結束，所以收到 SIGTERM / SIGINT 就先把 SSE 收掉。
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from collections import defaultdict
+
+import psycopg
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+import cache
+from db import CONNINFO
+from deps import current_user
+
+log = logging.getLogger("events")
+
+CHANNEL = "app_events"
+HEARTBEAT_SECONDS = 15.0      # 沒事件時送註解行，避免 proxy 以為連線斷了
+STREAM_MAX_SECONDS = 300.0    # 一條 SSE 最長開多久（瀏覽器會依 retry 自動重連）
+RETRY_MS = 3000               # 告訴瀏覽器斷線後幾毫秒重連
+QUEUE_SIZE = 100              # 每條 SSE 最多暫存幾個事件（瀏覽器太慢就丟最舊的）
+RECONNECT_DELAYS = (0.5, 1, 2, 5, 10)  # LISTEN 連線斷掉後的重連間隔
+
+ORIGIN = f"{socket.gethostname()}:{os.getpid()}"  # 分辨是不是自己送出的事件
+
+router = APIRouter()
+
+_subscribers = defaultdict(set)   # "project:<id>" / "user:<id>" -> {asyncio.Queue}
+_listener = None                  # LISTEN 的背景 task
+_closing = False                  # 準備關機：不再開新的 SSE
+_stats = {"received": 0, "delivered": 0, "dropped": 0, "reconnects": 0, "connected": 0}
+
+
+# ----------------
+# 送出事件（路由在 commit 前呼叫）
+# ----------------
+# 收件人由資料庫決定：案主 + 得標的接案人，再加上呼叫端指定的人（例如報價的人）
+PUBLISH_SQL = """
+    SELECT pg_notify(%(channel)s, json_build_object(
+        'type', %(type)s::text, 'project_id', p.id, 'status', p.status, 'origin', %(origin)s::text,
+        'users', array_remove(ARRAY[p.client_id, ab.freelancer_id] || %(users)s::int[], NULL)
+    )::text)
+    FROM projects p
+    LEFT JOIN bids ab ON ab.id = p.awarded_bid_id
+    WHERE p.id = %(project_id)s
+"""
+
+
+# 專案已經刪掉（PUBLISH_SQL 查不到）：收件人由呼叫端給
+PUBLISH_DELETED_SQL = """
+    SELECT pg_notify(%(channel)s, json_build_object(
+        'type', 'project_deleted', 'project_id', %(project_id)s::int, 'status', NULL, 'origin', %(origin)s::text,
+        'users', %(users)s::int[]
+    )::text)
+"""
+
+
+async def publish(cur, type, project_id, users=()):
+    """排入一個事件；跟目前的交易一起 commit 才會送出"""
+    await cur.execute(PUBLISH_SQL, {"channel": CHANNEL, "type": type, "project_id": project_id,
+                                    "origin": ORIGIN, "users": list(users)})
+
+
+async def publish_deleted(cur, project_id, users=()):
+    await cur.execute(PUBLISH_DELETED_SQL, {"channel": CHANNEL, "project_id": project_id,
+                                            "origin": ORIGIN, "users": list(users)})
+
+
+# ----------------
+# 訂閱 / 分送
+# ----------------
+def subscribe(topics):
+    queue = asyncio.Queue(QUEUE_SIZE)
+    for topic in topics:
+        _subscribers[topic].add(queue)
+    return queue
+
+
+def unsubscribe(queue, topics):
+    for topic in topics:
+        queues = _subscribers.get(topic)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del _subscribers[topic]
+
+
+def _offer(queue, message):
+    if queue.full():  # 瀏覽器跟不上：丟最舊的，反正收到任何事件都是重抓整頁
+        queue.get_nowait()
+        _stats["dropped"] += 1
+    queue.put_nowait(message)
+    _stats["delivered"] += 1
+
+
+def dispatch(event):
+    _stats["received"] += 1
+    project_id = event.get("project_id")
+    if project_id is not None and event.get("origin") != ORIGIN:
+        cache.invalidate_project(project_id)  # 自己送的在路由裡已經清過了
+
+    # 送給瀏覽器的內容不帶收件人清單
+    message = {"type": event.get("type"), "project_id": project_id, "status": event.get("status")}
+    targets = set(_subscribers.get(f"project:{project_id}", ()))
+    for uid in event.get("users") or ():
+        targets |= _subscribers.get(f"user:{uid}", set())
+    for queue in targets:
+        _offer(queue, message)
+
+
+def _resync_all():
+    # LISTEN 斷線期間的事件收不到了：叫所有頁面重抓一次；快取也整個清掉
+    cache.clear()
+    queues = {q for qs in _subscribers.values() for q in qs}
+    for queue in queues:
+        _offer(queue, {"type": "resync"})
+
+
+async def _listen():
+    attempt = 0
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(CONNINFO, autocommit=True) as conn:
+                await conn.execute(f"LISTEN {CHANNEL}")
+                _stats["connected"] = 1
+                if attempt:
+                    _resync_all()
+                attempt = 0
+                async for notify in conn.notifies():
+                    try:
+                        dispatch(json.loads(notify.payload))
+                    except (ValueError, TypeError):
+                        log.warning("bad event payload: %r", notify.payload[:200])
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            _stats["connected"] = 0
+            delay = RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)]
+            attempt += 1
+            _stats["reconnects"] += 1
+            log.warning("event listener disconnected (%s), retrying in %ss", exc, delay)
+            await asyncio.sleep(delay)
+
+
+def close_streams():
+    global _closing
+    _closing = True
+    for queues in list(_subscribers.values()):
+        for queue in queues:
+            _offer(queue, None)
+
+
+def _watch_shutdown(loop):
+    # 接在 uvicorn 的訊號處理前面：先讓 SSE 結束，uvicorn 才不會一直等這些連線
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        previous = signal.getsignal(sig)
+
+        def handler(signum, frame, previous=previous):
+            loop.call_soon_threadsafe(close_streams)
+            if callable(previous):
+                previous(signum, frame)
+
+        signal.signal(sig, handler)
+
+
+async def start_listener():
+    global _listener, _closing
+    _closing = False
+    if _listener is None:
+        _listener = asyncio.create_task(_listen(), name="events-listener")
+        _watch_shutdown(asyncio.get_running_loop())
+
+
+async def stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+        _listener = None
+    _stats["connected"] = 0
+    close_streams()
+
+
+def event_stats():
+    return dict(_stats, streams=len({q for qs in _subscribers.values() for q in qs}))
+
+
+# ----------------
+# SSE
+# ----------------
+def _sse(message):
+    return f"event: {message['type']}\ndata: {json.dumps(message)}\n\n"
+
+
+@router.get("/events")
+async def event_stream(request: Request):
+    user = current_user(request)
+    if not user:
+        raise HTTPException(401)
+    topics = [f"user:{user['id']}"]
+    project = request.query_params.get("project", "")
+    if project.isdigit():
+        topics.append(f"project:{int(project)}")
+
+    async def stream():
+        queue = subscribe(topics)
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            while not _closing and (left := deadline - time.monotonic()) > 0:
+                try:
+                    message = await asyncio.wait_for(queue.get(), min(HEARTBEAT_SECONDS, left))
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if message is None:  # 關機
+                    break
+                yield _sse(message)
+        finally:
+            unsubscribe(queue, topics)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}  # nginx 不要緩衝
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=headers)
@@ -0,0 +1,402 @@
+# jobs.py
+# 背景工作佇列：工作存在資料庫的 jobs 表，和資料變更寫在同一個交易裡（commit 了就一定會做到，沒 commit 就不會做），
+# 由獨立的 worker 行程取出來執行；失敗會隔一段時間重試，重試次數用完標成 failed。
+#   python jobs.py work [-n 2]         開 n 個 worker 行程（Ctrl+C / SIGTERM 會做完手上那筆才結束）
+#   python jobs.py sweep [--legacy]    立刻跑一次孤兒檔案清理（--legacy 連舊資料 uploads/ 底下沒人用的檔案也刪）
+#   python jobs.py status              各種工作的數量
+# 另外每天排一次 archive_closed（archive.py：結案很久的專案搬到 archive 表；ARCHIVE=off 不排）。
+# 路由裡用法：await jobs.enqueue(cur, "remove_files", {...}) 之後 conn.commit()。
+# handler 可能被執行不只一次（做到一半當掉會重做），所以都要寫成重跑也沒關係。
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+import traceback
+
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+
+import archive
+import db
+from storage import UPLOAD_DIR, TMP_DIR, PREVIEW_VARIANTS, path_of, remove_files as unlink_files
+
+log = logging.getLogger(__name__)
+
+POLL_INTERVAL = 1.0       # 沒工作時隔多久再看一次（秒）
+LOCK_TIMEOUT = 600        # running 超過這麼久還沒結束，當作 worker 死掉，重新排給別人
+RETRY_BASE = 5            # 重試間隔：5、10、20、40… 秒
+RETRY_MAX = 600
+SWEEP_INTERVAL = 3600     # 孤兒檔案清理的間隔（秒）
+SWEEP_GRACE = 3600        # 只清修改時間超過這麼久的檔案（上傳中、還沒 commit 的不算孤兒）
+SWEEP_BATCH = 500
+KEEP_FINISHED_DAYS = 7    # 做完的工作保留幾天
+KEEP_RATE_LIMIT_HOURS = 24  # 限流的桶子多久沒動就刪（早就補滿了，刪掉一樣）
+ARCHIVE_INTERVAL = 86400  # 搬 archive 的間隔（秒）
+
+HANDLERS = {}
+
+ENQUEUE_SQL = """
+    INSERT INTO jobs (kind, payload, dedupe_key, run_at)
+    VALUES (%s, %s, %s, now() + make_interval(secs => %s))
+    ON CONFLICT (dedupe_key) WHERE dedupe_key IS NOT NULL AND status IN ('queued', 'running')
+    DO NOTHING
+"""
+
+# 取一筆可以做的工作：SKIP LOCKED 讓多個 worker 不會搶同一筆、也不會互相等
+CLAIM_SQL = """
+    UPDATE jobs SET status='running', locked_at=now(), attempts=attempts + 1
+    WHERE id = (
+        SELECT id FROM jobs
+        WHERE status IN ('queued', 'running')
+          AND run_at <= now()
+          AND (status = 'queued' OR locked_at < now() - make_interval(secs => %s))
+        ORDER BY run_at
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, kind, payload, attempts, max_attempts,
+              extract(epoch FROM created_at::timestamptz)::float8 AS queued_at
+"""
+
+DONE_SQL = """
+    UPDATE jobs SET status='done', finished_at=now(), locked_at=NULL, last_error=NULL
+    WHERE id=%s
+"""
+
+FAIL_SQL = """
+    UPDATE jobs SET
+        status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+        finished_at = CASE WHEN attempts >= max_attempts THEN now() END,
+        run_at = now() + make_interval(secs => %s),
+        locked_at = NULL,
+        last_error = %s
+    WHERE id=%s
+"""
+
+
+def handler(kind):
+    # @handler("remove_files") 註冊處理函式：fn(conn, job)，conn 是同步連線，with 結束時 commit
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+async def enqueue(cur, kind, payload=None, dedupe_key=None, delay=0):
+    """在目前的交易裡排一筆工作（呼叫端負責 commit）；同 dedupe_key 已經在排就不重複排"""
+    await cur.execute(ENQUEUE_SQL, (kind, Jsonb(payload or {}), dedupe_key, delay))
+
+
+def enqueue_sync(conn, kind, payload=None, dedupe_key=None, delay=0):
+    conn.execute(ENQUEUE_SQL, (kind, Jsonb(payload or {}), dedupe_key, delay))
+
+
+async def queue_stats(conn):
+    # 健康檢查用：排隊中 / 執行中 / 失敗的數量
+    cur = await conn.execute("""
+        SELECT count(*) FILTER (WHERE status='queued' AND run_at <= now()),
+               count(*) FILTER (WHERE status='running')
+        FROM jobs WHERE status IN ('queued', 'running')
+    """)
+    ready, running = await cur.fetchone()
+    return {"ready": ready, "running": running}
+
+
+# ----------------
+# 刪檔（退件 / 重新上傳後沒人用的檔案）
+# ----------------
+@handler("remove_files")
+def remove_files(conn, job):
+    # 刪之前再確認一次：排隊這段期間同樣內容可能又被上傳（blobs 又有這筆 / 檔案被 touch 過）就不能刪
+    payload = job["payload"]
+    keys = payload.get("keys") or []
+    if keys:
+        rows = conn.execute("SELECT storage_key FROM blobs WHERE storage_key = ANY(%s)", (keys,)).fetchall()
+        in_use = {r[0] for r in rows}
+        keys = [k for k in keys if k not in in_use and not _touched_since(path_of(k), job["queued_at"])]
+    legacy = payload.get("legacy") or []
+    if legacy:
+        rows = conn.execute("""
+            SELECT filename FROM all_deliveries WHERE storage_key IS NULL AND filename = ANY(%s)
+        """, (legacy,)).fetchall()
+        in_use = {r[0] for r in rows}
+        legacy = [name for name in legacy if name not in in_use]
+    unlink_files(keys, legacy)
+    return {"removed": len(keys) + len(legacy)}
+
+
+def _touched_since(path, ts):
+    try:
+        return path.stat().st_mtime > ts
+    except FileNotFoundError:
+        return False
+
+
+# ----------------
+# 孤兒檔案清理：以資料庫為準，對帳 blobs / deliveries / uploads 目錄
+# ----------------
+@handler("sweep_orphans")
+def sweep_orphans(conn, job):
+    return sweep(conn, legacy=bool(job["payload"].get("legacy")))
+
+
+def _batches(items, size=SWEEP_BATCH):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _old_files(directory, cutoff, recursive=False):
+    # 修改時間早於 cutoff 的檔案（隱藏檔不算）
+    if not directory.is_dir():
+        return
+    for path in (directory.rglob("*") if recursive else directory.iterdir()):
+        if path.name.startswith("."):
+            continue
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        if path.is_file() and st.st_mtime < cutoff:
+            yield path
+
+
+def fix_refcounts(conn, stats):
+    # blobs.refcount 以實際的 deliveries 筆數為準（archive 裡的也算）；先 FOR UPDATE 鎖住那批 blobs，
+    # 正在上傳的交易會等我們 commit（或我們等它 commit），數出來的數字才不會過時
+    last = ""
+    while True:
+        with conn.transaction():
+            keys = [r[0] for r in conn.execute("""
+                SELECT storage_key FROM blobs WHERE storage_key > %s
+                ORDER BY storage_key LIMIT %s FOR UPDATE
+            """, (last, SWEEP_BATCH)).fetchall()]
+            if not keys:
+                return
+            last = keys[-1]
+            fixed = conn.execute("""
+                UPDATE blobs b SET refcount = d.n
+                FROM (SELECT k, count(dl.id) AS n
+                      FROM unnest(%s::text[]) AS k
+                      LEFT JOIN all_deliveries dl ON dl.storage_key = k
+                      GROUP BY k) d
+                WHERE b.storage_key = d.k AND b.refcount <> d.n
+            """, (keys,)).rowcount
+            dropped = [r[0] for r in conn.execute("""
+                DELETE FROM blobs WHERE storage_key = ANY(%s) AND refcount <= 0
+                RETURNING storage_key
+            """, (keys,)).fetchall()]
+        unlink_files(dropped)  # commit 之後才刪檔
+        stats["refcounts_fixed"] += fixed
+        stats["blobs_dropped"] += len(dropped)
+
+
+def remove_unreferenced_cas(conn, cutoff, stats):
+    # cas/ 底下的原檔在 blobs 裡找不到、或縮圖找不到同內容雜湊的 blob，就是孤兒
+    variant_suffixes = tuple(f".{v}.webp" for v in PREVIEW_VARIANTS)
+    for batch in _batches(_old_files(UPLOAD_DIR / "cas", cutoff, recursive=True)):
+        shas = list({p.name.split(".")[0] for p in batch})
+        rows = conn.execute("SELECT storage_key, sha256 FROM blobs WHERE sha256 = ANY(%s)", (shas,)).fetchall()
+        conn.commit()
+        keys, known = {r[0] for r in rows}, {r[1] for r in rows}
+        for path in batch:
+            if path.name.endswith(variant_suffixes):
+                orphan = path.name.split(".")[0] not in known
+            else:
+                orphan = path.relative_to(UPLOAD_DIR).as_posix() not in keys
+            if orphan:
+                path.unlink(missing_ok=True)
+                stats["files_removed"] += 1
+
+
+def remove_unreferenced_legacy(conn, cutoff, delete, stats):
+    # 舊資料（storage_key 為 NULL）直接放在 uploads/<原始檔名>；沒有 deliveries 指到的就是孤兒
+    for batch in _batches(_old_files(UPLOAD_DIR, cutoff)):
+        names = [p.name for p in batch]
+        rows = conn.execute("""
+            SELECT filename FROM all_deliveries WHERE storage_key IS NULL AND filename = ANY(%s)
+        """, (names,)).fetchall()
+        conn.commit()
+        used = {r[0] for r in rows}
+        for path in batch:
+            if path.name in used:
+                continue
+            stats["legacy_unreferenced"] += 1
+            if delete:
+                path.unlink(missing_ok=True)
+                stats["files_removed"] += 1
+
+
+def count_missing_files(conn, stats):
+    # 反過來：deliveries 有紀錄但檔案不見了（沒辦法補救，只記下來）
+    last = 0
+    while True:
+        rows = conn.execute("""
+            SELECT id, storage_key, filename FROM all_deliveries WHERE id > %s ORDER BY id LIMIT %s
+        """, (last, SWEEP_BATCH)).fetchall()
+        conn.commit()
+        if not rows:
+            return
+        last = rows[-1][0]
+        for delivery_id, key, filename in rows:
+            path = path_of(key) if key else UPLOAD_DIR / (filename or "")
+            if not path.is_file():
+                stats["missing_files"] += 1
+                log.warning("delivery %s: file missing (%s)", delivery_id, path)
+
+
+def purge_finished_jobs(conn, stats):
+    while True:
+        n = conn.execute("""
+            DELETE FROM jobs WHERE id IN (
+                SELECT id FROM jobs
+                WHERE status IN ('done', 'failed') AND finished_at < now() - make_interval(days => %s)
+                LIMIT %s)
+        """, (KEEP_FINISHED_DAYS, SWEEP_BATCH)).rowcount
+        conn.commit()
+        stats["jobs_purged"] += n
+        if n < SWEEP_BATCH:
+            return
+
+
+def purge_rate_limits(conn, stats):
+    stats["rate_limits_purged"] += conn.execute(
+        "DELETE FROM rate_limits WHERE updated_at < now() - make_interval(hours => %s)",
+        (KEEP_RATE_LIMIT_HOURS,)).rowcount
+    conn.commit()
+
+
+def sweep(conn, legacy=False):
+    """整套對帳；每一批各自 commit，中途被打斷下次再從頭掃也沒關係"""
+    stats = dict.fromkeys(("refcounts_fixed", "blobs_dropped", "files_removed", "tmp_removed",
+                           "legacy_unreferenced", "missing_files", "jobs_purged", "rate_limits_purged"), 0)
+    cutoff = time.time() - SWEEP_GRACE
+    fix_refcounts(conn, stats)
+    remove_unreferenced_cas(conn, cutoff, stats)
+    remove_unreferenced_legacy(conn, cutoff, legacy, stats)
+    for path in _old_files(TMP_DIR, cutoff):   # 上傳到一半當掉留下的暫存檔
+        path.unlink(missing_ok=True)
+        stats["tmp_removed"] += 1
+    count_missing_files(conn, stats)
+    purge_finished_jobs(conn, stats)
+    purge_rate_limits(conn, stats)
+    log.info("sweep: %s", stats)
+    return stats
+
+
+# ----------------
+# 冷熱分離：結案很久的專案搬到 archive 表（見 archive.py）
+# ----------------
+@handler("archive_closed")
+def archive_closed(conn, job):
+    return archive.run(conn, days=job["payload"].get("days", archive.ARCHIVE_AFTER_DAYS))
+
+
+# ----------------
+# worker
+# ----------------
+def run_one():
+    """取一筆工作來做；沒有可做的回傳 False"""
+    with db.get_conn() as conn:
+        job = conn.cursor(row_factory=dict_row).execute(CLAIM_SQL, (LOCK_TIMEOUT,)).fetchone()
+    if job is None:
+        return False
+
+    try:
+        fn = HANDLERS.get(job["kind"])
+        if fn is None:
+            raise LookupError(f"no handler for job kind {job['kind']!r}")
+        with db.get_conn() as conn:
+            result = fn(conn, job)
+    except Exception:
+        delay = min(RETRY_BASE * 2 ** (job["attempts"] - 1), RETRY_MAX)
+        log.warning("job %s (%s) failed, attempt %s/%s", job["id"], job["kind"],
+                    job["attempts"], job["max_attempts"], exc_info=True)
+        with db.get_conn() as conn:
+            conn.execute(FAIL_SQL, (delay, traceback.format_exc()[-2000:], job["id"]))
+    else:
+        log.info("job %s (%s) done %s", job["id"], job["kind"], result or "")
+        with db.get_conn() as conn:
+            conn.execute(DONE_SQL, (job["id"],))
+    return True
+
+
+def schedule_sweep(conn):
+    # 只會有一筆清理在排隊（dedupe_key），做完之後下一個 worker 看到就再排下一次
+    enqueue_sync(conn, "sweep_orphans", dedupe_key="sweep_orphans", delay=SWEEP_INTERVAL)
+    if archive.ARCHIVE_ENABLED:
+        enqueue_sync(conn, "archive_closed", dedupe_key="archive_closed", delay=ARCHIVE_INTERVAL)
+
+
+def work(stop):
+    next_schedule = 0.0
+    while not stop.is_set():
+        if time.monotonic() >= next_schedule:
+            with db.get_conn() as conn:
+                schedule_sweep(conn)
+            next_schedule = time.monotonic() + 60
+        if not run_one():
+            stop.wait(POLL_INTERVAL)
+
+
+def _worker_main(stop):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # Ctrl+C 由主行程統一處理，手上的工作做完才停
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s [jobs-{os.getpid()}] %(message)s")
+    try:
+        work(stop)
+    finally:
+        db.close_pool()
+
+
+def run_workers(n):
+    ctx = multiprocessing.get_context("spawn")
+    stop = ctx.Event()
+    procs = [ctx.Process(target=_worker_main, args=(stop,), name=f"jobs-{i}") for i in range(n)]
+    for p in procs:
+        p.start()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    for p in procs:
+        p.join()
+
+
+def print_status():
+    with db.get_conn() as conn:
+        rows = conn.execute("""
+            SELECT kind, status, count(*), max(last_error) FILTER (WHERE status='failed')
+            FROM jobs GROUP BY kind, status ORDER BY kind, status
+        """).fetchall()
+    for kind, status, n, err in rows:
+        print(f"{kind:16} {status:8} {n}")
+        if err:
+            print("    last error:", err.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="背景工作佇列")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    w = sub.add_parser("work")
+    w.add_argument("-n", "--workers", type=int, default=1)
+    s = sub.add_parser("sweep")
+    s.add_argument("--legacy", action="store_true", help="連舊資料 uploads/ 底下沒人用的檔案也刪")
+    sub.add_parser("status")
+    args = parser.parse_args()
+
+    if args.cmd == "work":
+        run_workers(args.workers)
+    elif args.cmd == "sweep":
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+        with db.get_conn() as conn:
+            print(sweep(conn, legacy=args.legacy))
+    else:
+        print_status()
+    sys.exit(0)
@@ -0,0 +1,225 @@
+# metrics.py
+# 效能指標：每個路由（用路由樣板，例如 /projects/{id}）的延遲分布、狀態碼、處理中數量，
+# 以及每一句 SQL 的執行時間（用「指紋」分組：空白統一、常數換成 ?，同一種查詢算同一組）。
+# app.py 的 /metrics 以 Prometheus 文字格式輸出；不需要額外套件。
+# 每個行程各自統計（uvicorn 開多個 worker 時，Prometheus 抓到的是其中一個，請每個 worker 分開抓或只開一個）。
+#   SLOW_QUERY_MS=200   執行超過 200 ms 的 SQL 會記一筆 warning log（預設關閉）
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+
+import psycopg
+from starlette.routing import Match
+
+log = logging.getLogger("slow_query")
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS") or 0)  # 0 = 不記
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+STATEMENT_PREVIEW = 200   # /metrics 裡顯示的 SQL 最多幾個字
+
+_lock = threading.Lock()  # 同步連線池的查詢在 threadpool 裡跑，要上鎖
+
+
+# ----------------
+# 指標
+# ----------------
+class Histogram:
+    def __init__(self, name, help, labels, buckets):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self.series = {}  # label 值 -> [各 bucket 次數..., 總和, 次數]
+
+    def observe(self, values, seconds):
+        with _lock:
+            s = self.series.get(values)
+            if s is None:
+                s = self.series[values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    s[i] += 1
+                    break
+            s[-2] += seconds
+            s[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with _lock:
+            series = {k: list(v) for k, v in self.series.items()}
+        for values, s in sorted(series.items()):
+            labels = _labels(self.labels, values)
+            total = 0
+            for bound, n in zip(self.buckets, s):
+                total += n
+                yield f'{self.name}_bucket{{{labels},le="{bound}"}} {total}'
+            yield f'{self.name}_bucket{{{labels},le="+Inf"}} {s[-1]}'
+            yield f"{self.name}_sum{{{labels}}} {s[-2]:.6f}"
+            yield f"{self.name}_count{{{labels}}} {s[-1]}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels):
+        self.name, self.help, self.labels = name, help, labels
+        self.series = {}
+
+    def inc(self, values, n=1):
+        with _lock:
+            self.series[values] = self.series.get(values, 0) + n
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with _lock:
+            series = dict(self.series)
+        for values, n in sorted(series.items()):
+            yield f"{self.name}{{{_labels(self.labels, values)}}} {n}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values):
+    return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+http_duration = Histogram("http_request_duration_seconds", "HTTP request latency by route template",
+                          ("method", "route"), HTTP_BUCKETS)
+http_responses = Counter("http_responses_total", "HTTP responses by route template and status",
+                         ("method", "route", "status"))
+http_in_flight = Gauge("http_requests_in_flight", "HTTP requests currently being handled",
+                       ("method", "route"))
+sql_duration = Histogram("db_query_duration_seconds", "SQL statement latency by statement fingerprint",
+                         ("fingerprint",), SQL_BUCKETS)
+sql_errors = Counter("db_query_errors_total", "SQL statements that raised", ("fingerprint",))
+_statements = {}  # 指紋 -> 正規化後的 SQL（/metrics 裡對照用）
+
+
+# ----------------
+# SQL 指紋與計時
+# ----------------
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACE_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql):
+    """回傳 (指紋, 正規化 SQL)：常數換成 ?、空白壓成一格；參數（%s）本來就不在字串裡"""
+    norm = _SPACE_RE.sub(" ", _NUMBER_RE.sub("?", _STRING_RE.sub("?", sql))).strip()
+    return hashlib.sha1(norm.encode()).hexdigest()[:12], norm
+
+
+def _query_text(query):
+    if isinstance(query, bytes):
+        return query.decode("utf-8", "replace")
+    if isinstance(query, str):
+        return query
+    return repr(query)  # psycopg.sql.Composed 之類，沒有連線拿不到最終字串
+
+
+def observe_query(query, seconds, failed=False):
+    fp, norm = fingerprint(_query_text(query))
+    if not norm:
+        return  # 連線池借出前的健康檢查（空字串）
+    if fp not in _statements:
+        _statements[fp] = norm[:STATEMENT_PREVIEW]
+    sql_duration.observe((fp,), seconds)
+    if failed:
+        sql_errors.inc((fp,))
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        log.warning("slow query %.1f ms [%s] %s", seconds * 1000, fp, norm[:1000])
+
+
+class TimedCursor(psycopg.Cursor):
+    # 同步連線池（db.get_conn()）用的 cursor：每次 execute 都計時
+    def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = super().execute(query, params, **kwargs)
+        except BaseException:
+            observe_query(query, time.perf_counter() - start, failed=True)
+            raise
+        observe_query(query, time.perf_counter() - start)
+        return result
+
+
+class AsyncTimedCursor(psycopg.AsyncCursor):
+    # 非同步連線池（db.connection() / get_db）用的 cursor
+    async def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = await super().execute(query, params, **kwargs)
+        except BaseException:
+            observe_query(query, time.perf_counter() - start, failed=True)
+            raise
+        observe_query(query, time.perf_counter() - start)
+        return result
+
+
+# ----------------
+# HTTP middleware
+# ----------------
+def route_template(app, scope):
+    # 找出這個 request 會進哪個路由，用樣板（/projects/{id}）當標籤，不然每個 id 都會變成一組
+    partial = None
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path  # 路徑對但方法不對（會回 405）
+    return partial or "<unmatched>"
+
+
+class MetricsMiddleware:
+    def __init__(self, app, router_app=None):
+        self.app = app
+        self.router_app = router_app  # 用來比對路由的 FastAPI app（middleware 裡拿不到）
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        labels = (scope["method"], route_template(self.router_app, scope))
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_flight.inc(labels)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # 串流回應（zip 下載）算到最後一塊送完
+            http_in_flight.inc(labels, -1)
+            http_duration.observe(labels, time.perf_counter() - start)
+            http_responses.inc(labels + (str(status),))
+
+
+def render(extra=()):
+    """Prometheus 文字格式；extra 是 [(名稱, 說明, 值)] 的即時數值（連線池等）"""
+    lines = []
+    for metric in (http_duration, http_responses, http_in_flight, sql_duration, sql_errors):
+        lines += metric.render()
+    lines += ["# HELP db_query_statement_info Normalized SQL text for each fingerprint",
+              "# TYPE db_query_statement_info gauge"]
+    for fp, norm in sorted(_statements.items()):
+        lines.append(f'db_query_statement_info{{fingerprint="{fp}",statement="{_escape(norm)}"}} 1')
+    for name, help, value in extra:
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,140 @@
+# migrate.py
+# 資料庫結構版本管理：依檔名順序套用 migrations/NNNN_名稱.sql，已套用的記在 schema_migrations
+#   python migrate.py up       套用所有還沒跑過的 migration
+#   python migrate.py status   列出每支 migration 是否已套用（檔案內容被改過也會提示）
+#
+# 每支 migration 預設包在一個交易裡；第一行寫 "-- migrate: no-transaction" 的檔案
+# 會逐句以 autocommit 執行（CREATE INDEX CONCURRENTLY 需要），所以內容要能重跑（IF NOT EXISTS）。
+# CONCURRENTLY 建到一半失敗會留下一個無效（INVALID）的索引，IF NOT EXISTS 會直接跳過它，
+# 所以建之前先把同名的無效索引刪掉，失敗時也順手刪掉，下次重跑才會真的重建。
+import hashlib
+import re
+import sys
+from pathlib import Path
+
+import psycopg
+
+from db import CONNINFO
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+LOCK_ID = 1141_0001  # pg_advisory_lock 用，避免兩個人同時跑 migration
+NO_TX_MARK = "-- migrate: no-transaction"
+CONCURRENT_INDEX = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+([\w.\"]+)", re.I)
+
+
+def list_migrations():
+    # [(version, name, path)]，依版本號排序
+    found = []
+    for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+        m = re.match(r"^(\d+)_(.+)\.sql$", path.name)
+        if m:
+            found.append((m.group(1), m.group(2), path))
+    return found
+
+
+def checksum(sql):
+    return hashlib.sha256(sql.encode("utf-8")).hexdigest()
+
+
+def split_statements(sql):
+    # 只給 no-transaction 的檔案用：裡面不會有函式本體，照分號切即可
+    body = "\n".join(line for line in sql.splitlines() if not line.strip().startswith("--"))
+    return [s.strip() for s in body.split(";") if s.strip()]
+
+
+def ensure_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version varchar(20) PRIMARY KEY,
+            name text NOT NULL,
+            checksum varchar(64) NOT NULL,
+            applied_at timestamp DEFAULT now() NOT NULL
+        )
+    """)
+
+
+def applied(conn):
+    rows = conn.execute("SELECT version, checksum FROM schema_migrations").fetchall()
+    return dict(rows)
+
+
+def drop_if_invalid(conn, index):
+    # 只刪 indisvalid = false 的（建到一半失敗留下的），好的索引不動
+    invalid = conn.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(%s) AND NOT indisvalid)",
+        (index,)).fetchone()[0]
+    if invalid:
+        print(f"  dropping invalid index {index}")
+        conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index}")
+
+
+def record(conn, version, name, sql):
+    conn.execute(
+        "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+        (version, name, checksum(sql)),
+    )
+
+
+def apply_one(conn, version, name, path):
+    sql = path.read_text(encoding="utf-8")
+    if sql.lstrip().startswith(NO_TX_MARK):
+        for stmt in split_statements(sql):
+            m = CONCURRENT_INDEX.match(stmt)
+            if not m:
+                conn.execute(stmt)
+                continue
+            drop_if_invalid(conn, m.group(1))
+            try:
+                conn.execute(stmt)
+            except psycopg.Error:
+                drop_if_invalid(conn, m.group(1))
+                raise
+        record(conn, version, name, sql)
+    else:
+        # 內容和版本紀錄在同一個交易：不會套用了卻沒記到（下次又跑一次）
+        with conn.transaction():
+            conn.execute(sql)
+            record(conn, version, name, sql)
+
+
+def up(conn):
+    done = applied(conn)
+    count = 0
+    for version, name, path in list_migrations():
+        if version in done:
+            continue
+        print(f"applying {version}_{name} ...")
+        apply_one(conn, version, name, path)
+        count += 1
+    print(f"{count} migration(s) applied" if count else "already up to date")
+
+
+def status(conn):
+    done = applied(conn)
+    for version, name, path in list_migrations():
+        if version not in done:
+            mark = "pending"
+        elif done[version] != checksum(path.read_text(encoding="utf-8")):
+            mark = "applied (file changed since!)"
+        else:
+            mark = "applied"
+        print(f"{version}_{name}: {mark}")
+
+
+if __name__ == "__main__":
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd not in ("up", "status"):
+        print("usage: python migrate.py up|status")
+        sys.exit(2)
+
+    # 用獨立的 autocommit 連線：交易由每支 migration 自己決定
+    with psycopg.connect(CONNINFO, autocommit=True) as conn:
+        conn.execute("SELECT pg_advisory_lock(%s)", (LOCK_ID,))
+        try:
+            ensure_table(conn)
+            if cmd == "up":
+                up(conn)
+            else:
+                status(conn)
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s)", (LOCK_ID,))
@@ -0,0 +1,83 @@
+-- 基本資料表（和 docs/schema.sql 的結構相同）
+-- 已經用 schema.sql 匯入過的資料庫跑這支不會有任何變化
+
+CREATE TABLE IF NOT EXISTS "public"."users" (
+    "id" serial NOT NULL,
+    "username" character varying(50) NOT NULL,
+    "password_hash" character varying(128) NOT NULL,
+    "role" character varying(20) NOT NULL,
+    "full_name" character varying(100),
+    "phone" character varying(32),
+    "agreed_privacy" boolean DEFAULT false,
+    "email" text,
+    CONSTRAINT "users_pkey" PRIMARY KEY ("id"),
+    CONSTRAINT "users_role_check" CHECK ((role)::text = ANY ((ARRAY['client'::character varying, 'freelancer'::character varying])::text[]))
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS users_username_key ON public.users USING btree (username);
+CREATE UNIQUE INDEX IF NOT EXISTS users_email_key ON public.users USING btree (email);
+
+CREATE TABLE IF NOT EXISTS "public"."projects" (
+    "id" serial NOT NULL,
+    "title" character varying(100) NOT NULL,
+    "description" text,
+    "status" character varying(20) DEFAULT 'open' NOT NULL,
+    "client_id" integer NOT NULL,
+    "created_at" timestamp DEFAULT now() NOT NULL,
+    "awarded_bid_id" integer,
+    "budget" integer,
+    CONSTRAINT "projects_pkey" PRIMARY KEY ("id")
+);
+
+CREATE TABLE IF NOT EXISTS "public"."bids" (
+    "id" serial NOT NULL,
+    "project_id" integer NOT NULL,
+    "freelancer_id" integer NOT NULL,
+    "price" integer NOT NULL,
+    "message" text,
+    "created_at" timestamp DEFAULT now() NOT NULL,
+    CONSTRAINT "bids_pkey" PRIMARY KEY ("id")
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS bids_project_id_freelancer_id_key ON public.bids USING btree (project_id, freelancer_id);
+
+CREATE TABLE IF NOT EXISTS "public"."deliveries" (
+    "id" serial NOT NULL,
+    "project_id" integer NOT NULL,
+    "freelancer_id" integer NOT NULL,
+    "filename" character varying(200) NOT NULL,
+    "note" text,
+    "created_at" timestamp DEFAULT now() NOT NULL,
+    CONSTRAINT "deliveries_pkey" PRIMARY KEY ("id")
+);
+
+-- 外鍵（已存在就跳過）
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'bids_freelancer_id_fkey') THEN
+        ALTER TABLE ONLY "public"."bids" ADD CONSTRAINT "bids_freelancer_id_fkey" FOREIGN KEY (freelancer_id) REFERENCES users(id) NOT DEFERRABLE;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'bids_project_id_fkey') THEN
+        ALTER TABLE ONLY "public"."bids" ADD CONSTRAINT "bids_project_id_fkey" FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE NOT DEFERRABLE;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'deliveries_freelancer_id_fkey') THEN
+        ALTER TABLE ONLY "public"."deliveries" ADD CONSTRAINT "deliveries_freelancer_id_fkey" FOREIGN KEY (freelancer_id) REFERENCES users(id) NOT DEFERRABLE;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'deliveries_project_id_fkey') THEN
+        ALTER TABLE ONLY "public"."deliveries" ADD CONSTRAINT "deliveries_project_id_fkey" FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE NOT DEFERRABLE;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'projects_awarded_bid_id_fkey') THEN
+        ALTER TABLE ONLY "public"."projects" ADD CONSTRAINT "projects_awarded_bid_id_fkey" FOREIGN KEY (awarded_bid_id) REFERENCES bids(id) NOT DEFERRABLE;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'projects_client_id_fkey') THEN
+        ALTER TABLE ONLY "public"."projects" ADD CONSTRAINT "projects_client_id_fkey" FOREIGN KEY (client_id) REFERENCES users(id) NOT DEFERRABLE;
+    END IF;
+END
+$$;
+
+-- schema.sql 的 dump 建序號時沒有 setval，匯入後序號會從 1 開始撞到既有資料；
+-- 序號落後時把它推到目前最大 id
+SELECT setval('users_id_seq', max(id)) FROM users HAVING max(id) > (SELECT last_value FROM users_id_seq);
+SELECT setval('projects_id_seq', max(id)) FROM projects HAVING max(id) > (SELECT last_value FROM projects_id_seq);
+SELECT setval('bids_id_seq', max(id)) FROM bids HAVING max(id) > (SELECT last_value FROM bids_id_seq);
+SELECT setval('deliveries_id_seq', max(id)) FROM deliveries HAVING max(id) > (SELECT last_value FROM deliveries_id_seq);
@@ -0,0 +1,23 @@
+-- migrate: no-transaction
+-- 首頁 / 詳細頁常用條件的索引；用 CONCURRENTLY 建，不會鎖住寫入
+-- （不能包在交易裡，所以這支是逐句執行）
+
+-- 訪客 / 接案人「投放中」：WHERE status='open' ORDER BY id DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS projects_status_id_idx ON projects (status, id);
+
+-- 委託人各分頁 + 統計：WHERE client_id=? AND status=? ORDER BY id DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS projects_client_status_id_idx ON projects (client_id, status, id);
+
+-- 接案人進行中 / 歷史：bids -> projects.awarded_bid_id
+CREATE INDEX CONCURRENTLY IF NOT EXISTS projects_awarded_bid_id_idx ON projects (awarded_bid_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS bids_freelancer_id_idx ON bids (freelancer_id, id);
+
+-- 詳細頁報價列表：WHERE project_id=? ORDER BY price, created_at
+CREATE INDEX CONCURRENTLY IF NOT EXISTS bids_project_price_idx ON bids (project_id, price, created_at);
+
+-- 結案檔案：WHERE project_id=? [AND freelancer_id=?]，詳細頁依時間排序
+CREATE INDEX CONCURRENTLY IF NOT EXISTS deliveries_project_freelancer_idx ON deliveries (project_id, freelancer_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS deliveries_project_created_idx ON deliveries (project_id, created_at);
+
+-- users.username 有兩個一模一樣的唯一索引，留 users_username_key 就好
+DROP INDEX CONCURRENTLY IF EXISTS users_username_uniq;
@@ -0,0 +1,193 @@
+-- 首頁統計數字（投放中 / 進行中 / 已結案）的計數表
+-- 由 projects 上的 trigger 即時增減；之後要重算請跑 python counters.py rebuild
+--   scope = 'client'     : user_id 為委託人
+--   scope = 'freelancer' : user_id 為得標的接案人
+--   scope = 'global'     : user_id 固定 0，全站總數（接案人的「可接案」用）
+
+CREATE TABLE IF NOT EXISTS "public"."project_counters" (
+    "scope" character varying(20) NOT NULL,
+    "user_id" integer NOT NULL,
+    "open_count" integer DEFAULT 0 NOT NULL,
+    "progress_count" integer DEFAULT 0 NOT NULL,
+    "closed_count" integer DEFAULT 0 NOT NULL,
+    CONSTRAINT "project_counters_pkey" PRIMARY KEY ("scope", "user_id")
+);
+
+-- 狀態 -> 統計分類（和首頁分頁籤一致）
+CREATE OR REPLACE FUNCTION project_bucket(p_status text) RETURNS text AS $$
+    SELECT CASE
+        WHEN p_status = 'open' THEN 'open'
+        WHEN p_status IN ('in_progress', 'reopened') THEN 'progress'
+        WHEN p_status = 'closed' THEN 'closed'
+    END
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION bump_project_counter(p_scope text, p_user integer, p_bucket text, p_delta integer)
+RETURNS void AS $$
+BEGIN
+    IF p_user IS NULL OR p_bucket IS NULL THEN
+        RETURN;
+    END IF;
+    INSERT INTO project_counters AS c (scope, user_id, open_count, progress_count, closed_count)
+    VALUES (
+        p_scope, p_user,
+        CASE WHEN p_bucket = 'open' THEN p_delta ELSE 0 END,
+        CASE WHEN p_bucket = 'progress' THEN p_delta ELSE 0 END,
+        CASE WHEN p_bucket = 'closed' THEN p_delta ELSE 0 END
+    )
+    ON CONFLICT (scope, user_id) DO UPDATE SET
+        open_count = c.open_count + EXCLUDED.open_count,
+        progress_count = c.progress_count + EXCLUDED.progress_count,
+        closed_count = c.closed_count + EXCLUDED.closed_count;
+END
+$$ LANGUAGE plpgsql;
+
+-- 用 BEFORE：刪除專案時 bids 會被 CASCADE 刪掉，要在那之前查到得標者
+CREATE OR REPLACE FUNCTION projects_counters_trg() RETURNS trigger AS $$
+DECLARE
+    old_bucket text;
+    new_bucket text;
+    old_freelancer integer;
+    new_freelancer integer;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        old_bucket := project_bucket(OLD.status);
+        SELECT freelancer_id INTO old_freelancer FROM bids WHERE id = OLD.awarded_bid_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        new_bucket := project_bucket(NEW.status);
+        SELECT freelancer_id INTO new_freelancer FROM bids WHERE id = NEW.awarded_bid_id;
+    END IF;
+
+    -- 改標題 / 描述之類的更新不影響統計
+    IF TG_OP = 'UPDATE'
+       AND old_bucket IS NOT DISTINCT FROM new_bucket
+       AND OLD.client_id = NEW.client_id
+       AND old_freelancer IS NOT DISTINCT FROM new_freelancer THEN
+        RETURN NEW;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM bump_project_counter('client', OLD.client_id, old_bucket, -1);
+        PERFORM bump_project_counter('freelancer', old_freelancer, old_bucket, -1);
+        PERFORM bump_project_counter('global', 0, old_bucket, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM bump_project_counter('client', NEW.client_id, new_bucket, 1);
+        PERFORM bump_project_counter('freelancer', new_freelancer, new_bucket, 1);
+        PERFORM bump_project_counter('global', 0, new_bucket, 1);
+        RETURN NEW;
+    END IF;
+    RETURN OLD;
+END
+$$ LANGUAGE plpgsql;
+
+-- 新增 / 更新用 statement 層級的 trigger：transition table 先把整個 statement 的增減加總，
+-- 每個 (scope, user_id) 只寫一次（大量匯入時不會反覆更新 global 那一列、越跑越慢）。
+-- 刪除用 BEFORE ROW（要在 bids 被 CASCADE 刪掉之前查得標者），刪專案本來就是少數情況。
+CREATE OR REPLACE FUNCTION projects_counters_insert_trg() RETURNS trigger AS $$
+BEGIN
+    WITH counter_deltas (scope, user_id, bucket, delta) AS (
+        SELECT 'client', n.client_id, project_bucket(n.status), 1 FROM new_rows n
+        UNION ALL
+        SELECT 'freelancer', b.freelancer_id, project_bucket(n.status), 1
+        FROM new_rows n JOIN bids b ON b.id = n.awarded_bid_id
+        UNION ALL
+        SELECT 'global', 0, project_bucket(n.status), 1 FROM new_rows n
+    )
+    INSERT INTO project_counters AS c (scope, user_id, open_count, progress_count, closed_count)
+    SELECT scope, user_id,
+           COALESCE(sum(delta) FILTER (WHERE bucket = 'open'), 0),
+           COALESCE(sum(delta) FILTER (WHERE bucket = 'progress'), 0),
+           COALESCE(sum(delta) FILTER (WHERE bucket = 'closed'), 0)
+    FROM counter_deltas
+    WHERE user_id IS NOT NULL AND bucket IS NOT NULL
+    GROUP BY scope, user_id
+    ON CONFLICT (scope, user_id) DO UPDATE SET
+        open_count = c.open_count + EXCLUDED.open_count,
+        progress_count = c.progress_count + EXCLUDED.progress_count,
+        closed_count = c.closed_count + EXCLUDED.closed_count;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION projects_counters_update_trg() RETURNS trigger AS $$
+BEGIN
+    WITH counter_deltas (scope, user_id, bucket, delta) AS (
+        SELECT 'client', o.client_id, project_bucket(o.status), -1 FROM old_rows o
+        UNION ALL
+        SELECT 'freelancer', b.freelancer_id, project_bucket(o.status), -1
+        FROM old_rows o JOIN bids b ON b.id = o.awarded_bid_id
+        UNION ALL
+        SELECT 'global', 0, project_bucket(o.status), -1 FROM old_rows o
+        UNION ALL
+        SELECT 'client', n.client_id, project_bucket(n.status), 1 FROM new_rows n
+        UNION ALL
+        SELECT 'freelancer', b.freelancer_id, project_bucket(n.status), 1
+        FROM new_rows n JOIN bids b ON b.id = n.awarded_bid_id
+        UNION ALL
+        SELECT 'global', 0, project_bucket(n.status), 1 FROM new_rows n
+    )
+    INSERT INTO project_counters AS c (scope, user_id, open_count, progress_count, closed_count)
+    SELECT scope, user_id,
+           COALESCE(sum(delta) FILTER (WHERE bucket = 'open'), 0),
+           COALESCE(sum(delta) FILTER (WHERE bucket = 'progress'), 0),
+           COALESCE(sum(delta) FILTER (WHERE bucket = 'closed'), 0)
+    FROM counter_deltas
+    WHERE user_id IS NOT NULL AND bucket IS NOT NULL
+    GROUP BY scope, user_id
+    -- 增減互相抵銷（例如只改標題）就不用寫
+    HAVING sum(delta) FILTER (WHERE bucket = 'open') <> 0
+        OR sum(delta) FILTER (WHERE bucket = 'progress') <> 0
+        OR sum(delta) FILTER (WHERE bucket = 'closed') <> 0
+    ON CONFLICT (scope, user_id) DO UPDATE SET
+        open_count = c.open_count + EXCLUDED.open_count,
+        progress_count = c.progress_count + EXCLUDED.progress_count,
+        closed_count = c.closed_count + EXCLUDED.closed_count;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS projects_counters ON projects;
+DROP TRIGGER IF EXISTS projects_counters_delete ON projects;
+DROP TRIGGER IF EXISTS projects_counters_insert ON projects;
+DROP TRIGGER IF EXISTS projects_counters_update ON projects;
+
+CREATE TRIGGER projects_counters_delete
+    BEFORE DELETE ON projects
+    FOR EACH ROW EXECUTE FUNCTION projects_counters_trg();
+
+CREATE TRIGGER projects_counters_insert
+    AFTER INSERT ON projects
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION projects_counters_insert_trg();
+
+CREATE TRIGGER projects_counters_update
+    AFTER UPDATE ON projects
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION projects_counters_update_trg();
+
+-- 第一次建立時用現有資料填好數字（之後交給 trigger）
+LOCK TABLE projects IN SHARE MODE;
+DELETE FROM project_counters;
+INSERT INTO project_counters (scope, user_id, open_count, progress_count, closed_count)
+SELECT 'client', p.client_id,
+       COUNT(*) FILTER (WHERE project_bucket(p.status)='open'),
+       COUNT(*) FILTER (WHERE project_bucket(p.status)='progress'),
+       COUNT(*) FILTER (WHERE project_bucket(p.status)='closed')
+FROM projects p
+GROUP BY p.client_id
+UNION ALL
+SELECT 'freelancer', b.freelancer_id,
+       COUNT(*) FILTER (WHERE project_bucket(p.status)='open'),
+       COUNT(*) FILTER (WHERE project_bucket(p.status)='progress'),
+       COUNT(*) FILTER (WHERE project_bucket(p.status)='closed')
+FROM projects p
+JOIN bids b ON b.id = p.awarded_bid_id
+GROUP BY b.freelancer_id
+UNION ALL
+SELECT 'global', 0,
+       COUNT(*) FILTER (WHERE project_bucket(p.status)='open'),
+       COUNT(*) FILTER (WHERE project_bucket(p.status)='progress'),
+       COUNT(*) FILTER (WHERE project_bucket(p.status)='closed')
+FROM projects p;
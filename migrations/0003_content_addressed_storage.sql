@@ -0,0 +1,21 @@
+-- 結案檔案改用內容雜湊存放（storage.py）：同樣內容只存一份，用 refcount 記有幾筆 deliveries 在用
+-- storage_key 形如 'cas/ab/<sha256>.png'，相對於 www/uploads；舊資料 storage_key 為 NULL，檔案仍在 uploads/<filename>
+
+CREATE TABLE IF NOT EXISTS "public"."blobs" (
+    "storage_key" character varying(120) NOT NULL,
+    "sha256" character(64) NOT NULL,
+    "size" bigint NOT NULL,
+    "refcount" integer DEFAULT 0 NOT NULL,
+    "created_at" timestamp DEFAULT now() NOT NULL,
+    CONSTRAINT "blobs_pkey" PRIMARY KEY ("storage_key")
+);
+
+ALTER TABLE deliveries ADD COLUMN IF NOT EXISTS storage_key character varying(120);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'deliveries_storage_key_fkey') THEN
+        ALTER TABLE ONLY "public"."deliveries" ADD CONSTRAINT "deliveries_storage_key_fkey" FOREIGN KEY (storage_key) REFERENCES blobs(storage_key) NOT DEFERRABLE;
+    END IF;
+END
+$$;
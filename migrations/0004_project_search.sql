@@ -0,0 +1,46 @@
+-- 專案全文搜尋（標題 + 描述）
+-- 內建的 parser 會把一整串中文當成一個詞，搜「網站」找不到「網站設計」；
+-- 這台也不一定裝得了 pg_trgm / 中文斷詞外掛，所以自己把中文切成「單字 + 相鄰兩字」，
+-- 英文、數字照原本的方式斷詞，再用 'simple' 設定轉成 tsvector。
+-- search_vector 是 generated column：新增 / 編輯 / 刪除專案時資料庫自動維護，程式不用管。
+-- 搜尋字串用 search_query() 以同樣的規則轉成 tsquery（兩個函式放在一起，切法才會一致）。
+
+CREATE OR REPLACE FUNCTION search_tokens(t text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT concat_ws(' ',
+        -- 非中文部分：交給 parser 斷詞
+        regexp_replace(lower(coalesce(t, '')), '[㐀-䶿一-鿿豈-﫿]+', ' ', 'g'),
+        -- 中文部分：每一段連續中文切成單字與相鄰兩字
+        (SELECT string_agg(substr(m.run[1], i, n), ' ')
+           FROM regexp_matches(coalesce(t, ''), '[㐀-䶿一-鿿豈-﫿]+', 'g') AS m(run)
+           CROSS JOIN LATERAL generate_series(1, length(m.run[1])) AS i
+           CROSS JOIN (VALUES (1), (2)) AS g(n)
+          WHERE i + n - 1 <= length(m.run[1]))
+    )
+$$;
+
+-- 搜尋字串 -> tsquery（每個詞都要出現）
+--   英文 / 數字：前綴比對（pyth 找得到 python）
+--   中文：一個字就找單字，兩個字以上找所有相鄰兩字
+CREATE OR REPLACE FUNCTION search_query(q text) RETURNS tsquery
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT coalesce(string_agg(quote_literal(tok) || suffix, ' & '), '')::tsquery
+    FROM (
+        SELECT word AS tok, ':*' AS suffix
+        FROM unnest(tsvector_to_array(to_tsvector('simple',
+                 regexp_replace(lower(coalesce(q, '')), '[㐀-䶿一-鿿豈-﫿]+', ' ', 'g')))) AS word
+        UNION ALL
+        SELECT substr(m.run[1], i, least(2, length(m.run[1]))), ''
+        FROM regexp_matches(coalesce(q, ''), '[㐀-䶿一-鿿豈-﫿]+', 'g') AS m(run)
+        CROSS JOIN LATERAL generate_series(1, greatest(length(m.run[1]) - 1, 1)) AS i
+    ) t
+$$;
+
+-- 加 STORED 欄位本來就會重寫整張表，索引直接一起建（不另外 CONCURRENTLY）
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', search_tokens(title)), 'A') ||
+        setweight(to_tsvector('simple', search_tokens(description)), 'B')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS projects_search_idx ON projects USING gin (search_vector);
@@ -0,0 +1,23 @@
+-- 圖片結案檔案的縮圖 / 預覽（previews.py）
+-- preview_status：NULL = 還沒產生（圖片的話頁面顯示「預覽產生中」），'pending' = 某個 worker 啟動時認領去補做，
+-- 'ready' = 已產生，'failed' = 壞圖或太大，'skipped' = 不是圖片或伺服器沒裝 Pillow
+-- preview_claimed_at：認領的時間；認領的 worker 沒做完就關掉的話，過一段時間別的 worker 可以再認領
+-- 縮圖檔名由 storage_key 推出來（cas/ab/<sha256>.thumb.webp、.preview.webp），不用另外存
+
+ALTER TABLE blobs ADD COLUMN IF NOT EXISTS preview_status character varying(10);
+ALTER TABLE blobs ADD COLUMN IF NOT EXISTS preview_claimed_at timestamptz;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'blobs_preview_status_check') THEN
+        ALTER TABLE blobs ADD CONSTRAINT blobs_preview_status_check
+            CHECK (preview_status IN ('pending', 'ready', 'failed', 'skipped'));
+    END IF;
+END
+$$;
+
+-- 已經有的非圖片檔不會有縮圖（副檔名要跟 storage.IMAGE_SUFFIXES 一致）
+UPDATE blobs SET preview_status = 'skipped'
+WHERE preview_status IS NULL
+  AND COALESCE(lower(substring(storage_key from '\.[^./]+$')), '')
+      <> ALL (ARRAY['.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp']);
@@ -0,0 +1,34 @@
+-- 背景工作佇列（jobs.py）：刪檔之類的副作用跟資料變更寫在同一個交易裡，commit 了就一定會做到
+-- status：queued 等待中 / running 執行中 / done 完成 / failed 重試次數用完
+-- dedupe_key：同一個 key 同時只會有一筆在排隊或執行（例如定期清理只排一筆）
+
+CREATE TABLE IF NOT EXISTS "public"."jobs" (
+    "id" bigserial NOT NULL,
+    "kind" character varying(40) NOT NULL,
+    "payload" jsonb DEFAULT '{}'::jsonb NOT NULL,
+    "status" character varying(10) DEFAULT 'queued' NOT NULL,
+    "attempts" integer DEFAULT 0 NOT NULL,
+    "max_attempts" integer DEFAULT 5 NOT NULL,
+    "run_at" timestamp DEFAULT now() NOT NULL,
+    "locked_at" timestamp,
+    "dedupe_key" character varying(200),
+    "last_error" text,
+    "created_at" timestamp DEFAULT now() NOT NULL,
+    "finished_at" timestamp,
+    CONSTRAINT "jobs_pkey" PRIMARY KEY ("id"),
+    CONSTRAINT "jobs_status_check" CHECK (status IN ('queued', 'running', 'done', 'failed'))
+);
+
+-- worker 取工作：只掃還沒做完的（部分索引，做完的再多也不影響）
+CREATE INDEX IF NOT EXISTS jobs_pending_idx ON jobs (run_at) WHERE status IN ('queued', 'running');
+
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_dedupe_idx ON jobs (dedupe_key)
+    WHERE dedupe_key IS NOT NULL AND status IN ('queued', 'running');
+
+-- 清掉舊的已完成工作用
+CREATE INDEX IF NOT EXISTS jobs_finished_idx ON jobs (finished_at) WHERE status IN ('done', 'failed');
+
+-- 孤兒清理 / 刪檔前確認用：依內容雜湊找 blobs、依 storage_key 數 deliveries、依檔名找舊資料
+CREATE INDEX IF NOT EXISTS blobs_sha256_idx ON blobs (sha256);
+CREATE INDEX IF NOT EXISTS deliveries_storage_key_idx ON deliveries (storage_key) WHERE storage_key IS NOT NULL;
+CREATE INDEX IF NOT EXISTS deliveries_legacy_filename_idx ON deliveries (filename) WHERE storage_key IS NULL;
@@ -0,0 +1,92 @@
+-- 每個專案的報價摘要（報價數、最低 / 最高 / 中位數價格、最新報價時間），由 bids 的 trigger 即時維護
+-- 列表的報價數、專案頁的摘要直接讀這張表，不用每次 COUNT(*) 全部報價
+-- 還沒有報價的專案沒有這一列（讀的時候當成 0）
+
+CREATE TABLE IF NOT EXISTS "public"."project_bid_stats" (
+    "project_id" integer NOT NULL,
+    "bid_count" integer DEFAULT 0 NOT NULL,
+    "min_price" integer,
+    "max_price" integer,
+    "median_price" integer,
+    "last_bid_at" timestamp,
+    CONSTRAINT "project_bid_stats_pkey" PRIMARY KEY ("project_id"),
+    CONSTRAINT "project_bid_stats_project_id_fkey" FOREIGN KEY ("project_id")
+        REFERENCES "public"."projects"("id") ON DELETE CASCADE
+);
+
+-- 重算指定專案的摘要。中位數沒辦法增量維護，所以整個專案重算一次（走 bids_project_price_id_idx，
+-- 只讀索引，幾千筆報價也是毫秒等級）。
+-- 先鎖住摘要那一列再算：同一個專案同時有兩筆報價時，後到的會等前一個 commit，
+-- 之後的查詢（READ COMMITTED 每句重新取快照）就看得到對方的報價，不會把舊數字蓋回去。
+CREATE OR REPLACE FUNCTION refresh_bid_stats(ids integer[]) RETURNS void AS $$
+BEGIN
+    INSERT INTO project_bid_stats (project_id)
+    SELECT p.id FROM projects p WHERE p.id = ANY(ids)   -- 專案被刪（CASCADE 刪報價）就不用再寫
+    ON CONFLICT (project_id) DO NOTHING;
+
+    PERFORM 1 FROM project_bid_stats WHERE project_id = ANY(ids) ORDER BY project_id FOR UPDATE;
+
+    UPDATE project_bid_stats s
+    SET (bid_count, min_price, max_price, median_price, last_bid_at) = (
+        SELECT count(*), min(b.price), max(b.price),
+               round(percentile_cont(0.5) WITHIN GROUP (ORDER BY b.price)),
+               max(b.created_at)
+        FROM bids b WHERE b.project_id = s.project_id
+    )
+    WHERE s.project_id = ANY(ids);
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bids_stats_insert_trg() RETURNS trigger AS $$
+BEGIN
+    PERFORM refresh_bid_stats(ARRAY(SELECT DISTINCT project_id FROM new_rows));
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bids_stats_update_trg() RETURNS trigger AS $$
+BEGIN
+    PERFORM refresh_bid_stats(ARRAY(
+        SELECT project_id FROM old_rows UNION SELECT project_id FROM new_rows));
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bids_stats_delete_trg() RETURNS trigger AS $$
+BEGIN
+    PERFORM refresh_bid_stats(ARRAY(SELECT DISTINCT project_id FROM old_rows));
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS bids_stats_insert ON bids;
+DROP TRIGGER IF EXISTS bids_stats_update ON bids;
+DROP TRIGGER IF EXISTS bids_stats_delete ON bids;
+
+CREATE TRIGGER bids_stats_insert
+    AFTER INSERT ON bids
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bids_stats_insert_trg();
+
+CREATE TRIGGER bids_stats_update
+    AFTER UPDATE ON bids
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bids_stats_update_trg();
+
+CREATE TRIGGER bids_stats_delete
+    AFTER DELETE ON bids
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION bids_stats_delete_trg();
+
+-- 專案頁報價分頁：價格排序 (price, id)、時間排序 (id)，同價格用 id 決定先後，游標才不會重複或漏掉
+CREATE INDEX IF NOT EXISTS bids_project_price_id_idx ON bids (project_id, price, id);
+CREATE INDEX IF NOT EXISTS bids_project_id_idx ON bids (project_id, id);
+DROP INDEX IF EXISTS bids_project_price_idx;
+
+-- 現有資料
+INSERT INTO project_bid_stats (project_id, bid_count, min_price, max_price, median_price, last_bid_at)
+SELECT project_id, count(*), min(price), max(price),
+       round(percentile_cont(0.5) WITHIN GROUP (ORDER BY price)), max(created_at)
+FROM bids
+GROUP BY project_id
+ON CONFLICT (project_id) DO NOTHING;
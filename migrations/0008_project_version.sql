@@ -0,0 +1,19 @@
+-- 專案版本號：每次 UPDATE 專案（編輯、選標、結案、退件……）就加 1
+-- 首頁的專案卡片片段快取以 (id, version, 角色) 當 key，版本變了舊的卡片自然用不到，不用另外清
+-- 設了 app.keep_version = on 的交易不加（datacopy.py 匯入時補外鍵，要保留原本的版本號）
+
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS "version" integer DEFAULT 1 NOT NULL;
+
+CREATE OR REPLACE FUNCTION projects_version_trg() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('app.keep_version', true) IS DISTINCT FROM 'on' THEN
+        NEW.version := OLD.version + 1;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS projects_version ON projects;
+CREATE TRIGGER projects_version
+    BEFORE UPDATE ON projects
+    FOR EACH ROW EXECUTE FUNCTION projects_version_trg();
@@ -0,0 +1,37 @@
+-- 限流的 token bucket（ratelimit.py 設 RATE_LIMIT_BACKEND=postgres 時用，多個 worker / 多台機器共用同一組額度）
+-- UNLOGGED：不寫 WAL、當機後清空也沒關係（頂多大家的額度重新變滿）
+-- 很久沒動的列由 jobs.py 的清理順便刪掉（沒有列 = 額度是滿的）
+
+CREATE UNLOGGED TABLE IF NOT EXISTS "public"."rate_limits" (
+    "key" text NOT NULL,
+    "tokens" double precision NOT NULL,
+    "updated_at" timestamptz DEFAULT clock_timestamp() NOT NULL,
+    CONSTRAINT "rate_limits_pkey" PRIMARY KEY ("key")
+);
+
+CREATE INDEX IF NOT EXISTS rate_limits_updated_at_idx ON rate_limits (updated_at);
+
+-- 從 key 的桶子拿 cost 個 token：先依經過的時間補（每秒 rate 個，最多 burst 個）。
+-- 夠就扣掉、回傳 0；不夠就不扣，回傳還要等幾秒。
+-- 同一個 key 同時來的請求會在那一列上排隊（FOR UPDATE），不會兩個都拿到最後一個 token。
+CREATE OR REPLACE FUNCTION rate_limit_take(p_key text, p_rate double precision, p_burst double precision,
+                                           p_cost double precision DEFAULT 1)
+RETURNS double precision AS $$
+DECLARE
+    have double precision;
+    last timestamptz;
+BEGIN
+    INSERT INTO rate_limits (key, tokens) VALUES (p_key, p_burst)
+    ON CONFLICT (key) DO NOTHING;
+
+    SELECT tokens, updated_at INTO have, last FROM rate_limits WHERE key = p_key FOR UPDATE;
+    have := LEAST(p_burst, have + EXTRACT(EPOCH FROM clock_timestamp() - last) * p_rate);
+
+    IF have >= p_cost THEN
+        UPDATE rate_limits SET tokens = have - p_cost, updated_at = clock_timestamp() WHERE key = p_key;
+        RETURN 0;
+    END IF;
+    UPDATE rate_limits SET tokens = have, updated_at = clock_timestamp() WHERE key = p_key;
+    RETURN (p_cost - have) / p_rate;
+END
+$$ LANGUAGE plpgsql;
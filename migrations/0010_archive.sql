@@ -0,0 +1,140 @@
+-- 冷熱分離：結案超過一段時間的專案，連同報價、結案檔案、報價摘要，由 archive.py 分批搬到 *_archive 表
+-- projects / bids / deliveries 只留還會變動的資料，投放中 / 進行中的查詢與索引都變小
+-- 已結案分頁、專案頁、下載、搜尋會把 archive 一起讀（all_projects / all_bids / all_deliveries 三個 view）
+-- 搬移的交易會設 app.archiving = on：計數與報價摘要的 trigger 不動（專案還是算「已結案」）
+-- projects / bids / deliveries 之後加欄位時，archive 表、view 與 archive.py 也要一起加
+
+-- 結案時間（transitions.py 結案時寫入）；舊資料用最後一個結案檔案的時間，沒有就用建立時間
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS "closed_at" timestamp;
+
+UPDATE projects p
+SET closed_at = COALESCE((SELECT max(d.created_at) FROM deliveries d WHERE d.project_id = p.id), p.created_at)
+WHERE p.status = 'closed' AND p.closed_at IS NULL;
+
+-- archive.py 挑最早結案的一批
+CREATE INDEX IF NOT EXISTS projects_closed_at_idx ON projects (closed_at) WHERE status = 'closed';
+
+-- ----------------
+-- archive 表（欄位同原本的表，外鍵指向彼此）
+-- ----------------
+CREATE TABLE IF NOT EXISTS "public"."projects_archive" (
+    "id" integer NOT NULL,
+    "title" character varying(100) NOT NULL,
+    "description" text,
+    "status" character varying(20) NOT NULL,
+    "client_id" integer NOT NULL,
+    "created_at" timestamp NOT NULL,
+    "awarded_bid_id" integer,
+    "budget" integer,
+    "search_vector" tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', search_tokens(title)), 'A') ||
+        setweight(to_tsvector('simple', search_tokens(description)), 'B')
+    ) STORED,
+    "version" integer DEFAULT 1 NOT NULL,
+    "closed_at" timestamp,
+    "archived_at" timestamp DEFAULT now() NOT NULL,
+    CONSTRAINT "projects_archive_pkey" PRIMARY KEY ("id"),
+    CONSTRAINT "projects_archive_client_id_fkey" FOREIGN KEY ("client_id") REFERENCES "public"."users"("id")
+);
+
+CREATE TABLE IF NOT EXISTS "public"."bids_archive" (
+    "id" integer NOT NULL,
+    "project_id" integer NOT NULL,
+    "freelancer_id" integer NOT NULL,
+    "price" integer NOT NULL,
+    "message" text,
+    "created_at" timestamp NOT NULL,
+    CONSTRAINT "bids_archive_pkey" PRIMARY KEY ("id"),
+    CONSTRAINT "bids_archive_project_id_fkey" FOREIGN KEY ("project_id")
+        REFERENCES "public"."projects_archive"("id") ON DELETE CASCADE,
+    CONSTRAINT "bids_archive_freelancer_id_fkey" FOREIGN KEY ("freelancer_id") REFERENCES "public"."users"("id")
+);
+
+-- 得標報價和專案同一批搬進來：檢查留到 commit 再做
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'projects_archive_awarded_bid_id_fkey') THEN
+        ALTER TABLE projects_archive ADD CONSTRAINT projects_archive_awarded_bid_id_fkey
+            FOREIGN KEY (awarded_bid_id) REFERENCES bids_archive(id) DEFERRABLE INITIALLY DEFERRED;
+    END IF;
+END
+$$;
+
+CREATE TABLE IF NOT EXISTS "public"."deliveries_archive" (
+    "id" integer NOT NULL,
+    "project_id" integer NOT NULL,
+    "freelancer_id" integer NOT NULL,
+    "filename" character varying(200) NOT NULL,
+    "note" text,
+    "created_at" timestamp NOT NULL,
+    "storage_key" character varying(120),
+    CONSTRAINT "deliveries_archive_pkey" PRIMARY KEY ("id"),
+    CONSTRAINT "deliveries_archive_project_id_fkey" FOREIGN KEY ("project_id")
+        REFERENCES "public"."projects_archive"("id") ON DELETE CASCADE,
+    CONSTRAINT "deliveries_archive_freelancer_id_fkey" FOREIGN KEY ("freelancer_id") REFERENCES "public"."users"("id"),
+    CONSTRAINT "deliveries_archive_storage_key_fkey" FOREIGN KEY ("storage_key") REFERENCES "public"."blobs"("storage_key")
+);
+
+-- 搬過來之後就不會再變，不用 trigger 維護
+CREATE TABLE IF NOT EXISTS "public"."project_bid_stats_archive" (
+    "project_id" integer NOT NULL,
+    "bid_count" integer DEFAULT 0 NOT NULL,
+    "min_price" integer,
+    "max_price" integer,
+    "median_price" integer,
+    "last_bid_at" timestamp,
+    CONSTRAINT "project_bid_stats_archive_pkey" PRIMARY KEY ("project_id"),
+    CONSTRAINT "project_bid_stats_archive_project_id_fkey" FOREIGN KEY ("project_id")
+        REFERENCES "public"."projects_archive"("id") ON DELETE CASCADE
+);
+
+-- 已結案分頁（委託人 / 接案人）、專案頁、下載、搜尋、對帳用到的索引
+CREATE INDEX IF NOT EXISTS projects_archive_client_id_idx ON projects_archive (client_id, id);
+CREATE INDEX IF NOT EXISTS projects_archive_awarded_bid_id_idx ON projects_archive (awarded_bid_id);
+CREATE INDEX IF NOT EXISTS projects_archive_search_idx ON projects_archive USING gin (search_vector);
+CREATE INDEX IF NOT EXISTS bids_archive_project_price_id_idx ON bids_archive (project_id, price, id);
+CREATE INDEX IF NOT EXISTS bids_archive_project_id_idx ON bids_archive (project_id, id);
+CREATE INDEX IF NOT EXISTS bids_archive_freelancer_id_idx ON bids_archive (freelancer_id, id);
+CREATE INDEX IF NOT EXISTS deliveries_archive_project_created_idx ON deliveries_archive (project_id, created_at);
+CREATE INDEX IF NOT EXISTS deliveries_archive_storage_key_idx ON deliveries_archive (storage_key) WHERE storage_key IS NOT NULL;
+CREATE INDEX IF NOT EXISTS deliveries_archive_legacy_filename_idx ON deliveries_archive (filename) WHERE storage_key IS NULL;
+
+-- ----------------
+-- 熱 + 冷一起讀（UNION ALL；WHERE id = ? 之類的條件會推進兩邊，各走自己的索引）
+-- ----------------
+CREATE OR REPLACE VIEW all_projects AS
+    SELECT id, title, description, status, client_id, created_at, awarded_bid_id, budget,
+           search_vector, version, closed_at
+    FROM projects
+    UNION ALL
+    SELECT id, title, description, status, client_id, created_at, awarded_bid_id, budget,
+           search_vector, version, closed_at
+    FROM projects_archive;
+
+CREATE OR REPLACE VIEW all_bids AS
+    SELECT id, project_id, freelancer_id, price, message, created_at FROM bids
+    UNION ALL
+    SELECT id, project_id, freelancer_id, price, message, created_at FROM bids_archive;
+
+CREATE OR REPLACE VIEW all_deliveries AS
+    SELECT id, project_id, freelancer_id, filename, note, created_at, storage_key FROM deliveries
+    UNION ALL
+    SELECT id, project_id, freelancer_id, filename, note, created_at, storage_key FROM deliveries_archive;
+
+-- ----------------
+-- 搬移時不動計數 / 報價摘要（刪掉的列已經原封不動搬到 archive）
+-- ----------------
+DROP TRIGGER IF EXISTS projects_counters_delete ON projects;
+CREATE TRIGGER projects_counters_delete
+    BEFORE DELETE ON projects
+    FOR EACH ROW
+    WHEN (current_setting('app.archiving', true) IS DISTINCT FROM 'on')
+    EXECUTE FUNCTION projects_counters_trg();
+
+DROP TRIGGER IF EXISTS bids_stats_delete ON bids;
+CREATE TRIGGER bids_stats_delete
+    AFTER DELETE ON bids
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    WHEN (current_setting('app.archiving', true) IS DISTINCT FROM 'on')
+    EXECUTE FUNCTION bids_stats_delete_trg();
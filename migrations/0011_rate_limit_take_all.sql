@@ -0,0 +1,33 @@
+-- 一個路由有好幾個限制（例如報價：每個人 + 每個 IP）時，一次呼叫看完所有桶子：
+-- 每個都夠才一起扣、回傳 0；有一個不夠就都不扣（只補 token），回傳最久要等幾秒。
+-- 先依 key 排序建立 / 鎖住每一列，同時拿同一組桶子的請求不會互相死結。
+
+CREATE OR REPLACE FUNCTION rate_limit_take_all(p_keys text[], p_rates double precision[],
+                                               p_bursts double precision[], p_cost double precision DEFAULT 1)
+RETURNS double precision AS $$
+DECLARE
+    ts timestamptz := clock_timestamp();
+    wait double precision;
+BEGIN
+    INSERT INTO rate_limits (key, tokens)
+    SELECT k, b FROM unnest(p_keys, p_bursts) AS t(k, b) ORDER BY k
+    ON CONFLICT (key) DO NOTHING;
+
+    PERFORM 1 FROM rate_limits WHERE key = ANY(p_keys) ORDER BY key FOR UPDATE;
+
+    SELECT max(CASE WHEN have >= p_cost THEN 0 ELSE (p_cost - have) / rate END) INTO wait
+    FROM (
+        SELECT t.rate, LEAST(t.burst, r.tokens + EXTRACT(EPOCH FROM ts - r.updated_at) * t.rate) AS have
+        FROM unnest(p_keys, p_rates, p_bursts) AS t(key, rate, burst)
+        JOIN rate_limits r ON r.key = t.key
+    ) s;
+
+    UPDATE rate_limits r
+    SET tokens = LEAST(t.burst, r.tokens + EXTRACT(EPOCH FROM ts - r.updated_at) * t.rate)
+                 - CASE WHEN wait = 0 THEN p_cost ELSE 0 END,
+        updated_at = ts
+    FROM unnest(p_keys, p_rates, p_bursts) AS t(key, rate, burst)
+    WHERE r.key = t.key;
+    RETURN wait;
+END
+$$ LANGUAGE plpgsql;
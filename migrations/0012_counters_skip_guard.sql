@@ -0,0 +1,20 @@
+-- plancheck.py 在正式資料庫裡塞假資料跑 EXPLAIN（最後 ROLLBACK）：
+-- 設 app.skip_counters = on 時新增 / 修改專案不動 project_counters，
+-- 不然 'global' 那一列會被鎖到檢查結束，期間所有新增專案 / 改狀態都卡住。
+-- 刪除的 trigger 已經有 app.archiving（0010），plancheck 搬 archive 時一起設。
+
+DROP TRIGGER IF EXISTS projects_counters_insert ON projects;
+CREATE TRIGGER projects_counters_insert
+    AFTER INSERT ON projects
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    WHEN (current_setting('app.skip_counters', true) IS DISTINCT FROM 'on')
+    EXECUTE FUNCTION projects_counters_insert_trg();
+
+DROP TRIGGER IF EXISTS projects_counters_update ON projects;
+CREATE TRIGGER projects_counters_update
+    AFTER UPDATE ON projects
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    WHEN (current_setting('app.skip_counters', true) IS DISTINCT FROM 'on')
+    EXECUTE FUNCTION projects_counters_update_trg();
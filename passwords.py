@@ -0,0 +1,152 @@
+# passwords.py
+# 密碼雜湊 / 驗證：bcrypt 一次要 ~250ms CPU，放在 request 裡會卡住其他頁面，
+# 所以丟到獨立的 process pool 跑，並限制排隊數量：排滿了直接拒絕（HashBusy），不讓登入尖峰拖垮整站。
+import asyncio
+import hmac
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+HASH_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))  # 同時最多幾個雜湊在跑
+HASH_MAX_PENDING = HASH_WORKERS * 8                         # 執行中 + 排隊中的上限，超過就拒絕
+
+BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+PBKDF2_PREFIX = "$pbkdf2-sha256$"
+PLAIN_PREFIX = "plain:"
+
+
+class HashBusy(Exception):
+    # 雜湊佇列已滿，呼叫端應該請使用者稍後再試
+    pass
+
+
+# ----------------
+# 在子行程裡執行的函式（必須是模組層級，才能 pickle 過去）
+# ----------------
+def _hash(password):
+    try:
+        from passlib.hash import bcrypt
+        return bcrypt.hash(password)
+    except Exception:
+        pass
+    try:
+        from passlib.hash import pbkdf2_sha256
+        return pbkdf2_sha256.hash(password)
+    except Exception:
+        return PLAIN_PREFIX + password
+
+
+def _verify(password, stored):
+    try:
+        if stored.startswith(BCRYPT_PREFIXES):
+            from passlib.hash import bcrypt
+            return bcrypt.verify(password, stored)
+        if stored.startswith(PBKDF2_PREFIX):
+            from passlib.hash import pbkdf2_sha256
+            return pbkdf2_sha256.verify(password, stored)
+    except Exception:
+        pass
+    return False
+
+
+def _warm_up():
+    # 先把 passlib 載入好，第一個登入的人不用等 import
+    try:
+        import passlib.hash  # noqa: F401
+    except Exception:
+        pass
+    return os.getpid()
+
+
+# ----------------
+# 行程池與准入控制
+# ----------------
+_executor = None
+_slots = None       # 控制同時送進 executor 的數量
+_pending = 0        # 執行中 + 等待中的數量
+_background = set()  # 背景工作（rehash）要留參考，避免被 GC
+
+
+async def start_hasher():
+    # lifespan 啟動時呼叫；用 spawn 開子行程，不會複製到父行程的連線池和 event loop
+    global _executor, _slots, _pending
+    if _executor is None:
+        _executor = ProcessPoolExecutor(HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        _slots = asyncio.Semaphore(HASH_WORKERS)
+        _pending = 0
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(_executor, _warm_up) for _ in range(HASH_WORKERS)))
+    return _executor
+
+
+async def stop_hasher():
+    global _executor, _slots
+    if _background:
+        await asyncio.gather(*_background, return_exceptions=True)
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+        _slots = None
+
+
+async def _run(fn, *args):
+    global _pending
+    if _pending >= HASH_MAX_PENDING:
+        raise HashBusy()
+    _pending += 1
+    try:
+        executor = _executor or await start_hasher()
+        async with _slots:
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+    finally:
+        _pending -= 1
+
+
+def hasher_stats():
+    return {"workers": HASH_WORKERS, "pending": _pending, "max_pending": HASH_MAX_PENDING,
+            "background": len(_background)}
+
+
+# ----------------
+# 對外介面
+# ----------------
+async def hash_password(password):
+    # 註冊用；佇列滿時丟 HashBusy
+    return await _run(_hash, password)
+
+
+async def verify_password(password, stored):
+    """
+    回傳 (ok, needs_rehash)。明文（plain:）直接比對，不佔用行程池；
+    needs_rehash 為 True 表示登入成功後應該在背景改存成 bcrypt。
+    """
+    if stored.startswith(PLAIN_PREFIX):
+        ok = hmac.compare_digest(stored[len(PLAIN_PREFIX):].encode(), password.encode())
+        return ok, ok
+    if stored.startswith(BCRYPT_PREFIXES) or stored.startswith(PBKDF2_PREFIX):
+        return await _run(_verify, password, stored), False
+    return False, False
+
+
+def rehash_later(pool, user_id, password, old_hash):
+    """
+    首次登入把明文密碼轉成 bcrypt：不在 response 路徑上做，另外排一個背景工作。
+    用自己的連線，且只在 password_hash 還是舊值時才更新（避免蓋掉同時改過的密碼）。
+    """
+    async def job():
+        try:
+            new_hash = await _run(_hash, password)
+        except HashBusy:
+            return  # 忙的時候先跳過，下次登入再轉
+        if new_hash.startswith(PLAIN_PREFIX):
+            return
+        async with pool.connection() as conn:
+            await conn.execute(
+                "UPDATE users SET password_hash=%s WHERE id=%s AND password_hash=%s",
+                (new_hash, user_id, old_hash),
+            )
+
+    task = asyncio.create_task(job())
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
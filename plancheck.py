@@ -0,0 +1,238 @@
+# plancheck.py
+# 查詢計畫檢查：塞一批假資料後對每個常用查詢跑 EXPLAIN，
+# 只要有熱門資料表用到 Seq Scan（全表掃描）就算失敗（exit code = 1）。
+# 全部在同一個交易裡做，最後 ROLLBACK，不會留下任何資料。
+# 可以對正式資料庫跑：假資料不動 project_counters（app.skip_counters，migration 0012），
+# 不會鎖住 'global' 那一列卡住別人新增專案；帳號名稱帶這次的亂數，不會撞到真的帳號。
+#   python plancheck.py [--projects 20000] [--users 2000] [-v]
+import argparse
+import sys
+import uuid
+
+import psycopg
+
+from db import CONNINFO
+from queries import LIST_QUERIES, list_sql, DETAIL_SQL, detail_sql, detail_params
+from search import search_sql
+from downloads import DELIVERY_SQL, PROJECT_DELIVERIES_SQL
+from archive import ARCHIVE_SQL
+import transitions
+
+HOT_TABLES = {"users", "projects", "bids", "deliveries", "project_counters",
+              "projects_archive", "bids_archive", "deliveries_archive", "project_bid_stats_archive"}
+
+SEED_STEPS = [
+    "SET LOCAL app.skip_counters = on",
+    """
+    INSERT INTO users (username, password_hash, role, full_name)
+    SELECT 'plancheck_' || %(tag)s || '_' || g, 'plain:x',
+           CASE WHEN g %% 2 = 0 THEN 'client' ELSE 'freelancer' END, 'plancheck'
+    FROM generate_series(1, %(users)s) g
+    """,
+    """
+    CREATE TEMP TABLE seed_clients ON COMMIT DROP AS
+        SELECT id, row_number() OVER (ORDER BY id) AS rn
+        FROM users WHERE username LIKE 'plancheck\\_' || %(tag)s || '\\_%%' AND role='client'
+    """,
+    """
+    CREATE TEMP TABLE seed_freelancers ON COMMIT DROP AS
+        SELECT id, row_number() OVER (ORDER BY id) AS rn
+        FROM users WHERE username LIKE 'plancheck\\_' || %(tag)s || '\\_%%' AND role='freelancer'
+    """,
+    # 計數的 trigger 關掉了：每個假帳號一列（跟 trigger 會建的一樣），不碰 'global' 那列
+    """
+    INSERT INTO project_counters (scope, user_id)
+    SELECT 'client', id FROM seed_clients UNION ALL SELECT 'freelancer', id FROM seed_freelancers
+    """,
+    """
+    INSERT INTO projects (title, description, status, client_id, budget, created_at)
+    SELECT 'plancheck project ' || g, repeat('專案描述 ', 40),
+           (ARRAY['open', 'in_progress', 'reopened', 'closed', 'closed'])[1 + g %% 5],
+           c.id, 1000 + (g %% 50) * 100, now() - g * interval '1 minute'
+    FROM generate_series(1, %(projects)s) g
+    JOIN seed_clients c ON c.rn = 1 + g %% (SELECT count(*) FROM seed_clients)
+    """,
+    # 每個專案 3 筆報價，報價人錯開
+    """
+    INSERT INTO bids (project_id, freelancer_id, price, message)
+    SELECT p.id, f.id, 500 + (p.id * 37 + k * 101) %% 5000, 'plancheck bid'
+    FROM projects p
+    CROSS JOIN generate_series(0, 2) k
+    JOIN seed_freelancers f
+      ON f.rn = 1 + (p.id + k * 97) %% (SELECT count(*) FROM seed_freelancers)
+    WHERE p.client_id IN (SELECT id FROM seed_clients)
+    """,
+    # 非投放中的專案都有得標者，進行中 / 已結案的有結案檔案
+    """
+    UPDATE projects p
+    SET awarded_bid_id = first_bid.id
+    FROM (SELECT project_id, min(id) AS id FROM bids GROUP BY project_id) first_bid
+    WHERE first_bid.project_id = p.id
+      AND p.client_id IN (SELECT id FROM seed_clients) AND p.status <> 'open'
+    """,
+    """
+    INSERT INTO deliveries (project_id, freelancer_id, filename, note)
+    SELECT p.id, b.freelancer_id, 'plancheck-' || p.id || '.png', 'plancheck'
+    FROM projects p JOIN bids b ON b.id = p.awarded_bid_id
+    WHERE p.client_id IN (SELECT id FROM seed_clients) AND p.status IN ('in_progress', 'closed')
+    """,
+    # 已結案的一半搬到 archive（和 archive.py 同一句 SQL），列表 / 專案頁兩邊都要讀得到；
+    # 結案時間放在很久以前，archive 照 closed_at 挑的時候只會挑到假資料，不會鎖到真的專案
+    """
+    UPDATE projects SET closed_at = timestamptz '2000-01-01' + id * interval '1 minute'
+    WHERE client_id IN (SELECT id FROM seed_clients) AND status = 'closed'
+    """,
+    "SET LOCAL app.archiving = on",
+    ARCHIVE_SQL,
+    # 留在線上的已結案專案換回比較近的結案時間，archive 查詢的估計才跟正式環境一樣（到期的不多）
+    """
+    UPDATE projects SET closed_at = created_at + interval '1 day'
+    WHERE client_id IN (SELECT id FROM seed_clients) AND status = 'closed'
+    """,
+    "ANALYZE users",
+    "ANALYZE projects",
+    "ANALYZE bids",
+    "ANALYZE deliveries",
+    "ANALYZE project_counters",
+    "ANALYZE projects_archive",
+    "ANALYZE bids_archive",
+    "ANALYZE deliveries_archive",
+    "ANALYZE project_bid_stats_archive",
+]
+
+# 挑幾個有代表性的 id 當查詢參數
+PICK_SQL = """
+    SELECT
+        (SELECT client_id FROM projects GROUP BY client_id ORDER BY count(*) DESC LIMIT 1),
+        (SELECT b.freelancer_id FROM projects p JOIN bids b ON b.id = p.awarded_bid_id
+          GROUP BY b.freelancer_id ORDER BY count(*) DESC LIMIT 1),
+        (SELECT project_id FROM bids GROUP BY project_id ORDER BY count(*) DESC, project_id LIMIT 1),
+        (SELECT percentile_disc(0.5) WITHIN GROUP (ORDER BY id) FROM projects),
+        (SELECT username FROM users ORDER BY id DESC LIMIT 1),
+        (SELECT max(id) FROM projects_archive)
+"""
+
+
+def hot_queries(client_id, freelancer_id, project_id, mid_id, username, archived_id):
+    # [(名稱, SQL, 參數)]；列表 / 專案頁直接用 queries.py 的 SQL，其餘和 app.py 的路由一致
+    out = []
+    for key in LIST_QUERIES:
+        uid = client_id if key[0] == "client" else freelancer_id
+        params = {"uid": uid, "cursor": mid_id, "limit": 21}
+        out.append((f"list {key[0]}/{key[1]}", list_sql(key), params))
+        out.append((f"list {key[0]}/{key[1]} (next page)", list_sql(key, True, "next"), params))
+        out.append((f"list {key[0]}/{key[1]} (prev page)", list_sql(key, True, "prev"), params))
+
+    out += [
+        ("dashboard counters", """
+            SELECT scope, open_count, progress_count, closed_count
+            FROM project_counters
+            WHERE (scope=%s AND user_id=%s) OR (scope='global' AND user_id=0)
+        """, ("client", client_id)),
+        ("detail (owner)", DETAIL_SQL, detail_params(project_id, {"role": "client", "id": client_id})),
+        ("detail (freelancer)", DETAIL_SQL, detail_params(project_id, {"role": "freelancer", "id": freelancer_id})),
+        ("detail (guest)", DETAIL_SQL, detail_params(project_id, None)),
+        ("detail (owner, bids by price, next page)", detail_sql("price", True),
+         detail_params(project_id, {"role": "client", "id": client_id}, {"bid_price": 3000, "bid_id": mid_id})),
+        ("detail (owner, newest bids, next page)", detail_sql("newest", True),
+         detail_params(project_id, {"role": "client", "id": client_id}, {"bid_price": None, "bid_id": mid_id})),
+        ("detail (owner, archived)", detail_sql(archived=True),
+         detail_params(archived_id, {"role": "client", "id": client_id})),
+        ("detail (freelancer, archived)", detail_sql(archived=True),
+         detail_params(archived_id, {"role": "freelancer", "id": freelancer_id})),
+        ("search (keyword)", *search_sql({"q": "project 1234", "status": "all", "min_budget": None,
+                                          "max_budget": None, "cursor": None})),
+        ("search (keyword + filters, next page)", *search_sql({"q": "plancheck", "status": "open", "min_budget": 2000,
+                                                             "max_budget": 4000, "cursor": (0.1, mid_id)})),
+        ("search (closed, incl. archive)", *search_sql({"q": "project 1234", "status": "closed", "min_budget": None,
+                                                       "max_budget": None, "cursor": None})),
+        ("download: delivery", DELIVERY_SQL, (mid_id,)),
+        ("download: project zip", PROJECT_DELIVERIES_SQL, (project_id,)),
+        ("download: archived project zip", PROJECT_DELIVERIES_SQL, (archived_id,)),
+        ("transition: award", transitions._TEMPLATE.format(mutation=transitions._AWARD),
+         {"pid": project_id, "uid": client_id, "bid": mid_id}),
+        ("transition: delete", transitions._TEMPLATE.format(mutation=transitions._DELETE),
+         {"pid": project_id, "uid": client_id, "bid": None}),
+        ("project has bids", "SELECT EXISTS (SELECT 1 FROM bids WHERE project_id=%s)", (project_id,)),
+        ("upload: awarded freelancer", """
+            SELECT p.status, b.freelancer_id FROM projects p
+            JOIN bids b ON b.id = p.awarded_bid_id
+            WHERE p.id = %s
+        """, (project_id,)),
+        ("upload: previous deliveries", """
+            SELECT id, filename FROM deliveries
+            WHERE project_id=%s AND freelancer_id=%s
+        """, (project_id, freelancer_id)),
+        ("jobs: legacy file still used", """
+            SELECT filename FROM all_deliveries WHERE storage_key IS NULL AND filename = ANY(%s)
+        """, ([f"plancheck-{project_id}.png"],)),
+        ("jobs: recount blob refs", """
+            SELECT k, count(dl.id) FROM unnest(%s::text[]) AS k
+            LEFT JOIN all_deliveries dl ON dl.storage_key = k GROUP BY k
+        """, (["cas/00/plancheck.png"],)),
+        ("jobs: sweep deliveries", """
+            SELECT id, storage_key, filename FROM all_deliveries WHERE id > %s ORDER BY id LIMIT 500
+        """, (mid_id,)),
+        ("archive: batch", ARCHIVE_SQL, {"days": 180, "batch": 200}),
+        ("login", "SELECT id, username, password_hash, role FROM users WHERE username=%s", (username,)),
+    ]
+    return out
+
+
+def seq_scans(plan):
+    # 走訪整棵計畫樹，回傳用到 Seq Scan 的熱門資料表
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in HOT_TABLES:
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found += seq_scans(child)
+    return found
+
+
+def node_summary(plan):
+    name = plan.get("Node Type", "?")
+    if plan.get("Index Name"):
+        name += f" using {plan['Index Name']}"
+    elif plan.get("Relation Name"):
+        name += f" on {plan['Relation Name']}"
+    return [name] + [n for child in plan.get("Plans", []) for n in node_summary(child)]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="EXPLAIN 常用查詢，發現全表掃描就失敗")
+    ap.add_argument("--projects", type=int, default=20000)
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("-v", "--verbose", action="store_true", help="印出每個查詢用到的計畫節點")
+    args = ap.parse_args()
+
+    failures = 0
+    tag = uuid.uuid4().hex[:12]   # 這次假帳號的名稱前綴
+    with psycopg.connect(CONNINFO) as conn:
+        try:
+            with conn.cursor() as cur:
+                for step in SEED_STEPS:
+                    cur.execute(step, {"users": args.users, "projects": args.projects, "tag": tag,
+                                       "days": 0, "batch": args.projects // 5})
+                cur.execute(PICK_SQL)
+                picks = cur.fetchone()
+
+                for name, sql, params in hot_queries(*picks):
+                    cur.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+                    plan = cur.fetchone()[0][0]["Plan"]
+                    bad = seq_scans(plan)
+                    if bad:
+                        failures += 1
+                        print(f"FAIL  {name}: Seq Scan on {', '.join(sorted(set(bad)))}")
+                    else:
+                        print(f"ok    {name}")
+                    if args.verbose or bad:
+                        print("      " + " -> ".join(node_summary(plan)))
+        finally:
+            conn.rollback()  # 假資料全部丟掉
+
+    print(f"{failures} query plan(s) fell back to a sequential scan" if failures else "all query plans use indexes")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+# previews.py
+# 圖片結案檔案的縮圖（thumb，320px）與網頁預覽（preview，1280px），存成 WebP 放在原檔旁邊。
+# 上傳成功（commit）之後才排進背景行程池處理，上傳的 request 不用等；
+# 做完把 blobs.preview_status 設成 ready / failed，頁面在還沒做好之前顯示「預覽產生中」。
+# Pillow 是選配：沒裝就標成 skipped，頁面只顯示下載連結。不是圖片的在存 blobs 時就標 skipped（storage.add_ref）。
+# 每個 worker 啟動時都會補做上次沒做完的圖片：先把要做的列改成 pending 認領下來（SKIP LOCKED），
+# 同一張圖不會被好幾個 worker 重做；認領後沒做完（worker 被關掉）的，過 CLAIM_TIMEOUT 秒可以再認領。
+import asyncio
+import logging
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import db
+from storage import path_of, is_image, variant_key, IMAGE_SUFFIXES, PREVIEW_VARIANTS
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+log = logging.getLogger(__name__)
+
+PREVIEW_WORKERS = 1            # 縮圖很吃 CPU，開一個行程就好，不跟網頁搶
+PREVIEW_MAX_PENDING = 64       # 排隊上限；超過的先跳過，下次啟動時會補做
+PREVIEW_SIZES = {"thumb": (320, 320), "preview": (1280, 1280)}
+WEBP_QUALITY = 80
+RESUME_LIMIT = 200             # 啟動時最多補做幾張（也不超過排隊上限）
+CLAIM_TIMEOUT = 600            # 認領多久還沒做完，就當那個 worker 不在了
+
+# 認領還沒做的圖片（只看 IMAGE_SUFFIXES，非圖片不會佔名額），最舊的先做
+CLAIM_SQL = """
+    UPDATE blobs SET preview_status = 'pending', preview_claimed_at = now()
+    WHERE storage_key IN (
+        SELECT storage_key FROM blobs
+        WHERE refcount > 0
+          AND lower(substring(storage_key from '\\.[^./]+$')) = ANY(%(suffixes)s)
+          AND (preview_status IS NULL
+               OR (preview_status = 'pending' AND preview_claimed_at < now() - make_interval(secs => %(timeout)s)))
+        ORDER BY created_at
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING storage_key
+"""
+
+_executor = None
+_tasks = set()
+
+
+# ----------------
+# 在子行程裡執行
+# ----------------
+def _render(src, targets):
+    # targets: [(variant, 目的檔路徑)]；先寫暫存檔再換名，不會有人讀到一半的圖
+    with Image.open(src) as im:
+        im.draft("RGB", PREVIEW_SIZES["preview"])  # JPEG 可以直接用較小的解碼尺寸，省很多時間
+        im = ImageOps.exif_transpose(im)           # 依照 EXIF 轉正手機照片
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA" if "transparency" in im.info or "A" in im.getbands() else "RGB")
+        for variant, dest in targets:
+            out = im.copy()
+            out.thumbnail(PREVIEW_SIZES[variant], Image.LANCZOS)
+            tmp = f"{dest}.{uuid.uuid4().hex}.tmp"
+            out.save(tmp, "WEBP", quality=WEBP_QUALITY, method=4)
+            os.replace(tmp, dest)
+    return True
+
+
+# ----------------
+# 排程（在 event loop 裡）
+# ----------------
+async def start_previews():
+    # lifespan 啟動時呼叫；順便把上次沒做完的補排進去
+    global _executor
+    if Image is not None and _executor is None:
+        _executor = ProcessPoolExecutor(PREVIEW_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    limit = min(RESUME_LIMIT, PREVIEW_MAX_PENDING - len(_tasks))
+    async with db.connection() as conn:
+        cur = await conn.execute(CLAIM_SQL, {"suffixes": sorted(IMAGE_SUFFIXES), "timeout": CLAIM_TIMEOUT,
+                                             "limit": limit})
+        keys = [key for (key,) in await cur.fetchall()]
+    for key in keys:
+        schedule(key)
+
+
+async def stop_previews():
+    global _executor
+    for task in list(_tasks):
+        task.cancel()
+    if _tasks:
+        await asyncio.gather(*_tasks, return_exceptions=True)
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+def schedule(storage_key):
+    """上傳 commit 之後呼叫；不是圖片或佇列滿了就直接略過（不會擋住 request）"""
+    if not is_image(storage_key) or len(_tasks) >= PREVIEW_MAX_PENDING:
+        return None
+    task = asyncio.create_task(_generate(storage_key))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+async def _generate(storage_key):
+    src = path_of(storage_key)
+    targets = [(v, str(path_of(variant_key(storage_key, v)))) for v in PREVIEW_VARIANTS]
+    if Image is None:
+        status = "skipped"
+    elif not src.exists():
+        return  # 排隊時就被退件刪掉了，blobs 那筆也已經不在
+    elif all(os.path.exists(dest) for _, dest in targets):
+        status = "ready"  # 同樣內容之前已經做過
+    else:
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(_executor, _render, str(src), targets)
+            status = "ready"
+        except asyncio.CancelledError:
+            raise
+        except FileNotFoundError:
+            return  # 做到一半原檔被刪掉
+        except Exception:
+            log.warning("preview failed for %s", storage_key, exc_info=True)
+            status = "failed"
+
+    async with db.connection() as conn:
+        await conn.execute("UPDATE blobs SET preview_status=%s WHERE storage_key=%s", (status, storage_key))
+
+
+def preview_stats():
+    return {"enabled": Image is not None, "pending": len(_tasks), "max_pending": PREVIEW_MAX_PENDING}
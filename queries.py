@@ -0,0 +1,362 @@
+# queries.py
+# 首頁專案列表查詢：依角色 / 分頁籤選 SQL，統一用 id 做 keyset 分頁
+# 專案頁查詢：load_project_detail 一次查完，回傳 ProjectDetail；案主看的報價一次只拿一頁（可選排序）
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from psycopg.rows import dict_row
+
+from storage import is_image
+
+PAGE_SIZE = 20      # 每頁幾筆
+MAX_PAGE_SIZE = 100
+BID_PAGE_SIZE = 20  # 專案頁一次顯示幾筆報價
+
+# (角色, 分頁) -> 不含排序 / LIMIT 的 SQL；每段都以 WHERE 結尾，方便接 keyset 條件
+LIST_QUERIES = {
+    # 訪客：僅顯示投放中
+    ("guest", "open"): """
+        SELECT p.id, p.version, p.title, p.status, p.created_at,
+               LEFT(p.description, 200) AS description
+        FROM projects p
+        WHERE p.status='open'
+    """,
+
+    # 委託人：投放中（含報價數）
+    ("client", "open"): """
+        SELECT p.id, p.version, p.title, p.status, p.created_at,
+               LEFT(p.description, 200) AS description,
+               COALESCE(s.bid_count, 0) AS bid_count
+        FROM projects p
+        LEFT JOIN project_bid_stats s ON s.project_id = p.id
+        WHERE p.client_id=%(uid)s AND p.status='open'
+    """,
+    # 委託人：進行中（含結案檔案數）
+    ("client", "progress"): """
+        SELECT p.id, p.version, p.title, p.status, p.created_at,
+               LEFT(p.description, 200) AS description,
+               (SELECT COUNT(*) FROM deliveries d WHERE d.project_id=p.id) AS delivery_count
+        FROM projects p
+        WHERE p.client_id=%(uid)s AND p.status IN ('in_progress','reopened')
+    """,
+    # 委託人：已結案（含已搬到 archive 的；外層的 p.id 條件 / 排序會推進兩邊，各走自己的索引）
+    ("client", "closed"): """
+        SELECT * FROM (
+            SELECT p.id, p.version, p.title, p.status, p.created_at,
+                   LEFT(p.description, 200) AS description
+            FROM projects p
+            WHERE p.client_id=%(uid)s AND p.status='closed'
+            UNION ALL
+            SELECT p.id, p.version, p.title, p.status, p.created_at,
+                   LEFT(p.description, 200) AS description
+            FROM projects_archive p
+            WHERE p.client_id=%(uid)s
+        ) p
+        WHERE TRUE
+    """,
+
+    # 接案人：可接案（標記自己是否已報價）
+    ("freelancer", "open"): """
+        SELECT p.id, p.version, p.title, p.status, p.created_at,
+               LEFT(p.description, 200) AS description,
+               EXISTS (SELECT 1 FROM bids b
+                       WHERE b.project_id=p.id AND b.freelancer_id=%(uid)s) AS has_bid
+        FROM projects p
+        WHERE p.status='open'
+    """,
+    # 接案人：進行中（含自己上傳的檔案數）
+    ("freelancer", "progress"): """
+        SELECT p.id, p.version, p.title, p.status, p.created_at,
+               LEFT(p.description, 200) AS description,
+               (SELECT COUNT(*) FROM deliveries d
+                WHERE d.project_id=p.id AND d.freelancer_id=%(uid)s) AS my_delivery_count
+        FROM projects p
+        JOIN bids b ON b.id = p.awarded_bid_id
+        WHERE b.freelancer_id=%(uid)s AND p.status IN ('in_progress','reopened')
+    """,
+    # 接案人：歷史紀錄（同上，含 archive）
+    ("freelancer", "closed"): """
+        SELECT * FROM (
+            SELECT p.id, p.version, p.title, p.status, p.created_at,
+                   LEFT(p.description, 200) AS description
+            FROM projects p
+            JOIN bids b ON b.id = p.awarded_bid_id
+            WHERE b.freelancer_id=%(uid)s AND p.status='closed'
+            UNION ALL
+            SELECT p.id, p.version, p.title, p.status, p.created_at,
+                   LEFT(p.description, 200) AS description
+            FROM projects_archive p
+            JOIN bids_archive b ON b.id = p.awarded_bid_id
+            WHERE b.freelancer_id=%(uid)s
+        ) p
+        WHERE TRUE
+    """,
+}
+
+
+def list_key(user, tab):
+    # 沒登入一律看投放中；不認得的分頁沿用舊行為當成「已結案」
+    if not user:
+        return ("guest", "open")
+    if tab not in ("open", "progress"):
+        tab = "closed"
+    return (user["role"], tab)
+
+
+def parse_cursor(request):
+    # 讀 ?cursor=<id>&dir=next|prev；格式不對就當第一頁
+    try:
+        cursor = int(request.query_params.get("cursor", ""))
+    except ValueError:
+        return None, "next"
+    direction = request.query_params.get("dir", "next")
+    return cursor, ("prev" if direction == "prev" else "next")
+
+
+def list_sql(key, with_cursor=False, direction="next"):
+    # 組出完整 SQL：基本查詢 + keyset 條件 + 排序 / LIMIT（參數：uid, cursor, limit）
+    sql = LIST_QUERIES[key]
+    if with_cursor:
+        sql += " AND p.id < %(cursor)s" if direction == "next" else " AND p.id > %(cursor)s"
+    sql += " ORDER BY p.id DESC LIMIT %(limit)s" if direction == "next" else " ORDER BY p.id ASC LIMIT %(limit)s"
+    return sql
+
+
+async def list_projects(conn, user, tab, cursor=None, direction="next", limit=PAGE_SIZE):
+    """
+    依 id DESC 取一頁專案。
+    回傳 (projects, next_cursor, prev_cursor)；沒有下一頁 / 上一頁時為 None。
+    """
+    key = list_key(user, tab)
+    if key not in LIST_QUERIES:
+        return [], None, None
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    sql = list_sql(key, cursor is not None, direction)
+    params = {"uid": user["id"] if user else None, "cursor": cursor, "limit": limit + 1}  # 多拿一筆判斷還有沒有下一頁
+
+    async with conn.cursor(row_factory=dict_row) as cur:
+        await cur.execute(sql, params)
+        rows = await cur.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if direction == "prev":
+        rows.reverse()  # 往回翻是用 ASC 撈的，翻回 DESC
+        if not rows:    # 已經翻過頭：回到第一頁
+            return await list_projects(conn, user, tab, None, "next", limit)
+        prev_cursor = rows[0]["id"] if has_more else None
+        next_cursor = rows[-1]["id"]
+    else:
+        next_cursor = rows[-1]["id"] if has_more else None
+        prev_cursor = rows[0]["id"] if (cursor is not None and rows) else None
+
+    return rows, next_cursor, prev_cursor
+
+
+# --------------------------------
+# 專案頁：專案 + 看得到的報價 + 結案檔案，一個查詢（一次來回）拿完
+# --------------------------------
+@dataclass(slots=True)
+class BidView:
+    id: int
+    price: int
+    message: Optional[str]
+    created_at: datetime
+    freelancer: str
+
+
+@dataclass(slots=True)
+class DeliveryView:
+    id: int
+    filename: str
+    storage_key: Optional[str]
+    note: Optional[str]
+    created_at: datetime
+    freelancer: str
+    preview_status: Optional[str] = None   # 圖片縮圖：None / pending = 產生中，ready / failed / skipped
+
+    @property
+    def is_image(self):
+        return is_image(self.storage_key)
+
+
+@dataclass(slots=True)
+class ProjectView:
+    id: int
+    title: str
+    description: Optional[str]
+    status: str
+    created_at: datetime
+    budget: Optional[int]
+    client_name: str
+    client_id: int
+    awarded_bid_id: Optional[int]
+    awarded_freelancer_id: Optional[int]
+
+
+@dataclass(slots=True)
+class BidSummary:
+    bid_count: int = 0
+    min_price: Optional[int] = None
+    max_price: Optional[int] = None
+    median_price: Optional[int] = None
+    last_bid_at: Optional[datetime] = None
+
+
+@dataclass(slots=True)
+class ProjectDetail:
+    project: ProjectView
+    bids: list          # [BidView]；案主看一頁（依 bid_sort），接案人只看自己的，訪客看不到
+    deliveries: list    # [DeliveryView]，新到舊
+    bid_summary: Optional[BidSummary] = None   # 只有案主有（project_bid_stats）
+    awarded_bid: Optional[BidView] = None      # 案主看得到的得標報價（不管在第幾頁）
+    bid_sort: str = "price"
+    bid_next_cursor: Optional[str] = None      # 還有下一頁報價時的游標
+
+
+# 報價排序：名稱 -> (ORDER BY, 下一頁的 keyset 條件)；同價格用 id 決定先後
+BID_SORTS = {
+    "price": ("b.price, b.id", "(b.price, b.id) > (%(bid_price)s, %(bid_id)s)"),
+    "price_desc": ("b.price DESC, b.id DESC", "(b.price, b.id) < (%(bid_price)s, %(bid_id)s)"),
+    "newest": ("b.id DESC", "b.id < %(bid_id)s"),
+    "oldest": ("b.id", "b.id > %(bid_id)s"),
+}
+
+
+def parse_bid_cursor(sort, raw):
+    """
+    報價游標：價格排序是 "<price>_<id>"，時間排序是 "<id>"。
+    回傳查詢參數 {"bid_price", "bid_id"}；格式不對就當第一頁（None）。
+    """
+    try:
+        if sort in ("price", "price_desc"):
+            price, bid_id = raw.split("_")
+            return {"bid_price": int(price), "bid_id": int(bid_id)}
+        return {"bid_price": None, "bid_id": int(raw)}
+    except (AttributeError, ValueError):
+        return None
+
+
+def bid_cursor_of(sort, bid):
+    return f"{bid.price}_{bid.id}" if sort in ("price", "price_desc") else str(bid.id)
+
+
+# 報價是否看得到由查詢參數決定：viewer_role / viewer_id（訪客兩個都是 NULL）
+# {bid_after} / {bid_order} 由 detail_sql 依排序填入；表名 {projects} / {bids} / ... 由 archived 決定
+DETAIL_SQL_TEMPLATE = """
+    SELECT p.id, p.title, p.description, p.status, p.created_at, p.budget,
+           u.username AS client_name, u.id AS client_id, p.awarded_bid_id,
+           ab.freelancer_id AS awarded_freelancer_id,
+           s.bid_count, s.min_price, s.max_price, s.median_price, s.last_bid_at,
+           CASE WHEN %(viewer_role)s = 'client' AND p.client_id = %(viewer_id)s AND ab.id IS NOT NULL THEN
+               json_build_object('id', ab.id, 'price', ab.price, 'message', ab.message,
+                                 'created_at', ab.created_at, 'freelancer', au.username)
+           END AS awarded_bid,
+           COALESCE((
+               SELECT json_agg(x)
+               FROM (
+                   SELECT b.id, b.price, b.message, b.created_at, fu.username AS freelancer
+                   FROM {bids} b
+                   JOIN users fu ON fu.id = b.freelancer_id
+                   WHERE b.project_id = p.id
+                     AND ((%(viewer_role)s = 'client' AND p.client_id = %(viewer_id)s)
+                          OR (%(viewer_role)s = 'freelancer' AND b.freelancer_id = %(viewer_id)s))
+                     {bid_after}
+                   ORDER BY {bid_order}
+                   LIMIT %(bid_limit)s
+               ) x
+           ), '[]') AS bids,
+           COALESCE((
+               SELECT json_agg(json_build_object(
+                          'id', d.id, 'filename', d.filename, 'storage_key', d.storage_key, 'note', d.note,
+                          'created_at', d.created_at, 'freelancer', du.username,
+                          'preview_status', bl.preview_status)
+                      ORDER BY d.created_at DESC)
+               FROM {deliveries} d
+               JOIN users du ON du.id = d.freelancer_id
+               LEFT JOIN blobs bl ON bl.storage_key = d.storage_key
+               WHERE d.project_id = p.id
+           ), '[]') AS deliveries
+    FROM {projects} p
+    JOIN users u ON u.id = p.client_id
+    LEFT JOIN {bids} ab ON ab.id = p.awarded_bid_id
+    LEFT JOIN users au ON au.id = ab.freelancer_id
+    LEFT JOIN {bid_stats} s ON s.project_id = p.id
+    WHERE p.id = %(project_id)s
+"""
+
+
+# 已搬到 archive 的專案（archive.py）：同一個查詢改讀 *_archive 表
+LIVE_TABLES = {"projects": "projects", "bids": "bids", "deliveries": "deliveries",
+               "bid_stats": "project_bid_stats"}
+ARCHIVE_TABLES = {"projects": "projects_archive", "bids": "bids_archive", "deliveries": "deliveries_archive",
+                  "bid_stats": "project_bid_stats_archive"}
+
+
+def detail_sql(bid_sort="price", with_cursor=False, archived=False):
+    order, after = BID_SORTS[bid_sort]
+    return DETAIL_SQL_TEMPLATE.format(bid_order=order, bid_after=f"AND {after}" if with_cursor else "",
+                                      **(ARCHIVE_TABLES if archived else LIVE_TABLES))
+
+
+DETAIL_SQL = detail_sql()  # 第一頁、價格低到高
+
+
+def detail_params(project_id, user, cursor=None, bid_limit=BID_PAGE_SIZE):
+    return {
+        "project_id": project_id,
+        "viewer_role": user["role"] if user else None,
+        "viewer_id": user["id"] if user else None,
+        "bid_limit": bid_limit + 1,  # 多拿一筆判斷還有沒有下一頁
+        **(cursor or {"bid_price": None, "bid_id": None}),
+    }
+
+
+def _ts(value):
+    # json 裡的時間是 ISO 字串，轉回 datetime（模板顯示和原本一樣）
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _bid(b):
+    return BidView(b["id"], b["price"], b["message"], _ts(b["created_at"]), b["freelancer"])
+
+
+async def load_project_detail(conn, project_id, user, bid_sort="price", bid_cursor=None, bid_limit=BID_PAGE_SIZE):
+    """
+    專案頁要的資料，回傳 ProjectDetail；專案不存在回傳 None（已搬到 archive 的也查得到）。
+    報價一次只拿 bid_limit 筆（bid_sort 見 BID_SORTS，bid_cursor 是上一頁給的 bid_next_cursor）。
+    """
+    if bid_sort not in BID_SORTS:
+        bid_sort = "price"
+    bid_limit = max(1, min(bid_limit, MAX_PAGE_SIZE))
+    cursor = parse_bid_cursor(bid_sort, bid_cursor) if bid_cursor else None
+    params = detail_params(project_id, user, cursor, bid_limit)
+    async with conn.cursor(row_factory=dict_row) as cur:
+        await cur.execute(detail_sql(bid_sort, cursor is not None), params)
+        row = await cur.fetchone()
+        if not row:  # 不在線上的表：可能已經搬到 archive
+            await cur.execute(detail_sql(bid_sort, cursor is not None, archived=True), params)
+            row = await cur.fetchone()
+    if not row:
+        return None
+
+    bids = [_bid(b) for b in row.pop("bids")]
+    next_cursor = bid_cursor_of(bid_sort, bids[bid_limit - 1]) if len(bids) > bid_limit else None
+    bids = bids[:bid_limit]
+    awarded = row.pop("awarded_bid")
+    summary = BidSummary(*(row.pop(k) for k in ("bid_count", "min_price", "max_price",
+                                                 "median_price", "last_bid_at")))
+    is_owner = bool(user) and user["role"] == "client" and user["id"] == row["client_id"]
+    if summary.bid_count is None:
+        summary = BidSummary()  # 還沒有報價
+    deliveries = [DeliveryView(d["id"], d["filename"], d["storage_key"], d["note"], _ts(d["created_at"]),
+                               d["freelancer"], d["preview_status"])
+                  for d in row.pop("deliveries")]
+    row["status"] = (row["status"] or "").strip().lower()  # 正規化狀態（避免 CHAR 尾巴空白 / 大小寫）
+    return ProjectDetail(ProjectView(**row), bids, deliveries,
+                         bid_summary=summary if is_owner else None,
+                         awarded_bid=_bid(awarded) if awarded else None,
+                         bid_sort=bid_sort, bid_next_cursor=next_cursor)
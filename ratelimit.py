@@ -0,0 +1,173 @@
+# ratelimit.py
+# 限流與卸載：登入、註冊、報價、上傳結案檔案這些會寫資料庫 / 吃 CPU（bcrypt）的路由，
+# 依「登入者 id」和「來源 IP」各一個 token bucket，額度用完回 429 + Retry-After。
+# 另外每個 worker 同時處理的請求超過 MAX_IN_FLIGHT 就直接回 503（卸載），不要讓排隊拖慢所有人。
+#   RATE_LIMIT_BACKEND=memory     每個 worker 各算各的（預設）
+#   RATE_LIMIT_BACKEND=postgres   額度存在資料庫 rate_limits 表（migration 0009 / 0011），所有 worker / 機器共用
+#   RATE_LIMIT=off                關掉額度限制（bench.py 壓測、本機測試會從同一個 IP 登入大量帳號）
+#   MAX_IN_FLIGHT=200             每個 worker 同時處理幾個請求（0 = 不限）
+# 來源 IP 用 ASGI 的 client；前面有 nginx 的話 uvicorn 要加 --proxy-headers 才會是真的使用者 IP。
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import psycopg
+from psycopg_pool import PoolTimeout
+from starlette.responses import JSONResponse, PlainTextResponse
+
+import db
+from metrics import route_template
+
+log = logging.getLogger("ratelimit")
+
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT", "on") != "off"
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT") or 200)
+MEMORY_MAX_KEYS = 10000     # 記憶體裡最多記幾個桶子（太久沒用的先丟，丟掉 = 額度變滿）
+SHED_RETRY_AFTER = 1        # 卸載時叫人幾秒後再試
+BACKEND_POOL_TIMEOUT = 0.2  # postgres 額度：連線池滿了最多等幾秒，等不到就先用本機的額度
+
+# 不算在同時處理數裡的路徑：健康檢查、指標、靜態檔、長時間開著的 SSE
+SHED_EXEMPT = ("/healthz", "/metrics", "/static/", "/www/", "/events")
+
+
+@dataclass(frozen=True)
+class Limit:
+    scope: str          # "user"：登入者 id（沒登入就用 IP）；"ip"：來源 IP
+    per_minute: float   # 平均每分鐘幾次
+    burst: int          # 一次最多連續幾次
+
+    @property
+    def rate(self):
+        return self.per_minute / 60.0
+
+
+# (方法, 路由樣板) -> 要通過的限制（全部都要有額度）
+LIMITS = {
+    ("POST", "/login"): (Limit("ip", 10, 10),),
+    ("POST", "/register"): (Limit("ip", 5 / 60, 5),),    # 每小時 5 個帳號
+    ("POST", "/bids/{project_id}"): (Limit("user", 30, 10), Limit("ip", 120, 30)),
+    ("POST", "/deliveries/{project_id}"): (Limit("user", 20, 5), Limit("ip", 60, 20)),
+}
+
+_stats = {"allowed": 0, "limited": 0, "shed": 0, "backend_errors": 0, "in_flight": 0}
+
+
+# ----------------
+# 額度存放
+# ----------------
+class MemoryBackend:
+    def __init__(self, max_keys=MEMORY_MAX_KEYS):
+        self.buckets = OrderedDict()   # key -> (tokens, 更新時間)
+        self.max_keys = max_keys
+
+    async def take(self, buckets, cost=1.0):
+        """buckets：[(key, Limit)]。每個桶子都拿得到才一起扣、回傳 0；否則都不扣，回傳還要等幾秒"""
+        now = time.monotonic()
+        refilled = []
+        for key, limit in buckets:
+            tokens, last = self.buckets.pop(key, (limit.burst, now))
+            refilled.append((key, limit, min(limit.burst, tokens + (now - last) * limit.rate)))
+        wait = max((cost - tokens) / limit.rate if tokens < cost else 0.0 for _, limit, tokens in refilled)
+        for key, limit, tokens in refilled:
+            self.buckets[key] = (tokens - cost if not wait else tokens, now)   # 放到最後（最近用過）
+        while len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return wait
+
+
+class PostgresBackend:
+    # migration 0011：一次查完所有桶子
+    TAKE_SQL = "SELECT rate_limit_take_all(%s::text[], %s, %s, %s)"
+
+    def __init__(self):
+        self.fallback = MemoryBackend()
+
+    async def take(self, buckets, cost=1.0):
+        keys = [key for key, _ in buckets]
+        rates = [limit.rate for _, limit in buckets]
+        bursts = [float(limit.burst) for _, limit in buckets]
+        try:
+            async with db.connection(timeout=BACKEND_POOL_TIMEOUT) as conn:
+                cur = await conn.execute(self.TAKE_SQL, (keys, rates, bursts, cost))
+                return (await cur.fetchone())[0]
+        except (PoolTimeout, psycopg.Error) as exc:
+            # 資料庫有狀況時改用本機的額度，不要因為限流把所有人擋在外面
+            _stats["backend_errors"] += 1
+            log.warning("rate limit backend failed (%s), using in-memory buckets", exc)
+            return await self.fallback.take(buckets, cost)
+
+
+backend = PostgresBackend() if RATE_LIMIT_BACKEND == "postgres" else MemoryBackend()
+
+
+# ----------------
+# middleware
+# ----------------
+def client_ip(scope):
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def bucket_key(scope, route, limit):
+    user = (scope.get("session") or {}).get("user")
+    if limit.scope == "user":   # 沒登入用 IP，但跟 "ip" 的桶子分開
+        who = f"user:{user['id']}" if user else f"anon:{client_ip(scope)}"
+    else:
+        who = f"ip:{client_ip(scope)}"
+    return f"{scope['method']} {route} {who}"
+
+
+def _reject(scope, status, message, retry_after):
+    headers = {"Retry-After": str(retry_after)}
+    if scope["path"].startswith("/api/"):
+        return JSONResponse({"detail": message}, status_code=status, headers=headers)
+    return PlainTextResponse(message, status_code=status, headers=headers)
+
+
+class RateLimitMiddleware:
+    """要加在 SessionMiddleware 裡面一層（才拿得到登入者），MetricsMiddleware 外面也看得到 429 / 503"""
+
+    def __init__(self, app, router_app=None):
+        self.app = app
+        self.router_app = router_app  # 用來比對路由樣板的 FastAPI app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        # 先看忙不忙（不用查額度），再看這個人 / IP 的額度
+        exempt = scope["path"].startswith(SHED_EXEMPT)
+        if not exempt and MAX_IN_FLIGHT and _stats["in_flight"] >= MAX_IN_FLIGHT:
+            _stats["shed"] += 1
+            response = _reject(scope, 503, "伺服器忙碌中，請稍後再試。", SHED_RETRY_AFTER)
+            return await response(scope, receive, send)
+
+        limits = ()
+        if RATE_LIMIT_ENABLED and scope["method"] not in ("GET", "HEAD", "OPTIONS"):
+            route = route_template(self.router_app, scope)
+            limits = LIMITS.get((scope["method"], route), ())
+        if limits:
+            # 全部的桶子一起看：有一個沒額度就都不扣（不然被擋下來的請求也會吃掉別的桶子的額度）
+            wait = await backend.take([(bucket_key(scope, route, limit), limit) for limit in limits])
+            if wait > 0:
+                _stats["limited"] += 1
+                seconds = max(1, math.ceil(wait))
+                response = _reject(scope, 429, f"請求太頻繁，請 {seconds} 秒後再試。", seconds)
+                return await response(scope, receive, send)
+            _stats["allowed"] += 1
+
+        if exempt:
+            return await self.app(scope, receive, send)
+        _stats["in_flight"] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _stats["in_flight"] -= 1
+
+
+def rate_limit_stats():
+    return dict(_stats, enabled=int(RATE_LIMIT_ENABLED), backend=RATE_LIMIT_BACKEND, max_in_flight=MAX_IN_FLIGHT)
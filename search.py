@@ -0,0 +1,99 @@
+# search.py
+# 專案搜尋：標題 + 描述全文檢索（projects.search_vector，GIN 索引，見 migrations/0004），
+# 可再用狀態、預算篩選；有關鍵字時依相關度排序，沒有就新到舊。
+# 分頁一樣用游標：上一頁最後一筆的 (相關度, id)，不用 OFFSET。
+# 已結案 / 全部也會搜到已搬到 archive 的專案（all_projects，見 migrations/0010）。
+from psycopg.rows import dict_row
+
+SEARCH_PAGE_SIZE = 20
+MAX_QUERY_LENGTH = 100
+
+# 狀態篩選 -> 對應的 projects.status
+STATUS_FILTERS = {
+    "open": ("open",),
+    "progress": ("in_progress", "reopened"),
+    "closed": ("closed",),
+    "all": None,
+}
+
+
+def _int_or_none(value):
+    try:
+        return int(value) if value not in (None, "") else None
+    except ValueError:
+        return None
+
+
+def parse_cursor(value):
+    # 游標格式 "<rank>_<id>"；格式不對就當作第一頁
+    try:
+        rank, pid = (value or "").split("_")
+        return float(rank), int(pid)
+    except ValueError:
+        return None
+
+
+def make_cursor(row):
+    return f"{row['rank']!r}_{row['id']}"
+
+
+def parse_search(request):
+    """從網址參數取出搜尋條件：q / status / min_budget / max_budget / cursor"""
+    qp = request.query_params
+    status = qp.get("status", "open")
+    return {
+        "q": " ".join(qp.get("q", "").split())[:MAX_QUERY_LENGTH],
+        "status": status if status in STATUS_FILTERS else "open",
+        "min_budget": _int_or_none(qp.get("min_budget")),
+        "max_budget": _int_or_none(qp.get("max_budget")),
+        "cursor": parse_cursor(qp.get("cursor")),
+    }
+
+
+def search_sql(f, limit=SEARCH_PAGE_SIZE):
+    """依搜尋條件組 SQL（只加有用到的條件，讓 planner 看得到實際要走哪個索引）"""
+    params = {"q": f["q"], "limit": limit + 1}
+    where = []
+    if f["q"]:
+        rank = "ts_rank_cd(p.search_vector, search_query(%(q)s))"
+        where.append("p.search_vector @@ search_query(%(q)s)")
+    else:
+        rank = "0::real"
+    statuses = STATUS_FILTERS[f["status"]]
+    if statuses:
+        where.append("p.status = ANY(%(statuses)s)")
+        params["statuses"] = list(statuses)
+    if f["min_budget"] is not None:
+        where.append("p.budget >= %(min_budget)s")
+        params["min_budget"] = f["min_budget"]
+    if f["max_budget"] is not None:
+        where.append("p.budget <= %(max_budget)s")
+        params["max_budget"] = f["max_budget"]
+
+    # archive 裡只有已結案：只找投放中 / 進行中就不用碰
+    table = "projects" if statuses and "closed" not in statuses else "all_projects"
+
+    sql = f"""
+        SELECT * FROM (
+            SELECT p.id, p.title, p.status, p.created_at, p.budget,
+                   LEFT(p.description, 200) AS description,
+                   {rank} AS rank
+            FROM {table} p
+            WHERE {" AND ".join(where) or "TRUE"}
+        ) s
+    """
+    if f["cursor"]:
+        sql += " WHERE (s.rank, s.id) < (%(cursor_rank)s, %(cursor_id)s)"
+        params["cursor_rank"], params["cursor_id"] = f["cursor"]
+    sql += " ORDER BY s.rank DESC, s.id DESC LIMIT %(limit)s"
+    return sql, params
+
+
+async def search_projects(conn, f, limit=SEARCH_PAGE_SIZE):
+    """回傳 (rows, next_cursor)；多抓一筆判斷還有沒有下一頁"""
+    sql, params = search_sql(f, limit)
+    async with conn.cursor(row_factory=dict_row) as cur:
+        await cur.execute(sql, params)
+        rows = await cur.fetchall()
+    next_cursor = make_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
@@ -0,0 +1,270 @@
+# seed.py
+# 壓力測試用的假資料：依參數產生大量使用者 / 專案 / 報價 / 結案檔案（帳號都是 bench_ 開頭，可以整批清掉）。
+# 同樣的 --seed 產生同樣的資料（PostgreSQL 的 setseed + random()），不同 commit 之間的 bench.py 結果才比得起來。
+#   python seed.py                                    # 預設：2 萬使用者、10 萬專案、100 萬報價
+#   python seed.py --projects 20000 --bids 200000     # 小一點
+#   python seed.py --reset                            # 先清掉上一次的 bench_ 資料再產生
+#   python seed.py --reset --only-reset               # 只清資料
+# 所有 bench_ 帳號的密碼都是 BENCH_PASSWORD。
+import argparse
+import hashlib
+import random
+import sys
+import time
+
+from db import get_conn
+from passwords import _hash
+from storage import make_key, path_of
+
+BENCH_PASSWORD = "bench-pass"
+BENCH_PREFIX = "bench\\_%"   # LIKE 用
+
+CATEGORIES = ["網站開發", "App 開發", "平面設計", "影片剪輯", "翻譯", "文案撰寫", "資料分析", "活動企劃",
+              "攝影", "程式教學", "市場調查", "3D 建模"]
+TASKS = ["協助製作", "急徵", "長期合作", "小型專案", "需要有經驗者", "學生可", "遠端", "週末完成",
+         "可議價", "附作品集"]
+PARAGRAPHS = [
+    "需求說明：請依照附件規格完成，過程中需要定期回報進度，完成後提供原始檔。",
+    "工作內容包含前期訪談、提案、修改兩次，預計兩週內完成，預算可依經驗調整。",
+    "希望找有相關經驗的夥伴，請在報價時附上過去作品或簡單說明做法。",
+    "可以遠端進行，溝通以訊息為主；若需要開會可另外約時間。",
+    "交件格式：PDF 與原始檔各一份，檔名請標明版本與日期。",
+]
+MESSAGES = ["可協助，附上作品集連結。", "有相關經驗三年，可以配合時程。", "價格可再討論，想先了解細節。",
+            "學生接案，認真負責。", "之前做過類似的專案，可以提供參考。"]
+
+
+def _arr(items):
+    return "ARRAY[" + ", ".join("'" + s.replace("'", "''") + "'" for s in items) + "]"
+
+
+# 每一步都先在子查詢裡對 generate_series 依序取亂數（順序固定 → 結果可重現），再 JOIN 對應的 id
+STEPS = [
+    ("users", """
+        INSERT INTO users (username, password_hash, role, full_name, agreed_privacy)
+        SELECT 'bench_' || r.prefix || g, %(password_hash)s, r.role, 'Bench ' || r.prefix || g, true
+        FROM (VALUES ('c', 'client', %(clients)s), ('f', 'freelancer', %(freelancers)s)) r(prefix, role, n)
+        CROSS JOIN LATERAL generate_series(1, r.n) g
+        ORDER BY r.prefix, g
+    """),
+    ("client map", """
+        CREATE TEMP TABLE bench_clients ON COMMIT DROP AS
+            SELECT row_number() OVER (ORDER BY id) AS rn, id FROM users
+            WHERE username LIKE 'bench\\_c%%' AND role = 'client'
+    """),
+    ("freelancer map", """
+        CREATE TEMP TABLE bench_freelancers ON COMMIT DROP AS
+            SELECT row_number() OVER (ORDER BY id) AS rn, id FROM users
+            WHERE username LIKE 'bench\\_f%%' AND role = 'freelancer'
+    """),
+    ("projects", f"""
+        INSERT INTO projects (title, description, status, client_id, budget, created_at)
+        SELECT x.title, x.description, x.status, c.id, x.budget, x.created_at
+        FROM (
+            SELECT g,
+                   ({_arr(CATEGORIES)})[1 + floor(random() * {len(CATEGORIES)})::int] || '：'
+                   || ({_arr(TASKS)})[1 + floor(random() * {len(TASKS)})::int] || ' #' || g AS title,
+                   array_to_string(({_arr(PARAGRAPHS)})[1:1 + floor(random() * {len(PARAGRAPHS)})::int], E'\\n') AS description,
+                   (ARRAY['open', 'in_progress', 'reopened', 'closed'])[
+                       CASE WHEN r < 0.4 THEN 1 WHEN r < 0.65 THEN 2 WHEN r < 0.7 THEN 3 ELSE 4 END] AS status,
+                   1 + floor(random() * %(clients)s)::int AS crn,
+                   (2 + floor(random() * 200)::int) * 500 AS budget,
+                   now() - (%(projects)s - g) * interval '10 minutes' * 105120 / %(projects)s AS created_at
+            FROM (SELECT g, random() AS r FROM generate_series(1, %(projects)s) g) s
+        ) x
+        JOIN bench_clients c ON c.rn = x.crn
+        ORDER BY x.g
+    """),
+    ("project map", """
+        CREATE TEMP TABLE bench_projects ON COMMIT DROP AS
+            SELECT row_number() OVER (ORDER BY p.id) AS rn, p.id, p.created_at FROM projects p
+            JOIN bench_clients c ON c.id = p.client_id
+    """),
+    # 熱門專案報價比較多（power 讓亂數偏向前面）；同一人對同一案只能報一次，重複的略過
+    ("bids", f"""
+        INSERT INTO bids (project_id, freelancer_id, price, message, created_at)
+        SELECT p.id, f.id, x.price, x.message, p.created_at + x.after
+        FROM (
+            SELECT g,
+                   1 + floor(power(random(), 2) * %(projects)s)::int AS prn,
+                   1 + floor(random() * %(freelancers)s)::int AS frn,
+                   (1 + floor(random() * 400)::int) * 250 AS price,
+                   ({_arr(MESSAGES)})[1 + floor(random() * {len(MESSAGES)})::int] AS message,
+                   random() * interval '72 hours' AS after
+            FROM generate_series(1, %(bids)s) g
+        ) x
+        JOIN bench_projects p ON p.rn = x.prn
+        JOIN bench_freelancers f ON f.rn = x.frn
+        ORDER BY x.g
+        ON CONFLICT (project_id, freelancer_id) DO NOTHING
+    """),
+    # 不是投放中的專案：最早的報價得標；沒有人報價的改回投放中
+    ("awards", """
+        UPDATE projects p SET awarded_bid_id = first_bid.id
+        FROM (SELECT b.project_id, min(b.id) AS id FROM bids b
+              JOIN bench_projects bp ON bp.id = b.project_id GROUP BY b.project_id) first_bid
+        WHERE p.id = first_bid.project_id AND p.status <> 'open'
+    """),
+    ("unawarded", """
+        UPDATE projects p SET status = 'open'
+        FROM bench_projects bp
+        WHERE p.id = bp.id AND p.status <> 'open' AND p.awarded_bid_id IS NULL
+    """),
+    # 已結案的都有結案檔案，進行中的六成有
+    ("deliveries", """
+        INSERT INTO deliveries (project_id, freelancer_id, filename, note, storage_key, created_at)
+        SELECT x.id, x.freelancer_id, 'delivery-' || x.id || x.suffix, '請查收', x.storage_key, x.created_at
+        FROM (
+            SELECT p.id, b.freelancer_id, p.status, (p.id * 7919) %% 10 AS r,
+                   k.storage_key, k.suffix, b.created_at + interval '3 days' AS created_at
+            FROM bench_projects bp
+            JOIN projects p ON p.id = bp.id
+            JOIN bids b ON b.id = p.awarded_bid_id
+            JOIN LATERAL (SELECT storage_key, suffix FROM bench_blobs
+                          WHERE n = p.id %% %(blob_count)s) k ON true
+            WHERE p.status IN ('in_progress', 'closed')
+            ORDER BY p.id
+        ) x
+        WHERE x.status = 'closed' OR x.r < 6
+        ORDER BY x.id
+    """),
+    # 結案時間：最後一個結案檔案的兩天後（archive.py 依這個決定搬不搬）
+    ("closed_at", """
+        UPDATE projects p SET closed_at = d.last_at + interval '2 days'
+        FROM (SELECT d.project_id, max(d.created_at) AS last_at FROM deliveries d
+              JOIN bench_projects bp ON bp.id = d.project_id GROUP BY d.project_id) d
+        WHERE p.id = d.project_id AND p.status = 'closed'
+    """),
+    ("blob refcounts", """
+        UPDATE blobs b SET refcount = d.n
+        FROM (SELECT storage_key, count(*) AS n FROM deliveries
+              WHERE storage_key IN (SELECT storage_key FROM bench_blobs) GROUP BY storage_key) d
+        WHERE b.storage_key = d.storage_key
+    """),
+]
+
+RESET_STEPS = [
+    "CREATE TEMP TABLE reset_users ON COMMIT DROP AS SELECT id FROM users WHERE username LIKE %(prefix)s",
+    """CREATE TEMP TABLE reset_projects ON COMMIT DROP AS
+        SELECT id FROM all_projects WHERE client_id IN (SELECT id FROM reset_users)""",
+    """CREATE TEMP TABLE reset_keys ON COMMIT DROP AS
+        SELECT DISTINCT storage_key FROM all_deliveries
+        WHERE storage_key IS NOT NULL
+          AND (project_id IN (SELECT id FROM reset_projects) OR freelancer_id IN (SELECT id FROM reset_users))""",
+    """DELETE FROM deliveries
+        WHERE project_id IN (SELECT id FROM reset_projects) OR freelancer_id IN (SELECT id FROM reset_users)""",
+    """UPDATE projects SET awarded_bid_id = NULL
+        WHERE awarded_bid_id IN (SELECT id FROM bids WHERE freelancer_id IN (SELECT id FROM reset_users))
+           OR id IN (SELECT id FROM reset_projects)""",
+    """DELETE FROM bids
+        WHERE project_id IN (SELECT id FROM reset_projects) OR freelancer_id IN (SELECT id FROM reset_users)""",
+    "DELETE FROM projects WHERE id IN (SELECT id FROM reset_projects)",
+    # 已經搬到 archive 的（archive.py）也一樣清
+    """DELETE FROM deliveries_archive
+        WHERE project_id IN (SELECT id FROM reset_projects) OR freelancer_id IN (SELECT id FROM reset_users)""",
+    """UPDATE projects_archive SET awarded_bid_id = NULL
+        WHERE awarded_bid_id IN (SELECT id FROM bids_archive WHERE freelancer_id IN (SELECT id FROM reset_users))
+           OR id IN (SELECT id FROM reset_projects)""",
+    """DELETE FROM bids_archive
+        WHERE project_id IN (SELECT id FROM reset_projects) OR freelancer_id IN (SELECT id FROM reset_users)""",
+    # archive 沒有計數 trigger：全站的已結案數自己扣
+    """SELECT bump_project_counter('global', 0, 'closed',
+        -(SELECT count(*) FROM projects_archive WHERE id IN (SELECT id FROM reset_projects))::int)""",
+    "DELETE FROM projects_archive WHERE id IN (SELECT id FROM reset_projects)",
+    "DELETE FROM project_counters WHERE user_id IN (SELECT id FROM reset_users) AND scope <> 'global'",
+    "DELETE FROM users WHERE id IN (SELECT id FROM reset_users)",
+    # 檔案本身留給 jobs.py 的孤兒清理
+    """UPDATE blobs b SET refcount = (SELECT count(*) FROM all_deliveries d WHERE d.storage_key = b.storage_key)
+        WHERE b.storage_key IN (SELECT storage_key FROM reset_keys)""",
+    "DELETE FROM blobs WHERE refcount <= 0 AND storage_key IN (SELECT storage_key FROM reset_keys)",
+]
+
+
+def write_blobs(cur, count, size, seed):
+    # 幾個真的檔案給結案檔案共用（下載 / zip 才測得到）；內容由 seed 決定
+    rng = random.Random(seed)
+    cur.execute("CREATE TEMP TABLE bench_blobs (n int PRIMARY KEY, storage_key text, suffix text) ON COMMIT DROP")
+    for n in range(count):
+        data = rng.randbytes(size)
+        suffix = (".pdf", ".zip", ".pptx", ".mp4")[n % 4]
+        digest = hashlib.sha256(data).hexdigest()
+        key = make_key(digest, "x" + suffix)
+        path = path_of(key)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+        cur.execute("""
+            INSERT INTO blobs (storage_key, sha256, size, refcount, preview_status)
+            VALUES (%s, %s, %s, 0, 'skipped') ON CONFLICT (storage_key) DO NOTHING
+        """, (key, digest, size))
+        cur.execute("INSERT INTO bench_blobs VALUES (%s, %s, %s)", (n, key, suffix))
+
+
+def reset(conn):
+    t = time.perf_counter()
+    for sql in RESET_STEPS:
+        conn.execute(sql, {"prefix": BENCH_PREFIX})
+    conn.commit()
+    print(f"reset: removed previous bench data ({time.perf_counter() - t:.1f}s)")
+
+
+def seed(conn, args):
+    clients = max(1, int(args.users * args.client_ratio))
+    params = {
+        "clients": clients,
+        "freelancers": max(1, args.users - clients),
+        "projects": args.projects,
+        "bids": args.bids,
+        "blob_count": args.blob_count,
+        "password_hash": _hash(BENCH_PASSWORD),  # 全部帳號共用同一個雜湊，不用算幾萬次
+    }
+    with conn.cursor() as cur:
+        cur.execute("SELECT setseed(%s)", ((args.seed % 2_000_000) / 1_000_000 - 1,))
+        write_blobs(cur, args.blob_count, args.blob_size, args.seed)
+        for name, sql in STEPS:
+            t = time.perf_counter()
+            cur.execute(sql, params)
+            print(f"{name:15} {cur.rowcount if cur.rowcount >= 0 else '':>10} rows  {time.perf_counter() - t:6.1f}s")
+    conn.commit()
+
+    conn.autocommit = True  # ANALYZE 讓規劃器馬上知道資料量變了
+    for table in ("users", "projects", "bids", "deliveries", "blobs", "project_counters"):
+        conn.execute(f"ANALYZE {table}")
+    conn.autocommit = False
+    counts = conn.execute("""
+        SELECT (SELECT count(*) FROM users WHERE username LIKE %(p)s),
+               (SELECT count(*) FROM projects p JOIN users u ON u.id = p.client_id WHERE u.username LIKE %(p)s),
+               (SELECT count(*) FROM bids b JOIN users u ON u.id = b.freelancer_id WHERE u.username LIKE %(p)s),
+               (SELECT count(*) FROM deliveries d JOIN users u ON u.id = d.freelancer_id WHERE u.username LIKE %(p)s)
+    """, {"p": BENCH_PREFIX}).fetchone()
+    print("seeded users={} projects={} bids={} deliveries={}".format(*counts))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="產生壓力測試用的假資料（bench_ 開頭）")
+    ap.add_argument("--users", type=int, default=20000)
+    ap.add_argument("--client-ratio", type=float, default=0.3, help="使用者中委託人的比例")
+    ap.add_argument("--projects", type=int, default=100000)
+    ap.add_argument("--bids", type=int, default=1000000, help="想要的報價數（重複的會略過，實際會少一點）")
+    ap.add_argument("--blob-count", type=int, default=16, help="共用的結案檔案實體檔數量")
+    ap.add_argument("--blob-size", type=int, default=256 * 1024)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--reset", action="store_true", help="先刪掉上一次產生的 bench_ 資料")
+    ap.add_argument("--only-reset", action="store_true")
+    args = ap.parse_args()
+
+    with get_conn() as conn:
+        if args.reset:
+            reset(conn)
+        if args.only_reset:
+            return 0
+        exists = conn.execute("SELECT EXISTS (SELECT 1 FROM users WHERE username LIKE %s)", (BENCH_PREFIX,)).fetchone()[0]
+        if exists:
+            print("bench data already exists; run with --reset to regenerate")
+            return 1
+        seed(conn, args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
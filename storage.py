@@ -0,0 +1,150 @@
+# storage.py
+# 結案檔案存放：邊收邊寫到硬碟（不整個讀進記憶體）、同時算 sha256，
+# 以內容雜湊當檔名存放，相同內容只存一份；blobs.refcount 記錄有幾筆 deliveries 在用。
+import hashlib
+import os
+import uuid
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+
+from starlette.concurrency import run_in_threadpool
+
+BASE_DIR = Path(__file__).resolve().parent
+UPLOAD_DIR = BASE_DIR / "www" / "uploads"   # 不對外公開，下載走 downloads.py（/deliveries/<id>/download）
+TMP_DIR = BASE_DIR / ".upload_tmp"          # 寫到一半的檔案（不在 www 底下，不會被看到）
+
+CHUNK_SIZE = 1024 * 1024              # 每次讀寫 1 MB
+MAX_UPLOAD_BYTES = 200 * 1024 * 1024  # 單檔上限 200 MB
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp"}
+PREVIEW_VARIANTS = ("thumb", "preview")   # 縮圖 / 網頁預覽（previews.py 產生）
+
+UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+TMP_DIR.mkdir(parents=True, exist_ok=True)
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+@dataclass
+class StoredFile:
+    storage_key: str   # 相對於 UPLOAD_DIR 的路徑
+    sha256: str
+    size: int
+
+
+def make_key(digest, filename):
+    # 保留副檔名，瀏覽器才知道檔案類型
+    suffix = Path(filename or "").suffix.lower()
+    if not suffix[1:].isalnum() or len(suffix) > 16:
+        suffix = ""
+    return f"cas/{digest[:2]}/{digest}{suffix}"
+
+
+def path_of(storage_key):
+    return UPLOAD_DIR / storage_key
+
+
+def is_image(storage_key):
+    return bool(storage_key) and PurePosixPath(storage_key).suffix.lower() in IMAGE_SUFFIXES
+
+
+def variant_key(storage_key, variant):
+    # 放在原檔旁邊：cas/ab/<sha256>.png -> cas/ab/<sha256>.thumb.webp
+    p = PurePosixPath(storage_key)
+    return str(p.with_name(f"{p.stem}.{variant}.webp"))
+
+
+def _write_chunk(f, hasher, chunk):
+    hasher.update(chunk)
+    f.write(chunk)
+
+
+def _finish(tmp_path, storage_key):
+    # 同內容已經存在就丟掉暫存檔，否則原子地搬到正式位置
+    dest = path_of(storage_key)
+    try:
+        # 已經有同內容：更新修改時間，排隊中的刪檔工作 / 孤兒清理看到最近有人用就不會刪（jobs.py）
+        os.utime(dest)
+        tmp_path.unlink(missing_ok=True)
+        return
+    except FileNotFoundError:
+        pass
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp_path, dest)
+
+
+async def save_upload(file, max_bytes=MAX_UPLOAD_BYTES):
+    """
+    把 UploadFile 以 CHUNK_SIZE 為單位寫進暫存檔（磁碟 IO 與雜湊都丟到 threadpool），
+    寫完依 sha256 搬到 cas/ 底下。超過 max_bytes 會丟 UploadTooLarge，暫存檔自動清掉。
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise UploadTooLarge()
+
+    tmp_path = TMP_DIR / uuid.uuid4().hex
+    hasher = hashlib.sha256()
+    size = 0
+    f = await run_in_threadpool(open, tmp_path, "wb")
+    try:
+        while True:
+            chunk = await file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge()
+            await run_in_threadpool(_write_chunk, f, hasher, chunk)
+        await run_in_threadpool(f.close)
+    except BaseException:
+        await run_in_threadpool(f.close)
+        await run_in_threadpool(tmp_path.unlink, True)
+        raise
+
+    digest = hasher.hexdigest()
+    key = make_key(digest, file.filename)
+    await run_in_threadpool(_finish, tmp_path, key)
+    return StoredFile(key, digest, size)
+
+
+async def add_ref(cur, stored):
+    # 新增一筆 deliveries 之前呼叫（deliveries.storage_key 有外鍵指向 blobs）
+    # 不是圖片的不會有縮圖，直接標 skipped（NULL 只留給還沒做的圖片）
+    await cur.execute("""
+        INSERT INTO blobs (storage_key, sha256, size, refcount, preview_status)
+        VALUES (%s, %s, %s, 1, %s)
+        ON CONFLICT (storage_key) DO UPDATE SET refcount = blobs.refcount + 1
+    """, (stored.storage_key, stored.sha256, stored.size, None if is_image(stored.storage_key) else "skipped"))
+
+
+async def release(cur, storage_keys):
+    """
+    deliveries 刪掉之後呼叫：每個 key 扣一次引用（同一個 key 出現兩次就扣兩次）。
+    回傳已經沒人用、可以刪檔的 key；實際刪檔交給背景工作（jobs.py 的 remove_files），跟這個交易一起 commit。
+    """
+    keys = [k for k in storage_keys if k]
+    if not keys:
+        return []
+    await cur.execute("""
+        UPDATE blobs b SET refcount = b.refcount - d.n
+        FROM (SELECT k, count(*) AS n FROM unnest(%s::text[]) AS k GROUP BY k) d
+        WHERE b.storage_key = d.k
+    """, (keys,))
+    await cur.execute("""
+        DELETE FROM blobs WHERE storage_key = ANY(%s) AND refcount <= 0
+        RETURNING storage_key
+    """, (keys,))
+    return [r[0] for r in await cur.fetchall()]
+
+
+def remove_files(storage_keys=(), legacy_names=()):
+    # 同步刪檔；路由裡不要直接呼叫，改排 jobs.py 的 remove_files 背景工作
+    for key in storage_keys:
+        path_of(key).unlink(missing_ok=True)
+        for variant in PREVIEW_VARIANTS:
+            path_of(variant_key(key, variant)).unlink(missing_ok=True)
+    for name in legacy_names:  # 舊資料：直接放在 uploads/<原始檔名>
+        p = UPLOAD_DIR / name
+        if p.parent == UPLOAD_DIR:
+            p.unlink(missing_ok=True)
@@ -0,0 +1,259 @@
+# transitions.py
+# 專案狀態轉換（狀態機）：每個動作都是「一句」有條件的 UPDATE / DELETE ... WHERE status=... RETURNING，
+# 擁有者、目前狀態、報價是否屬於這個專案都寫在 WHERE 裡，由資料庫一次判斷並上鎖，
+# 同時按兩次或兩個人同時按，只會有一個成功（不再是先 SELECT 再用 Python 判斷、再另外 UPDATE）。
+#
+#   open ──award──▶ in_progress ──close──▶ closed
+#     │                 │  ▲
+#   edit / delete    reject │ 重新上傳（app.py upload_delivery）
+#     （無報價時）        ▼  │
+#                      reopened
+#
+# 函式只送 SQL、不 commit（跟 jobs.enqueue 一樣由路由決定何時 commit）；回傳 Result，失敗時 reason 說明原因。
+#   python transitions.py check [-n 20]   並行壓測：同一個專案同時搶著選標 / 結案 / 退件，檢查只有一個成功、計數表正確
+import argparse
+import asyncio
+import sys
+from dataclasses import dataclass
+from typing import Optional
+
+# 失敗原因
+NOT_FOUND = "not_found"      # 專案不存在
+FORBIDDEN = "forbidden"      # 不是這個專案的委託人
+WRONG_STATE = "wrong_state"  # 目前狀態不能做這個動作
+HAS_BIDS = "has_bids"        # 已有報價，不能編輯 / 刪除
+BAD_BID = "bad_bid"          # 報價不存在或不是這個專案的
+CONFLICT = "conflict"        # 看起來可以，但同時有別人先改了（重新整理再試）
+
+
+@dataclass(frozen=True)
+class Result:
+    ok: bool
+    reason: Optional[str] = None  # 失敗原因（上面的常數）
+    status: Optional[str] = None  # 成功：新狀態；失敗：目前狀態（專案不存在是 None）
+
+    def __bool__(self):
+        return self.ok
+
+
+# 一句 SQL 做完：done 是真正的修改（條件不符就 0 列），target 是同一個快照裡的專案現況，
+# 只在失敗時用來說明原因，不用再多一趟查詢
+_TEMPLATE = """
+    WITH done AS ({mutation}),
+    target AS (
+        SELECT client_id, status,
+               EXISTS (SELECT 1 FROM bids WHERE project_id = %(pid)s) AS has_bids,
+               (SELECT project_id FROM bids WHERE id = %(bid)s) AS bid_project
+        FROM projects WHERE id = %(pid)s
+    )
+    SELECT (SELECT count(*) FROM done), t.client_id, t.status, t.has_bids, t.bid_project
+    FROM (SELECT 1) one LEFT JOIN target t ON true
+"""
+
+_AWARD = """
+    UPDATE projects p SET awarded_bid_id = b.id, status = 'in_progress'
+    FROM bids b
+    WHERE p.id = %(pid)s AND p.client_id = %(uid)s AND p.status = 'open'
+      AND b.id = %(bid)s AND b.project_id = p.id
+    RETURNING p.id
+"""
+_CLOSE = """
+    UPDATE projects SET status = 'closed', closed_at = now()
+    WHERE id = %(pid)s AND client_id = %(uid)s AND status = 'in_progress'
+    RETURNING id
+"""
+_REJECT = """
+    UPDATE projects SET status = 'reopened'
+    WHERE id = %(pid)s AND client_id = %(uid)s AND status = 'in_progress'
+    RETURNING id
+"""
+_EDIT = """
+    UPDATE projects SET title = %(title)s, description = %(description)s
+    WHERE id = %(pid)s AND client_id = %(uid)s AND status = 'open'
+      AND NOT EXISTS (SELECT 1 FROM bids WHERE project_id = %(pid)s)
+    RETURNING id
+"""
+_DELETE = """
+    DELETE FROM projects
+    WHERE id = %(pid)s AND client_id = %(uid)s AND status = 'open'
+      AND NOT EXISTS (SELECT 1 FROM bids WHERE project_id = %(pid)s)
+    RETURNING id
+"""
+
+
+async def _run(cur, mutation, params, uid, from_status, to_status, check_bids=False, bid=None):
+    params = {"bid": bid, **params}
+    await cur.execute(_TEMPLATE.format(mutation=mutation), params)
+    changed, client_id, status, has_bids, bid_project = await cur.fetchone()
+    if changed:
+        return Result(True, status=to_status)
+    # 失敗：依序找原因
+    if client_id is None:
+        reason = NOT_FOUND
+    elif client_id != uid:
+        reason = FORBIDDEN
+    elif status != from_status:
+        reason = WRONG_STATE
+    elif check_bids and has_bids:
+        reason = HAS_BIDS
+    elif bid is not None and bid_project != params["pid"]:
+        reason = BAD_BID
+    else:
+        reason = CONFLICT
+    return Result(False, reason, status)
+
+
+async def award(cur, project_id, user_id, bid_id):
+    """選標：open → in_progress，報價必須屬於這個專案"""
+    return await _run(cur, _AWARD, {"pid": project_id, "uid": user_id}, user_id,
+                      "open", "in_progress", bid=bid_id)
+
+
+async def close(cur, project_id, user_id):
+    """結案：in_progress → closed"""
+    return await _run(cur, _CLOSE, {"pid": project_id, "uid": user_id}, user_id, "in_progress", "closed")
+
+
+async def reject(cur, project_id, user_id):
+    """退件：in_progress → reopened（結案檔案由呼叫端在同一個交易裡刪）"""
+    return await _run(cur, _REJECT, {"pid": project_id, "uid": user_id}, user_id, "in_progress", "reopened")
+
+
+async def edit(cur, project_id, user_id, title, description):
+    """編輯標題 / 內容：只限 open 且還沒有報價"""
+    return await _run(cur, _EDIT, {"pid": project_id, "uid": user_id, "title": title, "description": description},
+                      user_id, "open", "open", check_bids=True)
+
+
+async def delete(cur, project_id, user_id):
+    """刪除：只限 open 且還沒有報價"""
+    return await _run(cur, _DELETE, {"pid": project_id, "uid": user_id}, user_id, "open", None, check_bids=True)
+
+
+# ----------------
+# 並行壓測
+# ----------------
+async def _attempt(fn, *args):
+    # 每個嘗試用自己的連線、自己的交易，跟真的同時有好幾個 request 一樣
+    import db
+    async with db.connection() as conn:
+        async with conn.cursor() as cur:
+            result = await fn(cur, *args)
+        await conn.commit()
+    return result
+
+
+async def _check(rounds, width):
+    import db
+
+    await db.open_async_pool()
+    problems = []
+    try:
+        async with db.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                    INSERT INTO users (username, password_hash, role, full_name, agreed_privacy)
+                    VALUES ('_tx_client', '-', 'client', 'tx check', true),
+                           ('_tx_other', '-', 'client', 'tx check', true)
+                    RETURNING id
+                """)
+                client, other = [r[0] for r in await cur.fetchall()]
+                await cur.execute("""
+                    INSERT INTO users (username, password_hash, role, full_name, agreed_privacy)
+                    SELECT '_tx_free_' || i, '-', 'freelancer', 'tx check', true FROM generate_series(1, %s) i
+                    RETURNING id
+                """, (width,))
+                freelancers = [r[0] for r in await cur.fetchall()]
+            await conn.commit()
+
+        for n in range(rounds):
+            async with db.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute("""
+                        INSERT INTO projects (title, description, client_id, status)
+                        VALUES (%s, 'tx check', %s, 'open'), ('_tx_foreign', 'tx check', %s, 'open')
+                        RETURNING id
+                    """, (f"_tx_{n}", client, other))
+                    pid, foreign = [r[0] for r in await cur.fetchall()]
+                    await cur.execute("""
+                        INSERT INTO bids (project_id, freelancer_id, price, message)
+                        SELECT %s, f, 100, '' FROM unnest(%s::int[]) f
+                        RETURNING id
+                    """, (pid, freelancers))
+                    bids = [r[0] for r in await cur.fetchall()]
+                    await cur.execute("""
+                        INSERT INTO bids (project_id, freelancer_id, price, message)
+                        VALUES (%s, %s, 1, '') RETURNING id
+                    """, (foreign, freelancers[0]))
+                    foreign_bid = (await cur.fetchone())[0]
+                await conn.commit()
+
+            # 1) 同時選不同的標 + 別人的報價 + 不是委託人：只能有一個成功
+            results = await asyncio.gather(
+                *(_attempt(award, pid, client, b) for b in bids),
+                _attempt(award, pid, client, foreign_bid),
+                _attempt(award, pid, other, bids[0]),
+                _attempt(delete, pid, client),
+            )
+            wins = [r for r in results if r.ok]
+            if len(wins) != 1:
+                problems.append(f"round {n}: {len(wins)} awards succeeded")
+            if results[width].reason not in (BAD_BID, WRONG_STATE):
+                problems.append(f"round {n}: foreign bid gave {results[width]}")
+            if results[width + 1].reason != FORBIDDEN:
+                problems.append(f"round {n}: other client gave {results[width + 1]}")
+
+            # 2) 同時結案和退件：只能有一個成功
+            results = await asyncio.gather(*(_attempt(close if i % 2 else reject, pid, client)
+                                             for i in range(width)))
+            if sum(r.ok for r in results) != 1:
+                problems.append(f"round {n}: {sum(r.ok for r in results)} of close/reject succeeded")
+
+            async with db.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute("""
+                        SELECT p.status, b.project_id FROM projects p LEFT JOIN bids b ON b.id = p.awarded_bid_id
+                        WHERE p.id = %s
+                    """, (pid,))
+                    status, awarded_project = await cur.fetchone()
+            if status not in ("closed", "reopened") or awarded_project != pid:
+                problems.append(f"round {n}: ended as {status} with bid of project {awarded_project}")
+    finally:
+        async with db.connection() as conn:
+            await conn.execute("""
+                DELETE FROM projects WHERE client_id IN (SELECT id FROM users WHERE username LIKE '\\_tx\\_%')
+            """)  # 報價跟著 cascade
+            await conn.execute("DELETE FROM users WHERE username LIKE '\\_tx\\_%'")
+            await conn.commit()
+        await db.close_async_pool()
+    return problems
+
+
+def check(rounds, width):
+    import counters
+    from db import get_conn
+
+    problems = asyncio.run(_check(rounds, width))
+    with get_conn() as conn:
+        mismatches = counters.diff(conn)
+    if mismatches:
+        problems.append(f"project_counters out of sync: {mismatches[:5]}")
+    for p in problems:
+        print("FAIL", p)
+    if not problems:
+        print(f"transitions OK ({rounds} rounds, {width} concurrent attempts each)")
+    return 1 if problems else 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="專案狀態轉換")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("check", help="並行壓測狀態轉換")
+    c.add_argument("-n", "--rounds", type=int, default=20)
+    c.add_argument("-w", "--width", type=int, default=8, help="每一輪同時送幾個請求")
+    args = ap.parse_args()
+    return check(args.rounds, args.width)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+// live.js：即時更新（events.py 的 /events，Server-Sent Events）
+// 有新報價、選標、上傳結案檔案、結案、退件時，重新抓一次目前的頁面，原地換掉 <main> 的內容；
+// 正在填表單時不直接換（會把打到一半的字洗掉），改成跳提示讓使用者自己重新整理。
+(function () {
+  if (!window.EventSource || !('live' in document.body.dataset)) return;  // 只有首頁和專案頁開
+
+  const EVENTS = ['bid_created', 'project_awarded', 'delivery_uploaded', 'project_closed', 'project_rejected', 'resync'];
+  const project = document.body.dataset.liveProject;
+  const source = new EventSource('/events' + (project ? '?project=' + encodeURIComponent(project) : ''));
+  let timer = null, loading = false, again = false;
+
+  function editing(main) {
+    const el = document.activeElement;
+    if (el && main.contains(el) && /^(INPUT|TEXTAREA|SELECT)$/.test(el.tagName)) return true;
+    return [...main.querySelectorAll('textarea, input[type=text], input[type=number], input[type=file]')]
+      .some(f => f.value);
+  }
+
+  function refresh() {
+    const main = document.querySelector('main');
+    if (!main) return;
+    if (loading) { again = true; return; }
+    if (editing(main)) { showNotice('🔔 這個頁面有新的更新，重新整理即可看到。', 'success'); return; }
+    loading = true;
+    fetch(location.href, { credentials: 'same-origin', headers: { 'X-Read-Primary': '1' } })  // 剛收到事件，複本可能還沒追上
+      .then(r => (r.ok && !r.redirected) ? r.text() : null)  // 專案被刪之類的就不動
+      .then(html => {
+        if (!html) return;
+        const fresh = new DOMParser().parseFromString(html, 'text/html').querySelector('main');
+        if (fresh) main.innerHTML = fresh.innerHTML;
+      })
+      .catch(() => {})
+      .finally(() => { loading = false; if (again) { again = false; refresh(); } });
+  }
+
+  // 同時來好幾個事件（例如一次很多報價）只重抓一次
+  function schedule() { clearTimeout(timer); timer = setTimeout(refresh, 300); }
+  EVENTS.forEach(name => source.addEventListener(name, schedule));
+  window.addEventListener('pagehide', () => source.close());
+})();